@@ -4,6 +4,16 @@
 # - conf/settings.py in the git checkout
 # - ~/.config/testcloud/settings.py
 # - /etc/testcloud/settings.py
+# or point the TESTCLOUD_CONFIG environment variable at it.
+#
+# Any value can also be overridden for a single run through an environment
+# variable named TESTCLOUD_<NAME>, like TESTCLOUD_RAM=2048 or
+# TESTCLOUD_DATA_DIR=/tmp/job1. Lists and dicts are given as python literals,
+# like TESTCLOUD_HOSTS="['qemu:///system']".
+#
+# The values of this file are kept in a snapshot in ~/.cache/testcloud, which
+# is used instead of executing the file again until it is modified. Values
+# computed from anything but this file aren't picked up until then.
 
 
 #DOWNLOAD_PROGRESS = True
@@ -14,6 +24,22 @@
 
 #DATA_DIR = "/var/lib/testcloud/"
 #STORE_DIR = "/var/lib/testcloud/backingstores"
+# tmpfs directory holding the disks of ephemeral instances
+#EPHEMERAL_DIR = "/dev/shm/testcloud"
+# kernels and initrds extracted from images for direct kernel boot
+#KERNEL_DIR = "/var/lib/testcloud/kernels"
+
+## testcloudd ##
+# Socket of the optional testcloudd daemon ('testcloudd'), which keeps libvirt
+# connections open. The CLI sends list, start, stop and remove through it
+# whenever it runs, and works on its own otherwise.
+#DAEMON_SOCKET = "/var/lib/testcloud/testcloudd.sock"
+
+## Domain XML ##
+# Write a copy of the domain XML of new instances to
+# DATA_DIR/instances/<name>/<name>-domain.xml. libvirt gets the XML directly,
+# the copy is only for reference; disable it to skip the write.
+#KEEP_DOMAIN_XML = True
 
 
 ## Data for cloud-init ##
@@ -45,14 +71,199 @@
 
 #CMD_LINE_ARGS = []
 
+# Boot the kernel and initrd of the image directly, skipping firmware and the
+# bootloader. They are extracted once per image. The root device in the kernel
+# command line must match the image being booted.
+#DIRECT_KERNEL_BOOT = False
+#KERNEL_CMDLINE = ("root=/dev/vda1 ro console=tty1 console=ttyS0,115200n8 "
+#                  "no_timer_check net.ifnames=0 quiet")
+
 # The timeout, in seconds, to wait for an instance to boot before
 # failing the boot process. Setting this to 0 disables waiting and
 # returns immediately after starting the boot process.
 #BOOT_TIMEOUT = 30
 
+# Add a qemu guest agent channel to new instances. The agent is then used to
+# detect the end of the boot, to find the IP and for 'instance exec'. The image
+# must run qemu-guest-agent.
+#GUEST_AGENT = False
+
+# Sharing host directories with 'instance create --share': the driver is
+# 'virtiofs', '9p' or 'auto' (virtiofs if the hypervisor supports it). Shares
+# are mounted in the guest under SHARE_MOUNT_DIR/<tag> with a cloud-config
+# 'mounts' section appended to USER_DATA. Read-only (':ro') virtiofs shares
+# need a libvirt supporting them, use '9p' with older ones.
+#SHARE_DRIVER = 'auto'
+#SHARE_MOUNT_DIR = '/mnt'
+
+# Pool of libvirt connection uris new instances are scheduled on when no
+# '--connection' is given. Each instance goes to the host running the fewest
+# domains which has enough free memory and stays there. All hosts need to see
+# DATA_DIR at the same path (shared storage), as the disks are created in it.
+#HOSTS = ['qemu:///system', 'qemu+ssh://root@hypervisor2/system']
+
+# libvirt network instances are attached to. With STATIC_ADDRESSES, every
+# instance gets an IP from the DHCP range of the network reserved for its MAC
+# (registered in DATA_DIR/addresses.json) before it is defined, so its IP is
+# known without waiting for it to boot. This edits the DHCP host entries of
+# the network, including its persistent definition, every reservation is
+# removed again with its instance.
+#NETWORK = 'default'
+#STATIC_ADDRESSES = False
+
+# Instances of a group ('instance create --group <group>') get a NAT network of
+# their own, GROUP_NETWORK_PREFIX<group>, on the first /24 of NETWORK_POOL not
+# used by any other libvirt network. It is removed with the last instance.
+#DEFAULT_GROUP = None
+#GROUP_NETWORK_PREFIX = 'testcloud-'
+#NETWORK_POOL = '10.123.0.0/16'
+
+# SSH access to instances for 'instance exec'. Without SSH_KEY, PASSWORD is
+# used through sshpass. Keys have to be injected into the instances, e.g. with
+# ssh_authorized_keys in USER_DATA. Connections are kept open for
+# SSH_CONTROL_PERSIST seconds after the last command and shared by all commands.
+#SSH_USER = 'fedora'
+#SSH_KEY = None
+#SSH_CONTROL_PERSIST = 600
+# maximum number of instances running a command at once
+#SSH_WORKERS = 16
+
+# Regular expressions matched against the serial console output of a booting
+# instance, the instance is up as soon as one of them matches. The console
+# output is kept in <instance dir>/<instance name>-console.log. With no
+# markers, the instance is considered up once it has a network interface.
+# Only images logging to the serial console (console=ttyS0) can use markers.
+#BOOT_READY_MARKERS = []
+#BOOT_READY_MARKERS = [r'Cloud-init v\. \S+ finished at']
+
 # ram size, in MiB
 #RAM = 512
 
 # Desired size, in GiB of instance disks. 0 leaves disk capacity
 # identical to source image
 #DISK_SIZE = 0
+
+## Domain profiles ##
+# Profiles tune the libvirt domain for throughput and are selected per instance
+# with 'testcloud instance create --profile <name>'. Every profile inherits the
+# values of the 'default' profile, which reproduces the historic domain setup.
+# Shipped profiles are 'default', 'performance', 'hugepages' (needs hugepages
+# reserved on the host) and 'density'. They stay available when PROFILES is
+# set, which only needs to list new profiles and those it changes.
+
+#DEFAULT_PROFILE = 'default'
+#PROFILES = {
+#    'default': {
+#        'vcpus': 1,
+#        'cpu_mode': 'custom',  # 'custom' (kvm64) or 'host-passthrough'
+#        'net_model': 'rtl8139',
+#        'net_queues': 0,  # virtio-net multiqueue, 0 disables it
+#        'disk_cache': None,  # e.g. 'none', 'writeback'
+#        'disk_io': None,  # e.g. 'native', 'threads', 'io_uring'
+#        'disk_discard': None,  # e.g. 'unmap'
+#        # qcow2 options of the overlay disk: cluster size (e.g. '128k'),
+#        # preallocation (e.g. 'metadata', needs extended L2 entries),
+#        # lazy refcounts and extended L2 entries (sub-cluster allocation,
+#        # needs qemu 5.2). Larger clusters with extended L2 entries need less
+#        # metadata for the same disk and still allocate in small steps.
+#        'disk_cluster_size': None,
+#        'disk_preallocation': None,
+#        'disk_lazy_refcounts': False,
+#        'disk_extended_l2': False,
+#        # maximum size of the qcow2 metadata (L2 and refcount) cache of qemu
+#        # for the disk, in bytes, None keeps the qemu default. 1 MiB of L2
+#        # cache covers 8 GiB of disk with 64k clusters. Needs libvirt 7.0.
+#        'disk_metadata_cache': None,
+#        'iothreads': 0,
+#        'rng': False,  # virtio-rng fed from /dev/urandom
+#        'hugepages': False,
+#        # guest memory may be merged with identical pages by host KSM
+#        'ksm': True,
+#        # seconds between guest balloon statistics updates, 0 disables them
+#        'balloon_stats': 0,
+#        # hand memory freed by the guest back to the host
+#        'free_page_reporting': False,
+#        # QoS limits, by the names of the libvirt parameters: iotune of the
+#        # disk ('total_bytes_sec', 'read_iops_sec', '..._max' for bursts and
+#        # '..._max_length' for their length in seconds), 'cpu_shares',
+#        # 'vcpu_period' and 'vcpu_quota' (in microseconds per vCPU) and the
+#        # network bandwidth in KiB/s ('inbound.average', 'outbound.peak', ...)
+#        'qos': {},
+#    },
+#    'performance': {
+#        'vcpus': 2,
+#        'cpu_mode': 'host-passthrough',
+#        'net_model': 'virtio',
+#        'net_queues': 2,
+#        'disk_cache': 'none',
+#        'disk_io': 'io_uring',
+#        'disk_discard': 'unmap',
+#        'disk_lazy_refcounts': True,
+#        'iothreads': 1,
+#        'rng': True,
+#        'ksm': False,
+#    },
+#    'density': {
+#        'net_model': 'virtio',
+#        'rng': True,
+#        'ksm': True,
+#        'balloon_stats': 5,
+#        'free_page_reporting': True,
+#    },
+#    # keeps busy instances from starving the others on a shared host
+#    'shared': {
+#        'qos': {'total_iops_sec': 500, 'total_iops_sec_max': 2000,
+#                'total_iops_sec_max_length': 10, 'total_bytes_sec': 50 * 1024 ** 2,
+#                'cpu_shares': 512, 'vcpu_period': 100000, 'vcpu_quota': 50000,
+#                'inbound.average': 10240, 'outbound.average': 10240},
+#    },
+#}
+
+# Pin the vCPUs and bind the memory of new instances to the least loaded host
+# NUMA node. Placements are recorded in the instance metadata.
+#NUMA_PLACEMENT = False
+
+## Admission control ##
+# Queue instance boots until the host has enough free memory and CPU for them
+# and allow at most MAX_BOOTING instances in the boot phase at once. The queue
+# is shared by all testcloud processes on the host.
+#ADMISSION_CONTROL = False
+#MAX_BOOTING = 4
+# memory, in MiB, always kept free for the host
+#ADMISSION_RESERVED_RAM = 1024
+# running vCPUs allowed per host CPU
+#ADMISSION_CPU_RATIO = 4
+# seconds to wait for admission and between resource checks
+#ADMISSION_TIMEOUT = 600
+#ADMISSION_POLL = 2
+
+## Memory density ##
+# 'testcloud instance density' shrinks instances using a profile with
+# balloon_stats (like 'density') towards their working set plus headroom (a
+# fraction of it), never below DENSITY_MIN_RAM MiB, and grows them back under
+# memory pressure. Changes smaller than DENSITY_STEP MiB are not applied.
+#DENSITY_MIN_RAM = 256
+#DENSITY_HEADROOM = 0.25
+#DENSITY_STEP = 32
+#DENSITY_INTERVAL = 10
+
+## Idle policy ##
+# 'testcloud instance idle' puts instances using at most IDLE_CPU of a host CPU
+# and IDLE_IO bytes per second of disk and network I/O for IDLE_TIMEOUT seconds
+# to rest: 'suspend' pauses them in memory, 'save' hibernates them to disk and
+# frees their memory. 'testcloud instance start' wakes them up again.
+#IDLE_ACTION = 'suspend'
+#IDLE_TIMEOUT = 1800
+#IDLE_CPU = 0.05
+#IDLE_IO = 65536
+#IDLE_INTERVAL = 60
+
+## Reaper ##
+# 'testcloud instance reap' removes instances DEFAULT_TTL seconds after their
+# creation (0 keeps them, override with 'create --ttl'), instance directories
+# whose domain is gone, ephemeral disks without an instance and domains using
+# disks of removed instances. Anything touched within the last REAPER_GRACE
+# seconds is left alone, it may belong to an instance being created.
+#DEFAULT_TTL = 0
+#REAPER_GRACE = 600
+#REAPER_INTERVAL = 300
@@ -46,7 +46,8 @@ setup(name='testcloud',
       package_dir={"testcloud": "testcloud"},
       include_package_data=True,
       cmdclass={'test': PyTest},
-      entry_points=dict(console_scripts=["testcloud=testcloud.cli:main"]),
+      entry_points=dict(console_scripts=["testcloud=testcloud.cli:main",
+                                         "testcloudd=testcloud.daemon:main"]),
       install_requires=[
           'Jinja2',
           'libvirt-python',
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+"""Functional test of cloning a running instance against a real libvirt. Needs
+libvirt, root and an image with ``qemu-guest-agent`` installed, given by URL in
+``TESTCLOUD_CLONE_IMAGE``::
+
+    TESTCLOUD_CLONE_IMAGE=file:///images/fedora.qcow2 \\
+        py.test test/functest_clone.py
+"""
+
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from testcloud import cli, config, image, instance
+
+CLONE_IMAGE = os.environ.get('TESTCLOUD_CLONE_IMAGE')
+
+pytestmark = pytest.mark.skipif(CLONE_IMAGE is None, reason="TESTCLOUD_CLONE_IMAGE is not set")
+
+
+@pytest.fixture
+def running_instance():
+    tc_image = image.Image(CLONE_IMAGE)
+    tc_image.prepare()
+
+    tc_instance = instance.Instance('testcloud-clone', image=tc_image)
+    tc_instance.guest_agent = True
+    tc_instance.prepare()
+    tc_instance.spawn_vm()
+    tc_instance.start()
+
+    yield tc_instance
+
+    tc_instance.remove(autostop=True)
+
+
+def _mac(tc_instance):
+    root = ET.fromstring(tc_instance._get_domain().XMLDesc(0))
+    return root.find('./devices/interface/mac').get('address')
+
+
+def test_clone_running(running_instance):
+    names = ['testcloud-clone-1', 'testcloud-clone-2']
+    try:
+        tc_clones = running_instance.clone(names)
+
+        assert instance._find_domain(running_instance.name,
+                                     running_instance.connection) == 'running'
+        macs = set([_mac(running_instance)])
+        ips = set([cli.find_vm_ip(running_instance.name)])
+        for tc_clone in tc_clones:
+            assert instance._find_domain(tc_clone.name, tc_clone.connection) == 'running'
+            # the clones boot from the frozen disk
+            assert tc_clone._wait_for_agent(tc_clone._get_domain(),
+                                            config.get_config().BOOT_TIMEOUT)
+            exitcode, _, _ = tc_clone.guest_exec(['true'])
+            assert exitcode == 0
+            macs.add(_mac(tc_clone))
+            ips.add(cli.find_vm_ip(tc_clone.name))
+
+        assert len(macs) == len(ips) == 1 + len(names)
+    finally:
+        for name in names:
+            tc_clone = instance.find_instance(name)
+            if tc_clone is not None:
+                tc_clone.remove(autostop=True)
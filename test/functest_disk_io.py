@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+"""Benchmark of guest disk I/O with different overlay disk options, using fio
+in real instances. Needs libvirt, root and an image with ``fio`` and
+``qemu-guest-agent`` installed, given by URL in ``TESTCLOUD_FIO_IMAGE``::
+
+    TESTCLOUD_FIO_IMAGE=file:///images/fedora-fio.qcow2 \\
+        py.test -s test/functest_disk_io.py
+
+The fio results of every profile are printed, compare them with ``-s``.
+"""
+
+import os
+import json
+
+import pytest
+
+from testcloud import image, instance
+
+FIO_IMAGE = os.environ.get('TESTCLOUD_FIO_IMAGE')
+
+#: profiles to compare, on top of the default profile
+PROFILES = {
+    'fio-baseline': {},
+    'fio-tuned': {
+        'disk_cluster_size': '128k',
+        'disk_extended_l2': True,
+        'disk_preallocation': 'metadata',
+        'disk_lazy_refcounts': True,
+        'disk_metadata_cache': 4 * 1024 * 1024,
+    },
+}
+
+#: fio jobs, by name
+FIO_JOBS = {
+    # first writes to the overlay, allocating clusters
+    'randwrite-4k': ['--rw=randwrite', '--bs=4k', '--iodepth=16'],
+    'randread-4k': ['--rw=randread', '--bs=4k', '--iodepth=16'],
+    # like package installs and image builds
+    'write-1m': ['--rw=write', '--bs=1M', '--iodepth=4'],
+}
+
+FIO_COMMAND = ['fio', '--filename=/var/tmp/fio.dat', '--size=2G', '--ioengine=libaio',
+               '--direct=1', '--runtime=30', '--time_based', '--output-format=json']
+
+
+@pytest.fixture(scope='module')
+def fio_image():
+    tc_image = image.Image(FIO_IMAGE)
+    tc_image.prepare()
+    return tc_image
+
+
+@pytest.mark.skipif(FIO_IMAGE is None, reason="TESTCLOUD_FIO_IMAGE is not set")
+@pytest.mark.parametrize('profile', sorted(PROFILES))
+def test_fio(profile, fio_image, monkeypatch):
+    monkeypatch.setitem(instance.config_data.PROFILES, profile, PROFILES[profile])
+    tc_instance = instance.Instance('testcloud-{}'.format(profile), image=fio_image)
+    tc_instance.profile = profile
+    tc_instance.guest_agent = True
+
+    try:
+        tc_instance.prepare()
+        tc_instance.spawn_vm()
+        tc_instance.start()
+
+        for job, options in sorted(FIO_JOBS.items()):
+            exitcode, stdout, stderr = tc_instance.guest_exec(
+                FIO_COMMAND + ['--name={}'.format(job)] + options)
+            assert exitcode == 0, stderr
+
+            result = json.loads(stdout.decode('utf-8'))['jobs'][0]
+            print("{:<14} {:<14} read {:>9.0f} IOPS {:>8.1f} MiB/s  write {:>9.0f} IOPS "
+                  "{:>8.1f} MiB/s".format(profile, job, result['read']['iops'],
+                                          result['read']['bw'] / 1024.0,
+                                          result['write']['iops'],
+                                          result['write']['bw'] / 1024.0))
+    finally:
+        tc_instance.remove(autostop=True)
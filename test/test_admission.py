@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+""" This module is for testing the behaviour of admission control."""
+
+import mock
+import pytest
+
+from testcloud import admission, config, exceptions
+
+
+def _stub_conn(free_mib=4096, cpus=4, running_vcpus=0):
+    stub_domain = mock.Mock()
+    stub_domain.isActive.return_value = True
+    stub_domain.info.return_value = [1, 0, 0, running_vcpus, 0]
+
+    stub_conn = mock.Mock()
+    stub_conn.getFreeMemory.return_value = free_mib * 1024 * 1024
+    stub_conn.getInfo.return_value = ['x86_64', 8192, cpus, 2000, 1, 1, cpus, 1]
+    stub_conn.listAllDomains.return_value = [stub_domain]
+    return stub_conn
+
+
+class TestAdmission(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+        self.conf.ADMISSION_CONTROL = True
+        self.conf.ADMISSION_RESERVED_RAM = 1024
+        self.conf.ADMISSION_CPU_RATIO = 1
+        self.conf.ADMISSION_POLL = 0
+
+    def test_fits(self, monkeypatch):
+        monkeypatch.setattr(admission, 'config_data', self.conf)
+
+        assert admission.fits(_stub_conn(), 2048, 1)
+
+    def test_not_enough_memory(self, monkeypatch):
+        monkeypatch.setattr(admission, 'config_data', self.conf)
+
+        assert not admission.fits(_stub_conn(), 2048, 1, booting_ram=2048)
+
+    def test_not_enough_cpu(self, monkeypatch):
+        monkeypatch.setattr(admission, 'config_data', self.conf)
+
+        assert not admission.fits(_stub_conn(running_vcpus=4), 512, 1)
+
+    def test_admit_claims_slot(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        monkeypatch.setattr(admission, 'config_data', self.conf)
+        slot_dir = '{}/admission'.format(tmpdir)
+
+        with admission.admit(_stub_conn(), 512):
+            assert admission._booting_ram(slot_dir) == 512
+
+        assert admission._booting_ram(slot_dir) == 0
+
+    def test_admit_timeout(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        monkeypatch.setattr(admission, 'config_data', self.conf)
+
+        with pytest.raises(exceptions.TestcloudInstanceError):
+            with admission.admit(_stub_conn(free_mib=512), 512, timeout=0):
+                pass
@@ -6,6 +6,24 @@
 
 """ This module is for testing the behaviour of cli functions."""
 
+import os
+import sys
+import subprocess
+
+import pytest
+
+from testcloud import cli
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(*args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([REPO_DIR] + [path for path in
+                                                      [env.get('PYTHONPATH')] if path])
+    return subprocess.check_output([sys.executable] + list(args), env=env,
+                                   stderr=subprocess.STDOUT).decode('utf-8')
+
 
 class TestCLI:
     def test_run(self):
@@ -13,3 +31,55 @@ class TestCLI:
 
     def test_main(self):
         pass
+
+
+class TestExecArgs(object):
+
+    def test_all_with_command(self):
+        args = cli.parse_args(['instance', 'exec', '--all', '--', 'uname', '-a'])
+
+        assert args.all and args.name is None
+        assert args.command == ['uname', '-a']
+
+    def test_all_with_single_word_command(self):
+        args = cli.parse_args(['instance', 'exec', '--all', '--', 'ls'])
+
+        assert args.all and args.name is None
+        assert args.command == ['ls']
+
+    def test_pattern_with_command(self):
+        args = cli.parse_args(['instance', 'exec', 'web-*', '--', 'ls', '--', '-l'])
+
+        assert not args.all and args.name == 'web-*'
+        assert args.command == ['ls', '--', '-l']
+
+    def test_all_and_name(self):
+        with pytest.raises(SystemExit):
+            cli.parse_args(['instance', 'exec', '--all', 'web-1', '--', 'ls'])
+
+
+class TestStartup(object):
+
+    def test_no_heavy_imports(self):
+        '''The CLI parses its arguments without importing libvirt, jinja2 or
+        requests, only the commands needing them import them.'''
+
+        output = run_python('-c', 'import sys\n'
+                                  'from testcloud import cli\n'
+                                  'cli.get_argparser().parse_args(["image", "list"])\n'
+                                  'print(" ".join(sorted(sys.modules)))')
+
+        loaded = set(output.split())
+        assert loaded.isdisjoint(['libvirt', 'jinja2', 'requests', 'testcloud.instance',
+                                  'testcloud.image'])
+
+    def test_import_is_light(self):
+        '''Importing the CLI loads none of the heavy modules, which make up
+        most of its startup time.'''
+
+        output = run_python('-c', 'import sys\n'
+                                  'import testcloud.cli\n'
+                                  'print(" ".join(sorted(sys.modules)))')
+
+        loaded = set(output.split())
+        assert loaded.isdisjoint(['libvirt', 'jinja2', 'requests'])
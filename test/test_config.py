@@ -4,6 +4,8 @@
 # License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
 # See the LICENSE file for more details on Licensing
 
+import pytest
+
 from testcloud import config
 
 
@@ -16,8 +18,20 @@ STORE_DIR = "{}/backingstores"
 
 class TestConfig(object):
     def setup_method(self, method):
+        self.orig_config = config._config
         config._config = None
 
+    def teardown_method(self, method):
+        # modules read the config lazily, don't leave the test config behind
+        config._config = self.orig_config
+
+    @pytest.fixture(autouse=True)
+    def cache_dir(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(config, 'CACHE_DIR', str(tmpdir.join('cache')))
+        for key in list(config.os.environ):
+            if key.startswith(config.ENV_PREFIX):
+                monkeypatch.delenv(key)
+
     def test_get_config_object(self, monkeypatch):
         '''Simple test to grab a config object, will return default config
         values.
@@ -84,3 +98,76 @@ class TestConfig(object):
         test_config = config.get_config()
 
         assert test_config.DATA_DIR == REF_DATA_DIR
+
+    def test_config_from_environ(self, tmpdir, monkeypatch):
+        '''TESTCLOUD_CONFIG names the config file, skipping the search'''
+
+        ref_conf_filename = str(tmpdir.join('job.py'))
+        with open(ref_conf_filename, 'w+') as ref_conffile:
+            ref_conffile.write(REF_CONF_CONTENTS)
+
+        monkeypatch.setattr(config, 'CONF_DIRS', [])
+        monkeypatch.setenv('TESTCLOUD_CONFIG', ref_conf_filename)
+        test_config = config.get_config()
+
+        assert test_config.DATA_DIR == REF_DATA_DIR
+
+
+class TestConfigSnapshot(object):
+
+    @pytest.fixture(autouse=True)
+    def cache_dir(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(config, 'CACHE_DIR', str(tmpdir.join('cache')))
+
+    def test_snapshot_reused(self, tmpdir, monkeypatch):
+        ref_conf = tmpdir.join(config.CONF_FILE)
+        ref_conf.write(REF_CONF_CONTENTS)
+
+        assert config._load_config_values(str(ref_conf))['DATA_DIR'] == REF_DATA_DIR
+
+        def fail_load(conf_filename):
+            raise AssertionError('config file executed again')
+        monkeypatch.setattr(config, '_load_config', fail_load)
+
+        assert config._load_config_values(str(ref_conf))['DATA_DIR'] == REF_DATA_DIR
+
+    def test_snapshot_invalidated(self, tmpdir):
+        ref_conf = tmpdir.join(config.CONF_FILE)
+        ref_conf.write(REF_CONF_CONTENTS)
+        config._load_config_values(str(ref_conf))
+
+        ref_conf.write(REF_CONF_CONTENTS + 'RAM = 2048\n')
+
+        assert config._load_config_values(str(ref_conf))['RAM'] == 2048
+
+    def test_unmarshallable_values(self, tmpdir):
+        ref_conf = tmpdir.join(config.CONF_FILE)
+        ref_conf.write('RAM = 2048\nHOOK = lambda: None\n')
+
+        assert config._load_config_values(str(ref_conf))['RAM'] == 2048
+
+
+class TestConfigEnviron(object):
+
+    def test_overrides(self):
+        test_config = config.ConfigData()
+        test_config.merge_environ({'TESTCLOUD_RAM': '2048',
+                                   'TESTCLOUD_DATA_DIR': '/tmp/job1',
+                                   'TESTCLOUD_GUEST_AGENT': 'yes',
+                                   'TESTCLOUD_IDLE_CPU': '0.5',
+                                   'TESTCLOUD_HOSTS': "['qemu+ssh://a/system']",
+                                   'TESTCLOUD_LOG_FILE': '/tmp/job1.log',
+                                   'TESTCLOUD_NOT_A_VALUE': 'ignored',
+                                   'RAM': '1'})
+
+        assert test_config.RAM == 2048
+        assert test_config.DATA_DIR == '/tmp/job1'
+        assert test_config.GUEST_AGENT is True
+        assert test_config.IDLE_CPU == 0.5
+        assert test_config.HOSTS == ['qemu+ssh://a/system']
+        assert test_config.LOG_FILE == '/tmp/job1.log'
+        assert not hasattr(test_config, 'NOT_A_VALUE')
+
+    def test_invalid_value(self):
+        with pytest.raises(ValueError):
+            config.ConfigData().merge_environ({'TESTCLOUD_RAM': 'lots'})
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+""" This module is for testing the behaviour of testcloudd and its clients."""
+
+import os
+import threading
+
+import mock
+import pytest
+
+from testcloud import daemon
+from testcloud import exceptions
+
+
+@pytest.fixture
+def stub_methods(monkeypatch):
+    methods = {'echo': lambda **params: params,
+               'fail': mock.Mock(side_effect=exceptions.TestcloudInstanceError('no can do'))}
+    monkeypatch.setattr(daemon, 'METHODS', methods)
+    return methods
+
+
+class TestHandle(object):
+
+    def test_result(self, stub_methods):
+        response = daemon.handle({'jsonrpc': '2.0', 'id': 1, 'method': 'echo',
+                                  'params': {'name': 'test-123'}})
+
+        assert response == {'jsonrpc': '2.0', 'id': 1, 'result': {'name': 'test-123'}}
+
+    def test_error(self, stub_methods):
+        response = daemon.handle({'jsonrpc': '2.0', 'id': 2, 'method': 'fail'})
+
+        assert response['error'] == {'code': daemon.SERVER_ERROR, 'message': 'no can do',
+                                     'data': {'type': 'TestcloudInstanceError'}}
+
+    def test_unknown_method(self, stub_methods):
+        response = daemon.handle({'jsonrpc': '2.0', 'id': 3, 'method': 'nope'})
+
+        assert response['error']['code'] == daemon.METHOD_NOT_FOUND
+
+    def test_invalid_request(self, stub_methods):
+        assert daemon.handle([1, 2])['error']['code'] == daemon.INVALID_REQUEST
+
+    def test_notification(self, stub_methods):
+        assert daemon.handle({'jsonrpc': '2.0', 'method': 'echo'}) is None
+
+
+class TestServer(object):
+
+    @pytest.fixture
+    def server(self, stub_methods, tmpdir):
+        server = daemon.Server(str(tmpdir.join('testcloudd.sock')))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        yield server
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+    def test_call(self, server):
+        client = daemon.connect(server.server_address)
+        try:
+            assert client.call('echo', name='test-123') == {'name': 'test-123'}
+            with pytest.raises(exceptions.TestcloudInstanceError):
+                client.call('fail')
+            with pytest.raises(exceptions.TestcloudCliError):
+                client.call('nope')
+        finally:
+            client.close()
+
+    def test_already_running(self, server):
+        with pytest.raises(exceptions.TestcloudCliError):
+            daemon.Server(server.server_address)
+
+    def test_not_running(self, tmpdir):
+        assert daemon.connect(str(tmpdir.join('testcloudd.sock'))) is None
+
+    def test_call_without_daemon(self, stub_methods, monkeypatch, tmpdir):
+        monkeypatch.setattr(daemon.config_data, 'DAEMON_SOCKET', str(tmpdir.join('nope.sock')))
+
+        assert daemon.call('echo', name='test-123') == {'name': 'test-123'}
+
+    def test_call_with_daemon(self, server, monkeypatch):
+        for key in list(os.environ):
+            if key.startswith('TESTCLOUD_'):
+                monkeypatch.delenv(key)
+        monkeypatch.setattr(daemon.config_data, 'DAEMON_SOCKET', server.server_address)
+        monkeypatch.setenv('TESTCLOUD_DAEMON_SOCKET', server.server_address)
+        stub_connect = mock.Mock(wraps=daemon.connect)
+        monkeypatch.setattr(daemon, 'connect', stub_connect)
+
+        assert daemon.call('echo', name='test-123') == {'name': 'test-123'}
+        assert stub_connect.called
+
+    def test_call_with_overrides(self, server, monkeypatch):
+        monkeypatch.setattr(daemon.config_data, 'DAEMON_SOCKET', server.server_address)
+        monkeypatch.setenv('TESTCLOUD_DATA_DIR', '/tmp/testcloud')
+        stub_connect = mock.Mock(wraps=daemon.connect)
+        monkeypatch.setattr(daemon, 'connect', stub_connect)
+
+        assert daemon.call('echo', name='test-123') == {'name': 'test-123'}
+        assert not stub_connect.called
+
+    def test_overrides_config(self):
+        assert daemon._overrides_config({'TESTCLOUD_DATA_DIR': '/tmp/testcloud'})
+        assert daemon._overrides_config({'TESTCLOUD_CONFIG': '/tmp/settings.py'})
+        assert not daemon._overrides_config({'TESTCLOUD_DAEMON_SOCKET': '/tmp/d.sock',
+                                             'TESTCLOUD_FIO_IMAGE': 'file:///fio.qcow2',
+                                             'HOME': '/root'})
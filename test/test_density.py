@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+""" This module is for testing the behaviour of the memory density monitor."""
+
+from testcloud import density
+
+
+class TestBalloonTarget(object):
+
+    def setup_method(self, method):
+        self.stats = {'balloon.current': 524288,
+                      'balloon.maximum': 524288,
+                      'balloon.available': 500000,
+                      'balloon.usable': 300000}
+
+    def test_shrink_to_working_set(self):
+        test_target = density.balloon_target(self.stats, min_ram=64, headroom=0.5)
+
+        assert test_target == 300000
+
+    def test_min_ram(self):
+        test_target = density.balloon_target(self.stats, min_ram=400, headroom=0.5)
+
+        assert test_target == 400 * 1024
+
+    def test_grow_capped_at_maximum(self):
+        self.stats['balloon.usable'] = 10000
+
+        test_target = density.balloon_target(self.stats, min_ram=64, headroom=0.5)
+
+        assert test_target == 524288
+
+    def test_missing_stats(self):
+        del self.stats['balloon.usable']
+
+        assert density.balloon_target(self.stats) is None
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+""" This module is for testing the behaviour of the idle policy."""
+
+import mock
+
+from testcloud import idle
+
+
+class TestActivity(object):
+
+    def test_activity(self):
+        stats = {'cpu.time': 5000,
+                 'block.count': 2,
+                 'block.0.rd.bytes': 100,
+                 'block.0.wr.bytes': 200,
+                 'block.1.rd.bytes': 1,
+                 'block.1.rd.reqs': 999,
+                 'net.0.rx.bytes': 10,
+                 'net.0.tx.bytes': 20,
+                 'net.0.rx.pkts': 999}
+
+        assert idle.activity(stats) == (5000, 331)
+
+
+class TestIsIdle(object):
+
+    def test_idle(self):
+        assert idle.is_idle((0, 0), (10 ** 9, 1000), 60, cpu_threshold=0.05, io_threshold=100)
+
+    def test_busy_cpu(self):
+        assert not idle.is_idle((0, 0), (30 * 10 ** 9, 0), 60,
+                                cpu_threshold=0.05, io_threshold=100)
+
+    def test_busy_io(self):
+        assert not idle.is_idle((0, 0), (0, 60 * 1000), 60, cpu_threshold=0.05, io_threshold=100)
+
+
+class TestIdleMonitor(object):
+
+    def setup_method(self, method):
+        self.domain = mock.Mock()
+        self.domain.name.return_value = 'test-123'
+        self.conn = mock.Mock()
+        self.conn.getAllDomainStats.return_value = [(self.domain, {'cpu.time': 0})]
+
+    def test_rest_after_timeout(self, monkeypatch):
+        monkeypatch.setattr(idle.libvirt, 'open', mock.Mock(return_value=self.conn))
+        monkeypatch.setattr(idle.instance, '_list_instances',
+                            mock.Mock(return_value=[{'name': 'test-123', 'ip': None}]))
+        stub_time = mock.Mock(side_effect=[0, 100, 200])
+        monkeypatch.setattr(idle.time, 'time', stub_time)
+        stub_rest = mock.Mock()
+        test_monitor = idle.IdleMonitor(action='save', timeout=150)
+        monkeypatch.setattr(test_monitor, '_rest', stub_rest)
+
+        assert test_monitor.check() == []
+        assert test_monitor.check() == []
+        assert test_monitor.check() == ['test-123']
+        stub_rest.assert_called_once_with('test-123')
+
+    def test_activity_resets_timeout(self, monkeypatch):
+        monkeypatch.setattr(idle.libvirt, 'open', mock.Mock(return_value=self.conn))
+        monkeypatch.setattr(idle.instance, '_list_instances',
+                            mock.Mock(return_value=[{'name': 'test-123', 'ip': None}]))
+        monkeypatch.setattr(idle.time, 'time', mock.Mock(side_effect=[0, 100, 200]))
+        self.conn.getAllDomainStats.side_effect = [[(self.domain, {'cpu.time': 0})],
+                                                   [(self.domain, {'cpu.time': 50 * 10 ** 9})],
+                                                   [(self.domain, {'cpu.time': 50 * 10 ** 9})]]
+        test_monitor = idle.IdleMonitor(timeout=150)
+        monkeypatch.setattr(test_monitor, '_rest', mock.Mock())
+
+        assert test_monitor.check() == []
+        assert test_monitor.check() == []
+        assert test_monitor.check() == []
+
+    def test_ignore_foreign_domains(self, monkeypatch):
+        monkeypatch.setattr(idle.libvirt, 'open', mock.Mock(return_value=self.conn))
+        monkeypatch.setattr(idle.instance, '_list_instances', mock.Mock(return_value=[]))
+        monkeypatch.setattr(idle.time, 'time', mock.Mock(side_effect=[0, 100]))
+        test_monitor = idle.IdleMonitor(timeout=50)
+        monkeypatch.setattr(test_monitor, '_rest', mock.Mock())
+
+        assert test_monitor.check() == []
+        assert test_monitor.check() == []
@@ -6,8 +6,12 @@
 
 """ This module is for testing the behaviour of the Image class."""
 
+import hashlib
+
+import mock
 import pytest
 
+from testcloud import config
 from testcloud import image
 from testcloud import exceptions
 
@@ -92,3 +96,54 @@ class TestImageUriProcess(object):
 
         with pytest.raises(exceptions.TestcloudImageError):
             image.Image(ref_uri)
+
+
+class TestImageDigest(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+
+    def test_digest_cached(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        self.conf.STORE_DIR = str(tmpdir)
+        monkeypatch.setattr(image, 'config_data', self.conf)
+        tmpdir.join('image.qcow2').write('imagedata')
+
+        test_image = image.Image('file:///srv/images/image.qcow2')
+        ref_digest = hashlib.sha256(b'imagedata').hexdigest()
+
+        assert test_image.digest() == ref_digest
+
+        # second lookup comes from the cache, without reading the image
+        stub_sha256 = mock.Mock(side_effect=AssertionError('image was hashed again'))
+        monkeypatch.setattr(hashlib, 'sha256', stub_sha256)
+        assert test_image.digest() == ref_digest
+
+
+class TestExtractKernel(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+
+    def test_replace_incomplete_kernel_dir(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        self.conf.STORE_DIR = str(tmpdir)
+        self.conf.KERNEL_DIR = str(tmpdir.join('kernels'))
+        monkeypatch.setattr(image, 'config_data', self.conf)
+        monkeypatch.setattr(image.Image, 'digest', lambda self: 'abc123')
+        monkeypatch.setattr(image.Image, '_adjust_image_selinux', lambda self, path: None)
+        # an earlier extraction which didn't get to write the initrd
+        tmpdir.mkdir('kernels').mkdir('abc123').join('vmlinuz').write('stale')
+
+        def stub_extract(command):
+            output = tmpdir.join('kernels', 'abc123.tmp')
+            output.join('vmlinuz-5.0').write('kernel')
+            output.join('initramfs-5.0.img').write('initrd')
+            return 0
+        monkeypatch.setattr(image.trace, 'call', stub_extract)
+
+        kernel, initrd = image.Image('file:///srv/images/image.qcow2').extract_kernel()
+
+        assert open(kernel).read() == 'kernel'
+        assert open(initrd).read() == 'initrd'
+        assert not tmpdir.join('kernels', 'abc123.tmp').exists()
@@ -6,11 +6,15 @@
 
 """ This module is for testing the behaviour of the Image class."""
 
+import base64
 import os
+import time
+import xml.etree.ElementTree as ET
 
 import mock
+import pytest
 
-from testcloud import instance, image, config
+from testcloud import instance, image, config, exceptions
 
 
 class TestInstance:
@@ -67,3 +71,657 @@ class TestFindInstance(object):
         test_instance = instance.find_instance(ref_name, ref_image)
 
         assert test_instance.path == ref_path
+
+
+class TestGetProfile(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+
+    def test_default_profile(self, monkeypatch):
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+
+        test_profile = instance.get_profile('default')
+
+        assert test_profile == config.ConfigData.PROFILES['default']
+
+    def test_profile_inherits_default(self, monkeypatch):
+        self.conf.PROFILES = {'fast': {'vcpus': 4}}
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+
+        test_profile = instance.get_profile('fast')
+
+        assert test_profile['vcpus'] == 4
+        assert test_profile['net_model'] == config.ConfigData.PROFILES['default']['net_model']
+
+    def test_custom_profiles_without_default(self, monkeypatch):
+        self.conf.PROFILES = {'fast': {'vcpus': 4}}
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+
+        assert instance.get_profile('default') == config.ConfigData.PROFILES['default']
+        assert instance.get_profile('performance') == dict(
+            config.ConfigData.PROFILES['default'], **config.ConfigData.PROFILES['performance'])
+
+    def test_unknown_profile(self, monkeypatch):
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+
+        with pytest.raises(exceptions.TestcloudInstanceError):
+            instance.get_profile('leprechaun')
+
+
+class TestDomainTemplate(object):
+
+    # seconds rendering RENDER_COUNT domain definitions may take
+    RENDER_BUDGET = 2.0
+    RENDER_COUNT = 1000
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+
+    def test_render_domains(self, monkeypatch, tmpdir):
+        """Benchmark: the template is compiled once and shared, rendering many
+        domain definitions only costs the rendering."""
+
+        self.conf.DATA_DIR = str(tmpdir)
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+        monkeypatch.setattr(instance, '_jinja_envs', {})
+        values = dict(instance.get_profile('performance'),
+                      memory=512 * 1024, disk='/tmp/disk.qcow2', seed='/tmp/seed.img',
+                      console_log='/tmp/console.log', network='default', shares=[],
+                      guest_agent=True)
+
+        start = time.time()
+        for index in range(self.RENDER_COUNT):
+            domain_xml = instance._get_template(self.conf.XML_TEMPLATE).render(
+                values, domain_name='test-{}'.format(index), uuid=index,
+                mac_address='52:54:00:00:00:{:02x}'.format(index % 256))
+        elapsed = time.time() - start
+
+        assert ET.fromstring(domain_xml).find('name').text == 'test-999'
+        assert elapsed < self.RENDER_BUDGET
+        assert len(instance._jinja_envs) == 1
+        # the compiled template is kept for other processes
+        assert tmpdir.join('jinja-cache').listdir()
+
+
+class TestEphemeralInstance(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+        self.conf.DATA_DIR = '/some/data/dir'
+        self.conf.EPHEMERAL_DIR = '/some/tmpfs/dir'
+
+    def test_ephemeral_disks_on_tmpfs(self, monkeypatch):
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+
+        test_instance = instance.Instance('test-123', ephemeral=True)
+
+        assert test_instance.local_disk.startswith('/some/tmpfs/dir/test-123/')
+        assert test_instance.seed_path.startswith('/some/tmpfs/dir/test-123/')
+        assert test_instance.metadata_path.startswith('/some/data/dir/instances/test-123/')
+
+    def test_ephemeral_from_metadata(self, monkeypatch):
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+        monkeypatch.setattr(instance.Instance, '_load_metadata',
+                            lambda self: {'ephemeral': True})
+
+        test_instance = instance.Instance('test-123')
+
+        assert test_instance.ephemeral
+        assert test_instance.local_disk.startswith('/some/tmpfs/dir/test-123/')
+
+
+class TestSpawnVm(object):
+
+    def setup_method(self, method):
+        self.conn = mock.Mock()
+        self.conn.defineXML.side_effect = instance.libvirt.libvirtError('bad domain')
+
+    def test_release_address_on_failure(self, monkeypatch):
+        monkeypatch.setattr(instance.util, 'open_connection', lambda uri: self.conn)
+        monkeypatch.setattr(instance.Instance, 'write_domain_xml', lambda self: '<domain/>')
+        monkeypatch.setattr(instance.network, 'lookup', mock.Mock(return_value=None))
+        stub_release = mock.Mock()
+        monkeypatch.setattr(instance.network, 'release', stub_release)
+        test_instance = instance.Instance('test-123')
+
+        with pytest.raises(instance.libvirt.libvirtError):
+            test_instance.spawn_vm()
+
+        stub_release.assert_called_once_with('test-123', test_instance.connection)
+
+    def test_keep_previous_address_on_failure(self, monkeypatch):
+        monkeypatch.setattr(instance.util, 'open_connection', lambda uri: self.conn)
+        monkeypatch.setattr(instance.Instance, 'write_domain_xml', lambda self: '<domain/>')
+        monkeypatch.setattr(instance.network, 'lookup',
+                            mock.Mock(return_value={'ip': '192.168.122.4'}))
+        stub_release = mock.Mock()
+        monkeypatch.setattr(instance.network, 'release', stub_release)
+
+        with pytest.raises(instance.libvirt.libvirtError):
+            instance.Instance('test-123').spawn_vm()
+
+        assert not stub_release.called
+
+
+class TestWaitForConsole(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+        self.conf.BOOT_READY_MARKERS = [r'Cloud-init v\. \S+ finished at']
+
+    def test_no_markers_by_default(self):
+        assert config.ConfigData.BOOT_READY_MARKERS == []
+
+    def test_marker_found(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+        test_instance = instance.Instance('test-123')
+        tmpdir.mkdir('instances').mkdir('test-123')
+        with open(test_instance.console_log, 'w') as console:
+            console.write('Cloud-init v. 17.1 finished at Mon, 01 Jan 2018\n'
+                          'booting\n'
+                          'Cloud-init v. 17.1 finished at Tue, 02 Jan 2018\n')
+
+        assert test_instance._wait_for_console(0, 1)
+
+    def test_marker_before_offset(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+        test_instance = instance.Instance('test-123')
+        tmpdir.mkdir('instances').mkdir('test-123')
+        ref_log = 'Cloud-init v. 17.1 finished at Mon, 01 Jan 2018\n'
+        with open(test_instance.console_log, 'w') as console:
+            console.write(ref_log + 'booting\n')
+
+        assert not test_instance._wait_for_console(len(ref_log), 0)
+
+
+class TestGuestExec(object):
+
+    def test_guest_exec(self, monkeypatch):
+        ref_replies = [{'pid': 42},
+                       {'exited': False},
+                       {'exited': True, 'exitcode': 3,
+                        'out-data': base64.b64encode(b'out').decode(),
+                        'err-data': base64.b64encode(b'err').decode()}]
+        stub_agent_command = mock.Mock(side_effect=ref_replies)
+        test_instance = instance.Instance('test-123')
+        monkeypatch.setattr(test_instance, 'agent_command', stub_agent_command)
+        monkeypatch.setattr(instance.time, 'sleep', mock.Mock())
+
+        test_result = test_instance.guest_exec(['ls', '-l', '/'])
+
+        assert test_result == (3, b'out', b'err')
+        ref_exec = stub_agent_command.call_args_list[0][0][0]
+        assert ref_exec['arguments']['path'] == 'ls'
+        assert ref_exec['arguments']['arg'] == ['-l', '/']
+
+
+class TestShares(object):
+
+    def test_parse_share(self, tmpdir):
+        test_share = instance.parse_share('{}:artifacts:ro'.format(tmpdir))
+
+        assert test_share == {'source': str(tmpdir), 'tag': 'artifacts', 'readonly': True}
+
+    def test_parse_share_rw(self, tmpdir):
+        test_share = instance.parse_share('{}:artifacts'.format(tmpdir))
+
+        assert not test_share['readonly']
+
+    def test_parse_invalid_share(self, tmpdir):
+        with pytest.raises(exceptions.TestcloudInstanceError):
+            instance.parse_share('{}:artifacts:leprechaun'.format(tmpdir))
+
+    def test_mounts_user_data(self, tmpdir):
+        test_instance = instance.Instance('test-123')
+        test_instance.shares = [instance.parse_share('{}:artifacts:ro'.format(tmpdir))]
+        test_instance.metadata['share_driver'] = 'virtiofs'
+
+        test_mounts = test_instance._mounts_user_data()
+
+        assert test_mounts == ('mounts:\n'
+                               '  - [ artifacts, /mnt/artifacts, virtiofs, '
+                               '"defaults,ro,nofail" ]\n')
+
+    @pytest.mark.parametrize('driver', ['virtiofs', '9p'])
+    def test_readonly_share_domain_xml(self, driver, monkeypatch, tmpdir):
+        conf = config.ConfigData()
+        conf.DATA_DIR = str(tmpdir)
+        conf.KEEP_DOMAIN_XML = False
+        monkeypatch.setattr(instance, 'config_data', conf)
+        monkeypatch.setattr(instance.Instance, 'save_metadata', mock.Mock())
+        test_instance = instance.Instance('test-123')
+        test_instance.shares = [instance.parse_share('{}:artifacts:ro'.format(tmpdir)),
+                                instance.parse_share('{}:scratch'.format(tmpdir))]
+        test_instance.metadata['share_driver'] = driver
+
+        root = ET.fromstring(test_instance.write_domain_xml())
+
+        filesystems = root.findall('./devices/filesystem')
+        assert [filesystem.find('readonly') is not None for filesystem in filesystems] == \
+            [True, False]
+
+
+class TestWake(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+
+    def test_wake_saved(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        tmpdir.mkdir('instances').mkdir('test-123')
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+        monkeypatch.setattr(instance, '_find_domain', mock.Mock(return_value='saved'))
+        stub_domain = mock.Mock()
+        stub_domain.create.return_value = 0
+        test_instance = instance.Instance('test-123')
+        test_instance.metadata['idle'] = 'saved'
+        monkeypatch.setattr(test_instance, '_get_domain', mock.Mock(return_value=stub_domain))
+
+        assert test_instance.wake()
+        stub_domain.create.assert_called_once_with()
+        assert 'idle' not in instance.Instance('test-123').metadata
+
+    def test_wake_paused(self, monkeypatch):
+        monkeypatch.setattr(instance, '_find_domain', mock.Mock(return_value='paused'))
+        stub_domain = mock.Mock()
+        test_instance = instance.Instance('test-123')
+        monkeypatch.setattr(test_instance, '_get_domain', mock.Mock(return_value=stub_domain))
+
+        assert test_instance.wake()
+        stub_domain.resume.assert_called_once_with()
+
+    def test_wake_running(self, monkeypatch):
+        monkeypatch.setattr(instance, '_find_domain', mock.Mock(return_value='running'))
+        test_instance = instance.Instance('test-123')
+
+        assert not test_instance.wake()
+
+
+class TestReset(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+
+    def test_reset(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        tmpdir.mkdir('instances').mkdir('test-123')
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+        monkeypatch.setattr(instance, '_find_domain', mock.Mock(return_value='running'))
+        test_instance = instance.Instance('test-123')
+        with open(test_instance.local_disk, 'w') as disk:
+            disk.write('dirty')
+
+        def stub_create_local_disk(path, backing_store, size):
+            with open(path, 'w') as disk:
+                disk.write('fresh')
+            return 0
+
+        stub_stop = mock.Mock()
+        stub_start = mock.Mock()
+        monkeypatch.setattr(test_instance, 'stop', stub_stop)
+        monkeypatch.setattr(test_instance, 'start', stub_start)
+        stub_snapshot = mock.Mock()
+        stub_domain = mock.Mock()
+        stub_domain.listAllSnapshots.return_value = [stub_snapshot]
+        monkeypatch.setattr(test_instance, '_get_domain', mock.Mock(return_value=stub_domain))
+        monkeypatch.setattr(test_instance, '_disk_info',
+                            mock.Mock(return_value={'virtual-size': 1024,
+                                                    'backing-filename': '/images/base.qcow2'}))
+        monkeypatch.setattr(test_instance, '_create_local_disk',
+                            mock.Mock(side_effect=stub_create_local_disk))
+
+        test_instance.reset(timeout=30)
+
+        stub_stop.assert_called_once_with()
+        test_instance._create_local_disk.assert_called_once_with(
+            test_instance.local_disk + '.new', '/images/base.qcow2', 1024)
+        with open(test_instance.local_disk, 'r') as disk:
+            assert disk.read() == 'fresh'
+        assert not os.path.exists(test_instance.local_disk + '.new')
+        stub_start.assert_called_once_with(30)
+        assert stub_snapshot.delete.called
+
+    def test_reset_ephemeral(self):
+        test_instance = instance.Instance('test-123', ephemeral=True)
+
+        with pytest.raises(exceptions.TestcloudInstanceError):
+            test_instance.reset()
+
+
+class TestQoS(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+
+    def test_parse_qos(self):
+        assert instance.parse_qos('total_iops_sec=500') == ('total_iops_sec', 500)
+        assert instance.parse_qos('inbound.average=0') == ('inbound.average', 0)
+
+    @pytest.mark.parametrize('spec', ['total_iops=500', 'cpu_shares=-1', 'cpu_shares',
+                                      'vcpu_quota=half'])
+    def test_parse_qos_invalid(self, spec):
+        with pytest.raises(exceptions.TestcloudInstanceError):
+            instance.parse_qos(spec)
+
+    def test_qos_values(self):
+        test_values = instance._qos_values({'total_iops_sec': 500, 'read_bytes_sec': 0,
+                                            'cpu_shares': 512, 'inbound.average': 1024,
+                                            'inbound.burst': 2048})
+
+        assert test_values == {'iotune': {'total_iops_sec': 500},
+                               'cputune': {'shares': 512},
+                               'bandwidth': {'inbound': {'average': 1024, 'burst': 2048}}}
+
+    def test_qos_values_drop_bursts_of_unset_limit(self):
+        test_qos = dict(config.ConfigData.PROFILES['shared']['qos'], total_iops_sec=0)
+
+        test_iotune = instance._qos_values(test_qos)['iotune']
+
+        assert 'total_iops_sec' not in test_iotune
+        assert 'total_iops_sec_max' not in test_iotune
+        assert 'total_iops_sec_max_length' not in test_iotune
+        assert test_iotune['total_bytes_sec'] == 50 * 1024 ** 2
+
+    def test_qos_values_drop_length_of_unset_burst(self):
+        test_iotune = instance._qos_values({'read_iops_sec': 100, 'read_iops_sec_max': 0,
+                                            'read_iops_sec_max_length': 10})['iotune']
+
+        assert test_iotune == {'read_iops_sec': 100}
+
+    def test_domain_xml(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        self.conf.KEEP_DOMAIN_XML = False
+        self.conf.STATIC_ADDRESSES = False
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+        monkeypatch.setattr(instance.Instance, 'save_metadata', mock.Mock())
+        test_instance = instance.Instance('test-123')
+        test_instance.profile = 'shared'
+        test_instance.qos = {'cpu_shares': 256, 'total_iops_sec': 0}
+
+        root = ET.fromstring(test_instance.write_domain_xml())
+
+        assert root.find('./cputune/shares').text == '256'
+        assert root.find('./cputune/quota').text == '50000'
+        assert root.find('./devices/disk/iotune/total_iops_sec') is None
+        assert root.find('./devices/disk/iotune/total_iops_sec_max') is None
+        assert root.find('./devices/disk/iotune/total_iops_sec_max_length') is None
+        assert root.find('./devices/disk/iotune/total_bytes_sec') is not None
+        assert root.find('./devices/interface/bandwidth/inbound').get('average') == '10240'
+
+    def test_tune(self, monkeypatch):
+        monkeypatch.setattr(instance, '_find_domain', mock.Mock(return_value='running'))
+        test_instance = instance.Instance('test-123')
+        stub_domain = mock.Mock()
+        stub_domain.isActive.return_value = True
+        stub_domain.isPersistent.return_value = True
+        stub_domain.XMLDesc.return_value = ("<domain><devices><interface type='network'>"
+                                            "<mac address='52:54:00:00:00:01'/></interface>"
+                                            "</devices></domain>")
+        monkeypatch.setattr(test_instance, '_get_domain', mock.Mock(return_value=stub_domain))
+
+        test_instance.tune({'total_iops_sec': 100, 'vcpu_quota': 0,
+                            'outbound.average': 512})
+
+        flags = instance.libvirt.VIR_DOMAIN_AFFECT_LIVE | instance.libvirt.VIR_DOMAIN_AFFECT_CONFIG
+        stub_domain.setBlockIoTune.assert_called_once_with('vda', {'total_iops_sec': 100}, flags)
+        stub_domain.setSchedulerParametersFlags.assert_called_once_with({'vcpu_quota': -1},
+                                                                        flags)
+        stub_domain.setInterfaceParameters.assert_called_once_with(
+            '52:54:00:00:00:01', {'outbound.average': 512}, flags)
+
+    def test_tune_remove_limit_with_bursts(self, monkeypatch):
+        monkeypatch.setattr(instance, '_find_domain', mock.Mock(return_value='running'))
+        test_instance = instance.Instance('test-123')
+        stub_domain = mock.Mock()
+        stub_domain.isActive.return_value = True
+        stub_domain.isPersistent.return_value = False
+        monkeypatch.setattr(test_instance, '_get_domain', mock.Mock(return_value=stub_domain))
+
+        test_instance.tune({'total_iops_sec': 0})
+
+        stub_domain.setBlockIoTune.assert_called_once_with(
+            'vda', {'total_iops_sec': 0, 'total_iops_sec_max': 0,
+                    'total_iops_sec_max_length': 0}, instance.libvirt.VIR_DOMAIN_AFFECT_LIVE)
+
+        with pytest.raises(exceptions.TestcloudInstanceError):
+            test_instance.tune({'total_iops_sec': 0, 'total_iops_sec_max': 2000})
+
+
+class TestOverlay(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+
+    def test_overlay_options(self):
+        profile = {'disk_cluster_size': '128k', 'disk_preallocation': 'metadata',
+                   'disk_lazy_refcounts': True, 'disk_extended_l2': True}
+
+        assert instance._overlay_options(profile) == ('cluster_size=128k,preallocation=metadata,'
+                                                      'lazy_refcounts=on,extended_l2=on')
+        assert instance._overlay_options(instance.get_profile('default')) == ''
+
+    def test_preallocation_needs_extended_l2(self):
+        with pytest.raises(exceptions.TestcloudInstanceError):
+            instance._overlay_options({'disk_preallocation': 'metadata'})
+
+    def test_create_local_disk(self, monkeypatch):
+        self.conf.PROFILES = {'tuned': {'disk_cluster_size': '2M', 'disk_lazy_refcounts': True}}
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+        stub_call = mock.Mock(return_value=0)
+        monkeypatch.setattr(instance.trace, 'call', stub_call)
+        test_instance = instance.Instance('test-123')
+        test_instance.profile = 'tuned'
+        test_instance.disk_size = 20
+        monkeypatch.setattr(test_instance, '_disk_info', mock.Mock(return_value={'format': 'raw'}))
+
+        assert test_instance._create_local_disk(backing_store='/images/base.raw') == 0
+
+        stub_call.assert_called_once_with(['qemu-img', 'create', '-f', 'qcow2',
+                                           '-b', '/images/base.raw', '-F', 'raw',
+                                           '-o', 'cluster_size=2M,lazy_refcounts=on',
+                                           test_instance.local_disk, '20G'])
+
+
+class TestCheckpoints(object):
+
+    def setup_method(self, method):
+        self.domain = mock.Mock()
+        self.test_instance = instance.Instance('test-123')
+
+    def _snapshot(self, name, created):
+        snapshot = mock.Mock()
+        snapshot.getName.return_value = name
+        snapshot.getXMLDesc.return_value = ('<domainsnapshot><name>{}</name><creationTime>{}'
+                                            '</creationTime></domainsnapshot>'.format(name,
+                                                                                      created))
+        return snapshot
+
+    def test_checkpoint(self, monkeypatch):
+        monkeypatch.setattr(self.test_instance, '_get_domain',
+                            mock.Mock(return_value=self.domain))
+
+        self.test_instance.checkpoint('clean & tidy')
+
+        ref_xml = self.domain.snapshotCreateXML.call_args[0][0]
+        assert '<name>clean &amp; tidy</name>' in ref_xml
+
+    def test_list_checkpoints(self, monkeypatch):
+        self.domain.listAllSnapshots.return_value = [self._snapshot('second', 200),
+                                                     self._snapshot('first', 100)]
+        monkeypatch.setattr(self.test_instance, '_get_domain',
+                            mock.Mock(return_value=self.domain))
+
+        assert self.test_instance.list_checkpoints() == ['first', 'second']
+
+    def test_reverting_creates_checkpoint(self, monkeypatch):
+        monkeypatch.setattr(self.test_instance, 'list_checkpoints', mock.Mock(return_value=[]))
+        monkeypatch.setattr(self.test_instance, 'checkpoint', mock.Mock())
+        monkeypatch.setattr(self.test_instance, 'revert', mock.Mock())
+
+        with pytest.raises(ValueError):
+            with self.test_instance.reverting('clean'):
+                raise ValueError()
+
+        self.test_instance.checkpoint.assert_called_once_with('clean')
+        self.test_instance.revert.assert_called_once_with('clean')
+
+    def test_reverting_reuses_checkpoint(self, monkeypatch):
+        monkeypatch.setattr(self.test_instance, 'list_checkpoints',
+                            mock.Mock(return_value=['clean']))
+        monkeypatch.setattr(self.test_instance, 'checkpoint', mock.Mock())
+        monkeypatch.setattr(self.test_instance, 'revert', mock.Mock())
+
+        with self.test_instance.reverting('clean'):
+            pass
+
+        assert not self.test_instance.checkpoint.called
+        self.test_instance.revert.assert_called_once_with('clean')
+
+
+class TestClone(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+        self.domain_xml = """<domain type='kvm'>
+  <name>test-123</name>
+  <uuid>7b1c6b4c-4c09-4e43-9c1a-61d6d1cbd4a6</uuid>
+  <cputune><emulatorpin cpuset='0-3'/></cputune>
+  <devices>
+    <disk type='file' device='disk'>
+      <source file='/old/test-123-local.qcow2'/>
+      <backingStore type='file'><source file='/images/base.qcow2'/></backingStore>
+      <target dev='vda' bus='virtio'/>
+    </disk>
+    <disk type='file' device='disk'>
+      <source file='/old/test-123-seed.img'/>
+      <target dev='vdb' bus='virtio'/>
+    </disk>
+    <interface type='network'>
+      <mac address='52:54:00:00:00:01'/>
+      <source network='default'/>
+      <target dev='vnet0'/>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x03' function='0x0'/>
+    </interface>
+    <serial type='pty'>
+      <source path='/dev/pts/3'/>
+      <log file='/old/test-123-console.log' append='on'/>
+    </serial>
+  </devices>
+</domain>"""
+
+    def test_clone_domain_xml(self):
+        test_root = instance._clone_domain_xml(self.domain_xml, 'test-123-1', '/new/disk.qcow2',
+                                               '/new/seed.img', '/new/console.log')
+
+        assert test_root.find('name').text == 'test-123-1'
+        assert test_root.find('uuid').text != '7b1c6b4c-4c09-4e43-9c1a-61d6d1cbd4a6'
+        assert [source.get('file') for source in test_root.findall('./devices/disk/source')] == \
+            ['/new/disk.qcow2', '/new/seed.img']
+        assert test_root.find('./devices/disk/backingStore') is None
+        assert test_root.find('./devices/serial/log').get('file') == '/new/console.log'
+        assert test_root.find('./devices/serial/source') is None
+        assert test_root.find('./devices/interface/target') is None
+        assert test_root.find('./devices/interface/address') is not None
+        assert test_root.find('cputune') is None
+
+    def test_clone_running(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        self.conf.STATIC_ADDRESSES = False
+        test_dir = tmpdir.mkdir('instances').mkdir('test-123')
+        test_dir.mkdir('meta').join('user-data').write('#cloud-config')
+        test_dir.join('test-123-seed.img').write('seed')
+        test_dir.join('test-123-local.qcow2').write('disk')
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+        monkeypatch.setattr(instance, '_find_domain',
+                            lambda name, connection: 'running' if name == 'test-123' else None)
+        stub_conn = mock.Mock()
+        monkeypatch.setattr(instance.libvirt, 'open', mock.Mock(return_value=stub_conn))
+        monkeypatch.setattr(instance.util, 'generate_mac_address',
+                            mock.Mock(return_value='52:54:00:00:00:02'))
+        stub_domain = mock.Mock()
+        stub_domain.snapshotNum.return_value = 0
+        stub_domain.isActive.return_value = 1
+        stub_domain.XMLDesc.return_value = self.domain_xml
+        monkeypatch.setattr(instance.Instance, '_get_domain', lambda self: stub_domain)
+        stub_start = mock.Mock()
+        monkeypatch.setattr(instance.Instance, 'start', stub_start)
+        monkeypatch.setattr(instance.Instance, '_disk_info',
+                            lambda self, path: {'virtual-size': 1024})
+        monkeypatch.setattr(instance.Instance, '_create_local_disk',
+                            lambda self, path, backing_store, size: open(path, 'w').close() or 0)
+        test_instance = instance.Instance('test-123')
+
+        test_clones = test_instance.clone(['test-123-1'])
+
+        assert [tc_clone.name for tc_clone in test_clones] == ['test-123-1']
+        base_dir = test_instance.metadata['clone_bases'][0]
+        with open('{}/disk.qcow2'.format(base_dir), 'r') as base:
+            assert base.read() == 'disk'
+        assert stub_domain.save.called
+        assert stub_conn.restore.called
+        assert not stub_conn.restoreFlags.called
+        ref_define_xml = stub_conn.defineXML.call_args[0][0]
+        assert '52:54:00:00:00:02' in ref_define_xml and 'test-123-1' in ref_define_xml
+        stub_start.assert_called_once_with(0)
+        test_clone = instance.Instance('test-123-1')
+        assert test_clone.metadata['clone_of'] == 'test-123'
+        assert test_clone.metadata['clone_bases'] == [base_dir]
+        assert os.path.exists(test_clone.seed_path)
+        assert not os.path.exists('{}/memory.save'.format(base_dir))
+
+
+class TestHosts(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+
+    def test_connection_from_metadata(self, monkeypatch):
+        monkeypatch.setattr(instance.Instance, '_load_metadata',
+                            lambda self: {'connection': 'qemu+ssh://b/system'})
+
+        test_instance = instance.Instance('test-123', connection='qemu:///system')
+
+        assert test_instance.connection == 'qemu+ssh://b/system'
+
+    def test_list_instances_across_hosts(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        self.conf.HOSTS = ['qemu+ssh://a/system', 'qemu+ssh://b/system']
+        instances = tmpdir.mkdir('instances')
+        for name, host in (('test-a', 'qemu+ssh://a/system'),
+                           ('test-b', 'qemu+ssh://b/system'),
+                           ('test-c', 'qemu+ssh://c/system')):
+            instances.mkdir(name).join('{}-metadata.json'.format(name)).write(
+                '{{"connection": "{}"}}'.format(host))
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+        host_domains = {'qemu:///system': {},
+                        'qemu+ssh://a/system': {'test-a': 'running', 'test-b': 'running'},
+                        'qemu+ssh://b/system': {'test-b': 'shutoff'},
+                        'qemu+ssh://c/system': None}
+        stub_map_hosts = mock.Mock(return_value=host_domains)
+        monkeypatch.setattr(instance.scheduler, 'map_hosts', stub_map_hosts)
+
+        test_states = dict((inst['name'], inst['state'])
+                           for inst in instance.list_instances())
+
+        assert test_states == {'test-a': 'running', 'test-b': 'shutoff',
+                               'test-c': 'unreachable'}
+        assert set(stub_map_hosts.call_args[0][1]) == set(host_domains)
+
+    def test_list_keeps_ephemeral_without_domain(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        tmpdir.mkdir('instances').mkdir('test-123').join('test-123-metadata.json').write(
+            '{"ephemeral": true}')
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+        monkeypatch.setattr(instance.scheduler, 'map_hosts',
+                            mock.Mock(return_value={'qemu:///system': {}}))
+        stub_remove = mock.Mock()
+        monkeypatch.setattr(instance.Instance, 'remove', stub_remove)
+
+        test_states = dict((inst['name'], inst['state'])
+                           for inst in instance.list_instances())
+
+        assert test_states == {'test-123': 'de-sync'}
+        assert not stub_remove.called
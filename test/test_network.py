@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+""" This module is for testing the behaviour of the address allocation."""
+
+import mock
+import pytest
+
+from testcloud import config
+from testcloud import network
+from testcloud.exceptions import TestcloudInstanceError
+
+NETWORK_XML = """<network>
+  <name>default</name>
+  <ip address='192.168.122.1' netmask='255.255.255.0'>
+    <dhcp>
+      <range start='192.168.122.2' end='192.168.122.5'/>
+      <host mac='52:54:00:aa:bb:cc' ip='192.168.122.2'/>
+    </dhcp>
+  </ip>
+  <ip family='ipv6' address='2001:db8::1' prefix='64'/>
+</network>"""
+
+
+class TestAddresses(object):
+
+    def test_mac_for_ip(self):
+        assert network.mac_for_ip('192.168.122.5') == '52:54:00:a8:7a:05'
+
+    def test_parse_network(self):
+        test_info = network.parse_network(NETWORK_XML)
+
+        assert test_info['gateway'] == '192.168.122.1'
+        assert test_info['hosts'] == {'52:54:00:aa:bb:cc': '192.168.122.2'}
+        assert test_info['range'][1] - test_info['range'][0] == 3
+
+    def test_pick_address(self):
+        test_info = network.parse_network(NETWORK_XML)
+
+        assert network.pick_address(test_info, set(['192.168.122.3'])) == '192.168.122.4'
+
+    def test_pick_address_skips_used_mac(self):
+        test_info = network.parse_network(NETWORK_XML)
+
+        # 10.168.122.3 on another network has the MAC of 192.168.122.3
+        assert network.pick_address(test_info, set(),
+                                    set([network.mac_for_ip('10.168.122.3')])) == '192.168.122.4'
+
+    def test_range_exhausted(self):
+        test_info = network.parse_network(NETWORK_XML)
+
+        with pytest.raises(TestcloudInstanceError):
+            network.pick_address(test_info, set(['192.168.122.3', '192.168.122.4',
+                                                 '192.168.122.5']))
+
+
+class TestAllocate(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+        self.net = mock.Mock()
+        self.net.XMLDesc.return_value = NETWORK_XML
+        self.net.DHCPLeases.return_value = [{'ipaddr': '192.168.122.3'}]
+        self.conn = mock.Mock()
+        self.conn.networkLookupByName.return_value = self.net
+
+    def test_allocate_and_release(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        monkeypatch.setattr(network, 'config_data', self.conf)
+        monkeypatch.setattr(network.libvirt, 'open', mock.Mock(return_value=self.conn))
+
+        test_first = network.allocate('test-1')
+        test_second = network.allocate('test-2')
+
+        assert test_first == {'mac': '52:54:00:a8:7a:04', 'ip': '192.168.122.4',
+                              'network': 'default', 'connection': 'qemu:///system'}
+        assert test_second['ip'] == '192.168.122.5'
+        assert network.allocate('test-1') == test_first
+        assert self.net.update.call_count == 2
+        assert "mac=\"52:54:00:a8:7a:04\"" in self.net.update.call_args_list[0][0][3]
+
+        network.release('test-1')
+
+        assert network.lookup('test-1') is None
+        assert network.lookup('test-2') == test_second
+        assert self.net.update.call_count == 3
+
+    def test_allocate_skips_mac_of_other_network(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        tmpdir.join('addresses.json').write(
+            '{"test-0": {"mac": "52:54:00:a8:7a:04", "ip": "10.168.122.4", '
+            '"network": "other", "connection": "qemu:///system"}}')
+        monkeypatch.setattr(network, 'config_data', self.conf)
+        monkeypatch.setattr(network.libvirt, 'open', mock.Mock(return_value=self.conn))
+
+        assert network.allocate('test-1')['ip'] == '192.168.122.5'
+
+    def test_allocate_skips_mac_of_lease(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        # a guest on another network leased the MAC derived from 192.168.122.4
+        self.net.DHCPLeases.return_value = [{'ipaddr': '192.168.122.3'},
+                                            {'ipaddr': '10.168.122.4',
+                                             'mac': '52:54:00:a8:7a:04'}]
+        monkeypatch.setattr(network, 'config_data', self.conf)
+        monkeypatch.setattr(network.libvirt, 'open', mock.Mock(return_value=self.conn))
+
+        assert network.allocate('test-1')['ip'] == '192.168.122.5'
+
+
+class TestGroupNetworks(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+        self.conn = mock.Mock()
+        self.conn.networkLookupByName.side_effect = network.libvirt.libvirtError('no network')
+        self.conn.listAllDomains.return_value = []
+        default = mock.Mock()
+        default.XMLDesc.return_value = NETWORK_XML
+        self.conn.listAllNetworks.return_value = [default]
+
+    def test_pick_subnet(self):
+        test_used = [network._parse_cidr('10.0.0.0/23'), network._parse_cidr('10.0.3.7/24')]
+
+        assert network.pick_subnet('10.0.0.0/16', test_used) == '10.0.2.0'
+
+    def test_pick_subnet_exhausted(self):
+        with pytest.raises(TestcloudInstanceError):
+            network.pick_subnet('10.0.0.0/24', [network._parse_cidr('10.0.0.128/25')])
+
+    def test_network_subnets(self):
+        assert network._network_subnets(NETWORK_XML) == \
+            [network._parse_cidr('192.168.122.0/24')]
+
+    def test_group_network_xml(self):
+        test_info = network.parse_network(network.group_network_xml('testcloud-ci', '10.1.2.0'))
+
+        assert test_info['gateway'] == '10.1.2.1'
+        assert test_info['range'] == (network._ip_to_int('10.1.2.2'),
+                                      network._ip_to_int('10.1.2.254'))
+
+    def test_group_network(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        self.conf.NETWORK_POOL = '192.168.122.0/23'
+        monkeypatch.setattr(network, 'config_data', self.conf)
+        monkeypatch.setattr(network.libvirt, 'open', mock.Mock(return_value=self.conn))
+        monkeypatch.setattr(network.libvirt.libvirtError, 'get_error_code',
+                            lambda self: network.libvirt.VIR_ERR_NO_NETWORK)
+
+        assert network.group_network('ci') == 'testcloud-ci'
+        assert "192.168.123.1" in self.conn.networkCreateXML.call_args[0][0]
+        assert network._load_networks() == {'testcloud-ci': '192.168.123.0'}
+
+        assert network.prune_group_network('testcloud-ci')
+        assert network._load_networks() == {}
+
+    def test_prune_keeps_network_in_use(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        monkeypatch.setattr(network, 'config_data', self.conf)
+        monkeypatch.setattr(network.libvirt, 'open', mock.Mock(return_value=self.conn))
+        network._save_networks({'testcloud-ci': '10.123.0.0'})
+        network._save_registry({'test-1': {'mac': '52:54:00:7b:00:02', 'ip': '10.123.0.2',
+                                           'network': 'testcloud-ci'}})
+
+        assert not network.prune_group_network('testcloud-ci')
+        assert network._load_networks() == {'testcloud-ci': '10.123.0.0'}
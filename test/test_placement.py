@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+""" This module is for testing the behaviour of NUMA placement."""
+
+from testcloud import placement
+
+
+REF_CAPS = """<capabilities>
+  <host>
+    <topology>
+      <cells num='2'>
+        <cell id='0'>
+          <memory unit='KiB'>8388608</memory>
+          <cpus num='4'>
+            <cpu id='0'/><cpu id='1'/><cpu id='2'/><cpu id='3'/>
+          </cpus>
+        </cell>
+        <cell id='1'>
+          <memory unit='KiB'>8388608</memory>
+          <cpus num='4'>
+            <cpu id='4'/><cpu id='5'/><cpu id='6'/><cpu id='7'/>
+          </cpus>
+        </cell>
+      </cells>
+    </topology>
+  </host>
+</capabilities>"""
+
+
+class TestPlacement(object):
+
+    def setup_method(self, method):
+        self.topology = placement.parse_topology(REF_CAPS)
+
+    def test_parse_topology(self):
+        assert [cell['id'] for cell in self.topology] == [0, 1]
+        assert self.topology[1]['cpus'] == [4, 5, 6, 7]
+        assert self.topology[0]['memory'] == 8388608
+
+    def test_format_cpuset(self):
+        assert placement.format_cpuset([5, 0, 1, 2, 7, 8]) == '0-2,5,7-8'
+
+    def test_place_empty_host(self):
+        test_placement = placement.place(self.topology, 1, 512, [])
+
+        assert test_placement['node'] == 0
+        assert test_placement['cpuset'] == '0-3'
+
+    def test_place_balances_nodes(self):
+        ref_assignments = [{'node': 0, 'vcpus': 2, 'ram': 512}]
+
+        test_placement = placement.place(self.topology, 1, 512, ref_assignments)
+
+        assert test_placement['node'] == 1
+        assert test_placement['cpuset'] == '4-7'
+
+    def test_place_single_node(self):
+        assert placement.place(self.topology[:1], 1, 512, []) is None
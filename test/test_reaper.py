@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+""" This module is for testing the behaviour of the reaper."""
+
+import os
+
+import mock
+import pytest
+
+from testcloud import config
+from testcloud import instance
+from testcloud import reaper
+
+DOMAIN_XML = """<domain type='kvm'>
+  <name>{name}</name>
+  <devices>
+    <disk type='file' device='disk'>
+      <source file='{disk}'/>
+    </disk>
+  </devices>
+</domain>"""
+
+
+class TestExpired(object):
+
+    def test_expired(self):
+        assert reaper.expired({'expires': 100}, now=100)
+
+    def test_not_expired(self):
+        assert not reaper.expired({'expires': 100}, now=99)
+
+    def test_no_ttl(self):
+        assert not reaper.expired({}, now=100)
+
+
+class TestReap(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+        self.conn = mock.Mock()
+        self.conn.listAllDomains.return_value = []
+
+    def _setup(self, monkeypatch, tmpdir, domains):
+        self.conf.DATA_DIR = str(tmpdir.mkdir('data'))
+        self.conf.EPHEMERAL_DIR = str(tmpdir.mkdir('shm'))
+        self.conf.REAPER_GRACE = 600
+        tmpdir.join('data').mkdir('instances')
+        monkeypatch.setattr(reaper, 'config_data', self.conf)
+        monkeypatch.setattr(instance, 'config_data', self.conf)
+        monkeypatch.setattr(reaper.libvirt, 'open', mock.Mock(return_value=self.conn))
+        monkeypatch.setattr(instance, '_list_domains', mock.Mock(return_value=domains))
+
+    def _age(self, path):
+        os.utime(path, (0, 0))
+
+    def test_desync_directory(self, monkeypatch, tmpdir):
+        self._setup(monkeypatch, tmpdir, {'test-ok': 'running'})
+        instances = tmpdir.join('data', 'instances')
+        self._age(str(instances.mkdir('test-ok')))
+        self._age(str(instances.mkdir('test-gone')))
+        instances.mkdir('test-new')
+
+        test_reaped = reaper.reap()
+
+        assert test_reaped == [str(instances.join('test-gone'))]
+        assert not instances.join('test-gone').check()
+        assert instances.join('test-ok').check()
+        assert instances.join('test-new').check()
+
+    def test_dry_run(self, monkeypatch, tmpdir):
+        self._setup(monkeypatch, tmpdir, {})
+        instances = tmpdir.join('data', 'instances')
+        self._age(str(instances.mkdir('test-gone')))
+
+        test_reaped = reaper.reap(dry_run=True)
+
+        assert test_reaped == [str(instances.join('test-gone'))]
+        assert instances.join('test-gone').check()
+
+    def test_expired_instance(self, monkeypatch, tmpdir):
+        self._setup(monkeypatch, tmpdir, {'test-123': 'running'})
+        instances = tmpdir.join('data', 'instances')
+        instances.mkdir('test-123').join('test-123-metadata.json').write('{"expires": 1}')
+        stub_remove = mock.Mock()
+        monkeypatch.setattr(instance.Instance, 'remove', stub_remove)
+
+        assert reaper.reap() == ['test-123']
+        stub_remove.assert_called_once_with(autostop=True)
+
+    def test_orphaned_ephemeral_disks(self, monkeypatch, tmpdir):
+        self._setup(monkeypatch, tmpdir, {})
+        orphan = tmpdir.join('shm').mkdir('test-gone')
+        orphan.join('test-gone-local.qcow2').write('')
+        self._age(str(orphan))
+
+        assert reaper.reap() == [str(orphan)]
+        assert not orphan.check()
+
+    def test_orphaned_domain(self, monkeypatch, tmpdir):
+        self._setup(monkeypatch, tmpdir, {'test-gone': 'running', 'other': 'running'})
+        disk = '{}/instances/test-gone/test-gone-local.qcow2'.format(self.conf.DATA_DIR)
+        stub_orphan = mock.Mock()
+        stub_orphan.name.return_value = 'test-gone'
+        stub_orphan.XMLDesc.return_value = DOMAIN_XML.format(name='test-gone', disk=disk)
+        stub_other = mock.Mock()
+        stub_other.name.return_value = 'other'
+        stub_other.XMLDesc.return_value = DOMAIN_XML.format(name='other',
+                                                            disk='/var/lib/libvirt/images/a.qcow2')
+        self.conn.listAllDomains.return_value = [stub_orphan, stub_other]
+
+        assert reaper.reap() == ['test-gone']
+        stub_orphan.destroy.assert_called_once_with()
+        assert stub_orphan.undefineFlags.called
+        assert not stub_other.destroy.called
+
+    def test_unreadable_metadata(self, monkeypatch, tmpdir):
+        self._setup(monkeypatch, tmpdir, {})
+        instances = tmpdir.join('data', 'instances')
+        instances.mkdir('test-broken').join('test-broken-metadata.json').write('{"exp')
+        self._age(str(instances.mkdir('test-gone')))
+
+        assert reaper.reap() == [str(instances.join('test-gone'))]
+        assert instances.join('test-broken').check()
+
+    def test_failing_instance(self, monkeypatch, tmpdir):
+        self._setup(monkeypatch, tmpdir, {'test-123': 'running'})
+        instances = tmpdir.join('data', 'instances')
+        instances.mkdir('test-123').join('test-123-metadata.json').write('{"expires": 1}')
+        self._age(str(instances.mkdir('test-gone')))
+        monkeypatch.setattr(instance.Instance, 'remove',
+                            mock.Mock(side_effect=reaper.libvirt.libvirtError('busy')))
+
+        assert reaper.reap() == [str(instances.join('test-gone'))]
+
+
+class TestRun(object):
+
+    def test_keeps_running_after_failure(self, monkeypatch):
+        stub_reap = mock.Mock(side_effect=[reaper.libvirt.libvirtError('gone'), [],
+                                           KeyboardInterrupt])
+        monkeypatch.setattr(reaper, 'reap', stub_reap)
+        monkeypatch.setattr(reaper.time, 'sleep', mock.Mock())
+
+        with pytest.raises(KeyboardInterrupt):
+            reaper.run(interval=1)
+
+        assert stub_reap.call_count == 3
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+""" This module is for testing the behaviour of the host scheduler."""
+
+import mock
+import pytest
+
+from testcloud import scheduler
+from testcloud.exceptions import TestcloudInstanceError
+
+
+class TestPickHost(object):
+
+    def test_fewest_instances(self):
+        loads = {'qemu+ssh://a/system': {'free_ram': 8192, 'instances': 3},
+                 'qemu+ssh://b/system': {'free_ram': 2048, 'instances': 1}}
+
+        assert scheduler.pick_host(loads, 1024) == 'qemu+ssh://b/system'
+
+    def test_most_free_ram(self):
+        loads = {'qemu+ssh://a/system': {'free_ram': 8192, 'instances': 1},
+                 'qemu+ssh://b/system': {'free_ram': 2048, 'instances': 1}}
+
+        assert scheduler.pick_host(loads, 1024) == 'qemu+ssh://a/system'
+
+    def test_skip_full_and_unreachable(self):
+        loads = {'qemu+ssh://a/system': None,
+                 'qemu+ssh://b/system': {'free_ram': 512, 'instances': 0},
+                 'test:///default': {'free_ram': 4096, 'instances': 5}}
+
+        assert scheduler.pick_host(loads, 1024) == 'test:///default'
+
+    def test_nothing_fits(self):
+        assert scheduler.pick_host({'test:///default': {'free_ram': 512, 'instances': 0}},
+                                   1024) is None
+
+
+class TestSchedule(object):
+
+    def test_map_hosts(self):
+        def stub_func(uri):
+            if uri == 'down':
+                raise scheduler.libvirt.libvirtError('unreachable')
+            return uri.upper()
+
+        results = scheduler.map_hosts(stub_func, ['a', 'b', 'down'])
+
+        assert results == {'a': 'A', 'b': 'B', 'down': None}
+
+    def test_schedule(self, monkeypatch):
+        loads = {'a': {'free_ram': 4096, 'instances': 2},
+                 'b': {'free_ram': 4096, 'instances': 0}}
+        monkeypatch.setattr(scheduler, 'host_load', mock.Mock(side_effect=loads.get))
+
+        assert scheduler.schedule(1024, hosts=['a', 'b']) == 'b'
+
+        with pytest.raises(TestcloudInstanceError):
+            scheduler.schedule(8192, hosts=['a', 'b'])
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+""" This module is for testing the behaviour of SSH command execution."""
+
+import io
+import subprocess
+
+import pytest
+
+from testcloud import ssh, config, exceptions
+
+
+class TestSSHConnection(object):
+
+    def setup_method(self, method):
+        self.conf = config.ConfigData()
+
+    def test_ip_from_file(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        monkeypatch.setattr(ssh, 'config_data', self.conf)
+        tmpdir.mkdir('instances').mkdir('test-123').join('ip').write('192.168.122.10\n')
+
+        test_connection = ssh.SSHConnection('test-123')
+
+        assert test_connection.ip == '192.168.122.10'
+
+    def test_unknown_ip(self, monkeypatch, tmpdir):
+        self.conf.DATA_DIR = str(tmpdir)
+        monkeypatch.setattr(ssh, 'config_data', self.conf)
+
+        with pytest.raises(exceptions.TestcloudInstanceError):
+            ssh.SSHConnection('test-123')
+
+    def test_multiplexed_command(self, monkeypatch):
+        self.conf.SSH_KEY = '/some/key'
+        monkeypatch.setattr(ssh, 'config_data', self.conf)
+
+        test_command = ssh.SSHConnection('test-123', '10.0.0.1')._ssh_command(
+            ['echo', 'hello world'])
+
+        assert test_command[0] == 'ssh'
+        assert 'ControlMaster=auto' in test_command
+        assert '/some/key' in test_command
+        assert test_command[-3:] == ['fedora@10.0.0.1', '--', "echo 'hello world'"]
+
+    def test_password_command(self, monkeypatch):
+        monkeypatch.setattr(ssh, 'config_data', self.conf)
+
+        test_command = ssh.SSHConnection('test-123', '10.0.0.1')._ssh_command(['true'])
+
+        assert test_command[:3] == ['sshpass', '-e', 'ssh']
+
+
+class TestRunParallel(object):
+
+    def test_prefixed_output(self, monkeypatch, tmpdir):
+        conf = config.ConfigData()
+        conf.DATA_DIR = str(tmpdir)
+        monkeypatch.setattr(ssh, 'config_data', conf)
+        instances = tmpdir.mkdir('instances')
+        for name in ['a', 'bb']:
+            instances.mkdir(name).join('ip').write('10.0.0.1')
+
+        def stub_popen(self, command, **kwargs):
+            return subprocess.Popen(['echo', self.name], **kwargs)
+        monkeypatch.setattr(ssh.SSHConnection, 'popen', stub_popen)
+
+        test_output = io.StringIO()
+        test_results = ssh.run_parallel(['a', 'bb', 'missing'], ['true'], 2, test_output)
+
+        assert test_results == {'a': 0, 'bb': 0, 'missing': -1}
+        test_lines = sorted(test_output.getvalue().splitlines())
+        assert [line.split() for line in test_lines] == [['a', '|', 'a'], ['bb', '|', 'bb']]
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+""" This module is for testing the behaviour of boot phase tracing."""
+
+import json
+
+import mock
+
+from testcloud import trace
+
+
+class TestTrace(object):
+
+    def setup_method(self, method):
+        trace.clear()
+
+    def teardown_method(self, method):
+        trace._recording = False
+        trace.clear()
+
+    def test_span_not_recorded_by_default(self):
+        with trace.span('phase'):
+            pass
+
+        assert trace.events() == []
+
+    def test_span_recorded(self, tmpdir):
+        trace.start_recording()
+
+        with trace.span('phase', 'libvirt', domain='test-123'):
+            pass
+
+        ref_trace = str(tmpdir.join('trace.json'))
+        trace.write(ref_trace)
+        with open(ref_trace, 'r') as trace_file:
+            test_events = json.load(trace_file)['traceEvents']
+
+        assert len(test_events) == 1
+        assert test_events[0]['name'] == 'phase'
+        assert test_events[0]['cat'] == 'libvirt'
+        assert test_events[0]['ph'] == 'X'
+        assert test_events[0]['args'] == {'domain': 'test-123'}
+
+    def test_callback(self):
+        stub_callback = mock.Mock()
+        trace.add_callback(stub_callback)
+
+        try:
+            @trace.traced('decorated')
+            def ref_func():
+                return 42
+
+            assert ref_func() == 42
+        finally:
+            trace.remove_callback(stub_callback)
+
+        assert stub_callback.call_args[0][0] == 'decorated'
+        assert stub_callback.call_args[0][1] == 'testcloud'
+
+    def test_call_subprocess(self):
+        trace.start_recording()
+
+        assert trace.call(['true']) == 0
+
+        assert trace.events()[0]['name'] == 'true'
+        assert trace.events()[0]['cat'] == 'subprocess'
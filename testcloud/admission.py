@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+"""
+Host resource admission control for booting instances. Boots are queued until
+the host has enough free memory and CPU for them and only a limited number of
+instances is allowed in the boot phase at once. The queue and the boot slots
+are lock files under ``DATA_DIR`` so they are shared by all testcloud
+processes on the host.
+"""
+
+import os
+import time
+import fcntl
+import logging
+import contextlib
+
+from . import config
+from .exceptions import TestcloudInstanceError
+
+config_data = config.lazy_config()
+
+log = logging.getLogger('testcloud.admission')
+
+
+def _admission_dir():
+    path = '{}/admission'.format(config_data.DATA_DIR)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+def _booting_ram(slot_dir):
+    """Sum up the memory, in MiB, claimed by instances currently holding a
+    boot slot. Their memory isn't necessarily allocated on the host yet.
+    Slots left behind by crashed processes are not locked and are skipped."""
+
+    claimed = 0
+    for slot in os.listdir(slot_dir):
+        if not slot.startswith('slot-'):
+            continue
+        with open(os.path.join(slot_dir, slot), 'r') as slot_file:
+            try:
+                fcntl.flock(slot_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except IOError:
+                # held by a booting instance
+                try:
+                    claimed += int(slot_file.read().strip() or 0)
+                except ValueError:
+                    pass
+            else:
+                fcntl.flock(slot_file, fcntl.LOCK_UN)
+    return claimed
+
+
+def _running_vcpus(conn):
+    """Count the vCPUs of all running domains on a libvirt connection."""
+
+    vcpus = 0
+    for domain in conn.listAllDomains():
+        if domain.isActive():
+            # info() is [state, maxMem, memory, nrVirtCpu, cpuTime]
+            vcpus += domain.info()[3]
+    return vcpus
+
+
+def fits(conn, ram, vcpus, booting_ram=0):
+    """Check whether the host has the resources to boot another instance.
+
+    :param conn: libvirt connection object of the host
+    :param int ram: memory of the instance, in MiB
+    :param int vcpus: number of vCPUs of the instance
+    :param int booting_ram: memory claimed by instances still booting, in MiB
+    :returns: ``True`` if the instance fits on the host
+    :rtype: bool
+    """
+
+    free_ram = conn.getFreeMemory() // (1024 * 1024)
+    available_ram = free_ram - booting_ram - config_data.ADMISSION_RESERVED_RAM
+    if ram > available_ram:
+        log.debug("Not enough memory to boot: {} MiB requested, {} MiB "
+                  "available".format(ram, available_ram))
+        return False
+
+    # getInfo() is [model, memory, cpus, mhz, nodes, sockets, cores, threads]
+    cpu_limit = conn.getInfo()[2] * config_data.ADMISSION_CPU_RATIO
+    running_vcpus = _running_vcpus(conn)
+    if running_vcpus + vcpus > cpu_limit:
+        log.debug("Not enough CPU to boot: {} vCPUs requested, {} of {} "
+                  "in use".format(vcpus, running_vcpus, cpu_limit))
+        return False
+
+    return True
+
+
+def _acquire_slot(slot_dir):
+    """Try to grab one of the ``MAX_BOOTING`` boot slots without blocking.
+
+    :returns: open file object holding the slot lock, or ``None``
+    """
+
+    for index in range(config_data.MAX_BOOTING):
+        slot_file = open(os.path.join(slot_dir, 'slot-{}'.format(index)), 'a+')
+        try:
+            fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            slot_file.close()
+            continue
+        return slot_file
+    return None
+
+
+@contextlib.contextmanager
+def admit(conn, ram, vcpus=1, timeout=None):
+    """Wait until the host can take another booting instance and hold a boot
+    slot for the duration of the ``with`` block. Waiting boots are queued, the
+    first one in the queue is admitted first. Does nothing unless
+    ``ADMISSION_CONTROL`` is enabled.
+
+    :param conn: libvirt connection object of the host
+    :param int ram: memory of the instance, in MiB
+    :param int vcpus: number of vCPUs of the instance
+    :param int timeout: seconds to wait for admission, defaults to the
+                        ``ADMISSION_TIMEOUT`` config value
+    :raises TestcloudInstanceError: if the instance is not admitted in time
+    """
+
+    if not config_data.ADMISSION_CONTROL:
+        yield
+        return
+
+    timeout = config_data.ADMISSION_TIMEOUT if timeout is None else timeout
+    slot_dir = _admission_dir()
+    deadline = time.time() + timeout
+    slot = None
+
+    log.debug("Waiting for admission to boot ({} MiB, {} vCPUs)".format(ram, vcpus))
+    with open(os.path.join(slot_dir, 'queue.lock'), 'a') as queue:
+        fcntl.flock(queue, fcntl.LOCK_EX)
+        try:
+            while True:
+                slot = _acquire_slot(slot_dir)
+                if slot is not None:
+                    if fits(conn, ram, vcpus, _booting_ram(slot_dir)):
+                        break
+                    slot.close()
+                    slot = None
+
+                if time.time() >= deadline:
+                    raise TestcloudInstanceError("Host resources did not allow booting "
+                                                 "within {} seconds".format(timeout))
+                time.sleep(config_data.ADMISSION_POLL)
+
+            slot.truncate(0)
+            slot.write(str(ram))
+            slot.flush()
+        finally:
+            fcntl.flock(queue, fcntl.LOCK_UN)
+
+    log.debug("Admitted to boot")
+    try:
+        yield
+    finally:
+        slot.truncate(0)
+        slot.close()
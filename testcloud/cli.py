@@ -6,31 +6,48 @@
 
 """
 This is the primary user entry point for testcloud
+
+The modules using libvirt, jinja2 or requests are imported by the command
+handlers which need them, so commands not using them don't pay for importing
+them.
 """
 
 import argparse
+import fnmatch
 import logging
 from time import sleep
 import os
+import sys
 from . import config
-from . import image
-from . import instance
-from . import util
+from . import daemon
+from . import trace
 from .exceptions import DomainNotFoundError, TestcloudCliError, TestcloudInstanceError
 
-config_data = config.get_config()
-
-# Only log to a file when specifically configured to
-if config_data.LOG_FILE is not None:
-    logging.basicConfig(filename=config_data.LOG_FILE, level=logging.DEBUG)
+config_data = config.lazy_config()
 
 log = logging.getLogger('testcloud')
 log.addHandler(logging.NullHandler())  # this is needed when running in library mode
 
+#: libvirt connection used when none is given
+DEFAULT_CONNECTION = 'qemu:///system'
+
 description = """Testcloud is a small wrapper program designed to quickly and
 simply boot images designed for cloud systems."""
 
 
+def _call(args, method, **params):
+    """Run an API method through testcloudd if it's running, which answers
+    without connecting to libvirt again. Traced commands always run here.
+
+    :param args: args from argparser
+    :param str method: name of the method, see :py:mod:`testcloud.daemon`
+    """
+
+    if args.trace:
+        return daemon.METHODS[method](**params)
+    return daemon.call(method, **params)
+
+
 ################################################################################
 # instance handling functions
 ################################################################################
@@ -41,15 +58,21 @@ def _list_instance(args):
 
     :param args: args from argparser
     """
-    instances = instance.list_instances(args.connection)
+    instances = _call(args, 'instance.list', connection=args.connection)
 
-    print("{:<16} {:^30}     {:<10}".format("Name", "IP", "State"))
-    print("-"*60)
+    # with a pool of hosts, show where each instance runs
+    if config_data.HOSTS:
+        print("{:<16} {:^30}     {:<10}  {}".format("Name", "IP", "State", "Host"))
+        print("-"*80)
+    else:
+        print("{:<16} {:^30}     {:<10}".format("Name", "IP", "State"))
+        print("-"*60)
     for inst in instances:
         if args.all or inst['state'] == 'running':
-            print("{:<27} {:^22}  {:<10}".format(inst['name'],
-                                                 inst['ip'],
-                                                 inst['state']))
+            line = "{:<27} {:^22}  {:<10}".format(inst['name'], inst['ip'], inst['state'])
+            if config_data.HOSTS:
+                line = "{}  {}".format(line, inst['connection'])
+            print(line)
 
     print("")
 
@@ -61,8 +84,17 @@ def _create_instance(args):
     :param args: args from argparser
     """
 
+    from . import image
+    from . import instance
+    from . import scheduler
+
     log.debug("create instance")
 
+    if args.connection is None:
+        # place new instances on the least loaded host of the pool
+        args.connection = (scheduler.schedule(args.ram) if config_data.HOSTS
+                           else DEFAULT_CONNECTION)
+
     tc_image = image.Image(args.url)
     tc_image.prepare()
 
@@ -79,7 +111,8 @@ def _create_instance(args):
                                                        args.name))
 
     else:
-        tc_instance = instance.Instance(args.name, image=tc_image, connection=args.connection)
+        tc_instance = instance.Instance(args.name, image=tc_image, connection=args.connection,
+                                        ephemeral=args.ephemeral)
 
         # set ram size
         tc_instance.ram = args.ram
@@ -87,14 +120,38 @@ def _create_instance(args):
         # set disk size
         tc_instance.disk_size = args.disksize
 
+        # set domain profile
+        tc_instance.profile = args.profile
+
+        # pin to a host NUMA node
+        tc_instance.numa = args.numa
+
+        # boot kernel and initrd directly
+        tc_instance.direct_kernel = args.direct_kernel
+
+        # add a guest agent channel
+        tc_instance.guest_agent = args.guest_agent
+
+        # share host directories
+        tc_instance.shares = [instance.parse_share(share) for share in args.share]
+
+        # let the reaper remove the instance after a while
+        tc_instance.ttl = args.ttl
+
+        # attach to the network of the group
+        tc_instance.group = args.group
+
+        # limit the I/O, CPU and network use of the instance
+        tc_instance.qos = dict(instance.parse_qos(spec) for spec in args.qos)
+
         # prepare instance
         tc_instance.prepare()
 
-        # create instance domain
-        tc_instance.spawn_vm()
-
-        # start created domain
-        tc_instance.start(args.timeout)
+        # create instance domain and start it, once the host has the
+        # resources for booting it
+        with tc_instance.admit():
+            tc_instance.spawn_vm()
+            tc_instance.start(args.timeout)
 
         # find vm ip
         vm_ip = find_vm_ip(args.name, args.connection)
@@ -112,13 +169,8 @@ def _start_instance(args):
     """
     log.debug("start instance: {}".format(args.name))
 
-    tc_instance = instance.find_instance(args.name, connection=args.connection)
-
-    if tc_instance is None:
-        raise TestcloudCliError("Cannot start instance {} because it does "
-                                "not exist".format(args.name))
-
-    tc_instance.start(args.timeout)
+    _call(args, 'instance.start', name=args.name, connection=args.connection,
+          timeout=args.timeout)
     with open(os.path.join(config_data.DATA_DIR, 'instances', args.name, 'ip'), 'r') as ip_file:
         vm_ip = ip_file.read()
         print("The IP of vm {}:  {}".format(args.name, vm_ip))
@@ -132,40 +184,206 @@ def _stop_instance(args):
     """
     log.debug("stop instance: {}".format(args.name))
 
+    _call(args, 'instance.stop', name=args.name, connection=args.connection)
+
+
+def _remove_instance(args):
+    """Handler for 'instance remove' command. Expects the following elements in args:
+        * name(str)
+
+    :param args: args from argparser
+    """
+    log.debug("remove instance: {}".format(args.name))
+
+    _call(args, 'instance.remove', name=args.name, connection=args.connection,
+          force=args.force)
+
+
+def _reboot_instance(args):
+    """Handler for 'instance reboot' command. Expects the following elements in args:
+        * name(str)
+
+    :param args: args from argparser
+    """
+    _stop_instance(args)
+    _start_instance(args)
+
+
+def _reset_instance(args):
+    """Handler for 'instance reset' command. Expects the following elements in args:
+        * name(str)
+        * timeout(int)
+
+    :param args: args from argparser
+    """
+    from . import instance
+
+    log.debug("reset instance: {}".format(args.name))
+
     tc_instance = instance.find_instance(args.name, connection=args.connection)
 
     if tc_instance is None:
-        raise TestcloudCliError("Cannot stop instance {} because it does "
+        raise TestcloudCliError("Cannot reset instance {} because it does "
                                 "not exist".format(args.name))
 
-    tc_instance.stop()
+    with tc_instance.admit():
+        tc_instance.reset(args.timeout)
+    with open(os.path.join(config_data.DATA_DIR, 'instances', args.name, 'ip'), 'r') as ip_file:
+        vm_ip = ip_file.read()
+        print("The IP of vm {}:  {}".format(args.name, vm_ip))
 
 
-def _remove_instance(args):
-    """Handler for 'instance remove' command. Expects the following elements in args:
+def _clone_instance(args):
+    """Handler for 'instance clone' command. Expects the following elements in args:
         * name(str)
+        * count(int)
 
     :param args: args from argparser
     """
-    log.debug("remove instance: {}".format(args.name))
+    from . import instance
+
+    log.debug("clone instance: {}".format(args.name))
 
     tc_instance = instance.find_instance(args.name, connection=args.connection)
 
     if tc_instance is None:
-        raise TestcloudCliError("Cannot remove instance {} because it does "
+        raise TestcloudCliError("Cannot clone instance {} because it does "
                                 "not exist".format(args.name))
 
-    tc_instance.remove(autostop=args.force)
+    # clones are named <name>-<n>, skipping names which are taken
+    names = []
+    index = 1
+    while len(names) < args.count:
+        name = "{}-{}".format(args.name, index)
+        if instance.find_instance(name, connection=args.connection) is None:
+            names.append(name)
+        index += 1
 
+    for tc_clone in tc_instance.clone(names):
+        if instance._find_domain(tc_clone.name, tc_clone.connection) != 'running':
+            print("Created clone {}".format(tc_clone.name))
+            continue
 
-def _reboot_instance(args):
-    """Handler for 'instance reboot' command. Expects the following elements in args:
+        vm_ip = find_vm_ip(tc_clone.name, tc_clone.connection)
+        tc_clone.create_ip_file(vm_ip)
+        print("The IP of vm {}:  {}".format(tc_clone.name, vm_ip))
+
+
+def _tune_instance(args):
+    """Handler for 'instance tune' command. Expects the following elements in args:
         * name(str)
+        * qos(list)
 
     :param args: args from argparser
     """
-    _stop_instance(args)
-    _start_instance(args)
+    from . import instance
+
+    log.debug("tune instance: {}".format(args.name))
+
+    qos = dict(instance.parse_qos(spec) for spec in args.qos)
+    _call(args, 'instance.tune', name=args.name, qos=qos, connection=args.connection)
+
+
+def _exec_instance(args):
+    """Handler for 'instance exec' command. Expects the following elements in args:
+        * name(str), may be a glob pattern
+        * all(bool)
+        * ssh(bool)
+        * workers(int)
+        * command(list)
+        * timeout(int)
+
+    Commands run over the guest agent of an instance if it has one, over SSH
+    otherwise. When more than one instance matches, the command runs in all of
+    them concurrently and output lines are prefixed with the instance name.
+
+    :param args: args from argparser
+    """
+    from . import instance
+    from . import ssh
+
+    command = args.command
+    if not command:
+        raise TestcloudCliError("No command given to execute")
+
+    if args.all:
+        names = [inst['name'] for inst in instance.list_instances(args.connection)
+                 if inst['state'] == 'running']
+    elif args.name is not None:
+        names = fnmatch.filter([inst['name'] for inst in instance._list_instances()],
+                               args.name)
+    else:
+        raise TestcloudCliError("Give an instance name or pattern, or use --all")
+
+    if not names:
+        raise TestcloudCliError("No instance matches {}".format(args.name or '--all'))
+
+    log.debug("exec on instances {}: {}".format(', '.join(names), command))
+
+    tc_instance = instance.find_instance(names[0], connection=args.connection)
+    if len(names) == 1 and tc_instance.guest_agent and not args.ssh:
+        exitcode, stdout, stderr = tc_instance.guest_exec(command, args.timeout)
+
+        # the output is raw bytes from the guest
+        getattr(sys.stdout, 'buffer', sys.stdout).write(stdout)
+        getattr(sys.stderr, 'buffer', sys.stderr).write(stderr)
+        sys.stdout.flush()
+    elif len(names) == 1:
+        exitcode = ssh.SSHConnection(names[0]).run(command)
+    else:
+        results = ssh.run_parallel(sorted(names), command, args.workers)
+        failed = [name for name, result in sorted(results.items()) if result != 0]
+        if failed:
+            log.error("Command failed on: {}".format(', '.join(failed)))
+        exitcode = 1 if failed else 0
+
+    if exitcode != 0:
+        raise SystemExit(exitcode)
+
+
+def _density_instance(args):
+    """Handler for 'instance density' command. Expects the following elements in args:
+        * once(bool)
+        * interval(int)
+
+    :param args: args from argparser
+    """
+    from . import density
+
+    if args.once:
+        density.adjust(args.connection)
+    else:
+        density.monitor(args.connection, args.interval)
+
+
+def _idle_instance(args):
+    """Handler for 'instance idle' command. Expects the following elements in args:
+        * action(str)
+        * idle_timeout(int)
+        * interval(int)
+
+    :param args: args from argparser
+    """
+    from . import idle
+
+    monitor = idle.IdleMonitor(args.connection, args.action, args.idle_timeout)
+    monitor.run(args.interval)
+
+
+def _reap_instance(args):
+    """Handler for 'instance reap' command. Expects the following elements in args:
+        * loop(bool)
+        * interval(int)
+        * dry_run(bool)
+
+    :param args: args from argparser
+    """
+    from . import reaper
+
+    if args.loop:
+        reaper.run(args.connection, args.interval)
+    else:
+        reaper.reap(args.connection, args.dry_run)
 
 
 ################################################################################
@@ -177,7 +395,7 @@ def _list_image(args):
     :param args: args from argparser
     """
     log.debug("list images")
-    images = image.list_images()
+    images = _call(args, 'image.list')
     print("Current Images:")
     for img in images:
         print("  {}".format(img))
@@ -189,6 +407,7 @@ def _remove_image(args):
 
     :param args: args from argparser
     """
+    from . import image
 
     log.debug("removing image {}".format(args.name))
 
@@ -202,6 +421,10 @@ def _remove_image(args):
 
 def get_argparser():
     parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--trace",
+                        metavar="FILE",
+                        help="Write timings of all phases to FILE, in Chrome "
+                             "trace-event format")
     subparsers = parser.add_subparsers(title="Command Types",
                                        description="Types of commands available",
                                        help="<command> --help")
@@ -209,8 +432,9 @@ def get_argparser():
     instarg = subparsers.add_parser("instance", help="help on instance options")
     instarg.add_argument("-c",
                          "--connection",
-                         default="qemu:///system",
-                         help="libvirt connection url to use")
+                         help="libvirt connection url to use, new instances are scheduled on "
+                              "one of HOSTS if it isn't given and {} is used "
+                              "otherwise".format(DEFAULT_CONNECTION))
     instarg_subp = instarg.add_subparsers(title="instance commands",
                                           description="Commands available for instance operations",
                                           help="<command> help")
@@ -268,6 +492,28 @@ def get_argparser():
                                 type=int,
                                 default=config_data.BOOT_TIMEOUT)
     instarg_reboot.set_defaults(func=_reboot_instance)
+    # instance reset
+    instarg_reset = instarg_subp.add_parser("reset",
+                                            help="reset the disk of an instance and reboot it")
+    instarg_reset.add_argument("name",
+                               help="name of instance to reset")
+    instarg_reset.add_argument("--timeout",
+                               help="Time (in seconds) to wait for boot to "
+                               "complete before completion, setting to 0"
+                               " disables all waiting.",
+                               type=int,
+                               default=config_data.BOOT_TIMEOUT)
+    instarg_reset.set_defaults(func=_reset_instance)
+    # instance clone
+    instarg_clone = instarg_subp.add_parser("clone",
+                                            help="create linked clones of an instance")
+    instarg_clone.add_argument("name",
+                               help="name of instance to clone")
+    instarg_clone.add_argument("--count",
+                               help="Number of clones to create.",
+                               type=int,
+                               default=1)
+    instarg_clone.set_defaults(func=_clone_instance)
     # instance create
     instarg_create = instarg_subp.add_parser("create", help="create instance")
     instarg_create.set_defaults(func=_create_instance)
@@ -301,6 +547,139 @@ def get_argparser():
                                 help="Desired instance disk size, in GB",
                                 type=int,
                                 default=config_data.DISK_SIZE)
+    instarg_create.add_argument("--profile",
+                                help="Domain profile to use, as configured in PROFILES "
+                                     "(default: %(default)s)",
+                                default=config_data.DEFAULT_PROFILE)
+    instarg_create.add_argument("--ephemeral",
+                                help="Keep the instance disks on tmpfs and use a transient "
+                                     "domain. The instance is removed by 'instance stop', or "
+                                     "by 'instance reap' if the guest shuts down by itself.",
+                                action="store_true")
+    instarg_create.add_argument("--direct-kernel",
+                                help="Boot the kernel and initrd of the image directly, "
+                                     "skipping firmware and bootloader.",
+                                action="store_true",
+                                default=config_data.DIRECT_KERNEL_BOOT)
+    instarg_create.add_argument("--guest-agent",
+                                help="Add a qemu guest agent channel, used for boot detection, "
+                                     "IP lookup and 'instance exec'.",
+                                action="store_true",
+                                default=config_data.GUEST_AGENT)
+    instarg_create.add_argument("--share",
+                                help="Share a host directory with the instance, mounted at "
+                                     "SHARE_MOUNT_DIR/<tag>. Can be given multiple times.",
+                                metavar="HOST_PATH:TAG[:ro]",
+                                action="append",
+                                default=[])
+    instarg_create.add_argument("--numa",
+                                help="Pin the instance to the least loaded host NUMA node.",
+                                action="store_true",
+                                default=config_data.NUMA_PLACEMENT)
+    instarg_create.add_argument("--group",
+                                help="Attach the instance to the NAT network of this group "
+                                     "of instances, created on demand.",
+                                default=config_data.DEFAULT_GROUP)
+    instarg_create.add_argument("--ttl",
+                                help="Time (in seconds) after which 'instance reap' removes "
+                                     "the instance, 0 keeps it.",
+                                type=int,
+                                default=config_data.DEFAULT_TTL)
+    instarg_create.add_argument("--qos",
+                                help="Limit the disk I/O, CPU or network use of the instance, "
+                                     "on top of the limits of its profile. Names are those "
+                                     "of the libvirt parameters, like total_iops_sec, "
+                                     "cpu_shares or inbound.average. Can be given multiple "
+                                     "times.",
+                                metavar="NAME=VALUE",
+                                action="append",
+                                default=[])
+
+    # instance tune
+    instarg_tune = instarg_subp.add_parser("tune",
+                                           help="change the QoS limits of an instance")
+    instarg_tune.add_argument("name",
+                              help="name of instance to tune")
+    instarg_tune.add_argument("qos",
+                              help="QoS limit to set, see 'instance create --qos', "
+                                   "0 removes it",
+                              metavar="NAME=VALUE",
+                              nargs="+")
+    instarg_tune.set_defaults(func=_tune_instance)
+
+    # instance exec
+    instarg_exec = instarg_subp.add_parser("exec",
+                                           help="run a command in instances, through their "
+                                                "guest agent or SSH")
+    instarg_exec_target = instarg_exec.add_mutually_exclusive_group()
+    instarg_exec_target.add_argument("name",
+                                     help="name of instance to run the command in, glob "
+                                          "patterns run it in all matching instances",
+                                     nargs="?")
+    instarg_exec_target.add_argument("--all",
+                                     help="run the command in all running instances",
+                                     action="store_true")
+    instarg_exec.add_argument("--ssh",
+                              help="use SSH even if the instance has a guest agent",
+                              action="store_true")
+    instarg_exec.add_argument("--workers",
+                              help="maximum number of instances running the command at once",
+                              type=int,
+                              default=config_data.SSH_WORKERS)
+    instarg_exec.add_argument("--timeout",
+                              help="Time (in seconds) to wait for the command to finish when "
+                                   "using the guest agent, setting to 0 waits forever.",
+                              type=int,
+                              default=0)
+    instarg_exec.add_argument("command",
+                              help="command to run, after '--'",
+                              nargs=argparse.REMAINDER)
+    instarg_exec.set_defaults(func=_exec_instance)
+
+    # instance density
+    instarg_density = instarg_subp.add_parser("density",
+                                              help="shrink idle instances to their working set")
+    instarg_density.add_argument("--once",
+                                 help="Adjust the instances once instead of monitoring them.",
+                                 action="store_true")
+    instarg_density.add_argument("--interval",
+                                 help="Time (in seconds) between adjustments.",
+                                 type=int,
+                                 default=config_data.DENSITY_INTERVAL)
+    instarg_density.set_defaults(func=_density_instance)
+
+    # instance idle
+    instarg_idle = instarg_subp.add_parser("idle",
+                                           help="suspend or hibernate idle instances")
+    instarg_idle.add_argument("--action",
+                              help="What to do with idle instances: pause them in memory "
+                                   "(suspend) or save them to disk (save).",
+                              choices=['suspend', 'save'],
+                              default=config_data.IDLE_ACTION)
+    instarg_idle.add_argument("--idle-timeout",
+                              help="Time (in seconds) an instance has to be idle for.",
+                              type=int,
+                              default=config_data.IDLE_TIMEOUT)
+    instarg_idle.add_argument("--interval",
+                              help="Time (in seconds) between activity checks.",
+                              type=int,
+                              default=config_data.IDLE_INTERVAL)
+    instarg_idle.set_defaults(func=_idle_instance)
+
+    # instance reap
+    instarg_reap = instarg_subp.add_parser("reap",
+                                           help="remove expired instances and leaked resources")
+    instarg_reap.add_argument("--loop",
+                              help="Keep reaping every --interval seconds.",
+                              action="store_true")
+    instarg_reap.add_argument("--interval",
+                              help="Time (in seconds) between runs with --loop.",
+                              type=int,
+                              default=config_data.REAPER_INTERVAL)
+    instarg_reap.add_argument("--dry-run",
+                              help="Only show what would be removed.",
+                              action="store_true")
+    instarg_reap.set_defaults(func=_reap_instance)
 
     imgarg = subparsers.add_parser("image", help="help on image options")
     imgarg_subp = imgarg.add_subparsers(title="subcommands",
@@ -334,15 +713,51 @@ def _configure_logging(level=logging.DEBUG):
     logging.basicConfig(format='%(levelname)s:%(message)s', level=level)
 
 
-def main():
+def parse_args(argv=None):
+    """Parse the command line. Everything after the first ``--`` is the command
+    of 'instance exec', so neither its first word is taken for an instance name
+    nor its options for options of testcloud.
+
+    :param list argv: arguments, defaults to ``sys.argv[1:]``
+    :returns: :py:class:`argparse.Namespace` of the arguments
+    """
+
     parser = get_argparser()
-    args = parser.parse_args()
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if '--' not in argv:
+        return parser.parse_args(argv)
+
+    split = argv.index('--')
+    args = parser.parse_args(argv[:split])
+    if not hasattr(args, 'command'):
+        parser.error("unrecognized arguments: {}".format(' '.join(argv[split:])))
+    args.command = argv[split + 1:]
+    return args
 
+
+def main():
+    args = parse_args()
+
+    # Only log to a file when specifically configured to
+    if config_data.LOG_FILE is not None:
+        logging.basicConfig(filename=config_data.LOG_FILE, level=logging.DEBUG)
     _configure_logging()
 
-    args.func(args)
+    # only creating instances picks a host by itself
+    if getattr(args, 'connection', '') is None and args.func is not _create_instance:
+        args.connection = DEFAULT_CONNECTION
+
+    if args.trace:
+        trace.start_recording()
 
+    try:
+        args.func(args)
+    finally:
+        if args.trace:
+            trace.write(args.trace)
 
+
+@trace.traced('find_vm_ip')
 def find_vm_ip(name, connection='qemu:///system'):
     """Finds the ip of a local vm given it's name used by libvirt.
 
@@ -351,16 +766,45 @@ def find_vm_ip(name, connection='qemu:///system'):
     :returns: ip address of VM
     :rtype: str
     """
+    from . import instance
+    from . import network
+    from . import util
+
+    # suspended and saved instances don't answer until they are woken up
+    tc_instance = instance.find_instance(name, connection=connection)
+    if tc_instance is not None:
+        tc_instance.wake()
+        # instances know the host they run on
+        connection = tc_instance.connection
+
+    # instances with a reserved address don't need any lookup
+    address = network.lookup(name)
+    if address is not None:
+        return address['ip']
+
+    with trace.span('find_vm_ip.domain_xml'):
+        for _ in xrange(100):
+            vm_xml = util.get_vm_xml(name, connection)
+            if vm_xml is not None:
+                break
+
+            else:
+                sleep(.2)
+        else:
+            raise DomainNotFoundError
 
-    for _ in xrange(100):
-        vm_xml = util.get_vm_xml(name, connection)
-        if vm_xml is not None:
-            break
+    # the guest agent knows the address without waiting for the arp cache
+    if util.find_guest_agent(vm_xml) is not None:
+        try:
+            with trace.span('find_vm_ip.agent'):
+                for _ in range(100):
+                    vm_ip = util.find_ip_from_agent(name, connection)
+                    if vm_ip:
+                        return vm_ip
 
-        else:
-            sleep(.2)
-    else:
-        raise DomainNotFoundError
+                    sleep(.2)
+        except TestcloudInstanceError as e:
+            log.debug("{}, falling back to arp".format(e))
 
     vm_mac = util.find_mac(vm_xml)
     vm_mac = vm_mac[0]
@@ -368,14 +812,15 @@ def find_vm_ip(name, connection='qemu:///system'):
     #  The arp cache takes some time to populate, so this keeps looking
     #  for the entry until it shows up.
 
-    for _ in xrange(100):
-        vm_ip = util.find_ip_from_mac(vm_mac.attrib['address'])
+    with trace.span('find_vm_ip.arp'):
+        for _ in xrange(100):
+            vm_ip = util.find_ip_from_mac(vm_mac.attrib['address'])
 
-        if vm_ip:
-            break
+            if vm_ip:
+                break
 
-        sleep(.2)
-    else:
-        raise TestcloudInstanceError('Could not find VM\'s ip before timeout')
+            sleep(.2)
+        else:
+            raise TestcloudInstanceError('Could not find VM\'s ip before timeout')
 
     return vm_ip
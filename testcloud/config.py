@@ -1,5 +1,9 @@
 import os
-import imp
+import sys
+import ast
+import types
+import marshal
+import hashlib
 
 import testcloud
 
@@ -13,6 +17,14 @@ CONF_DIRS = [DEFAULT_CONF_DIR,
 
 CONF_FILE = 'settings.py'
 
+# snapshots of the values of parsed config files
+CACHE_DIR = '{}/testcloud'.format(os.environ.get('XDG_CACHE_HOME') or
+                                  '{}/.cache'.format(os.environ['HOME']))
+
+# environment variables named ENV_PREFIX + a config value name override it,
+# ENV_PREFIX + 'CONFIG' names the config file to use instead of searching
+ENV_PREFIX = 'TESTCLOUD_'
+
 _config = None
 
 
@@ -29,6 +41,35 @@ def get_config():
     return _config
 
 
+class _LazyConfig(object):
+    '''Stands in for the config instance of :func:`get_config`, which is only
+    retrieved once a value is read or set.
+    '''
+
+    def __getattr__(self, name):
+        return getattr(get_config(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_config(), name, value)
+
+    def __delattr__(self, name):
+        delattr(get_config(), name)
+
+
+_lazy_config = _LazyConfig()
+
+
+def lazy_config():
+    '''Retrieve the config instance like :func:`get_config`, but don't parse
+    the config file before the first value is used. Meant for module level
+    ``config_data`` globals, so importing testcloud doesn't read any config.
+
+    :return: proxy to the :class:`.ConfigData` returned by :func:`get_config`
+    '''
+
+    return _lazy_config
+
+
 def _parse_config():
     '''Parse config file in a supported location and merge with default values.
 
@@ -36,11 +77,12 @@ def _parse_config():
     '''
 
     config = ConfigData()
-    config_filename = _find_config_file()
+    config_filename = os.environ.get(ENV_PREFIX + 'CONFIG') or _find_config_file()
 
     if config_filename is not None:
-        loaded_config = _load_config(config_filename)
-        config.merge_object(loaded_config)
+        config.merge_values(_load_config_values(config_filename))
+
+    config.merge_environ(os.environ)
 
     return config
 
@@ -67,7 +109,7 @@ def _load_config(conf_filename):
     :return: object containing configuration values
     '''
 
-    new_conf = imp.new_module('config')
+    new_conf = types.ModuleType('config')
     new_conf.__file__ = conf_filename
     try:
         with open(conf_filename, 'r') as conf_file:
@@ -79,6 +121,89 @@ def _load_config(conf_filename):
     return new_conf
 
 
+def _snapshot_path(conf_filename):
+    return '{}/settings-{}.snapshot'.format(
+        CACHE_DIR, hashlib.sha1(conf_filename.encode('utf-8')).hexdigest())
+
+
+def _load_config_values(conf_filename):
+    '''Load the configuration values of a python file, like :func:`_load_config`.
+    The values are kept in a snapshot in ``CACHE_DIR``, which is used instead
+    of executing the file again for as long as its mtime and size don't change.
+
+    :param conf_filename: full path to config file to load
+    :type conf_filename: str
+    :return: dict of configuration values
+    '''
+
+    conf_filename = os.path.abspath(conf_filename)
+    stat = os.stat(conf_filename)
+    key = (conf_filename, stat.st_mtime, stat.st_size, sys.hexversion)
+    snapshot_path = _snapshot_path(conf_filename)
+
+    try:
+        with open(snapshot_path, 'rb') as snapshot_file:
+            snapshot_key, values = marshal.load(snapshot_file)
+        if tuple(snapshot_key) == key:
+            return values
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        pass
+
+    loaded_config = _load_config(conf_filename)
+    values = dict((name, getattr(loaded_config, name)) for name in dir(loaded_config)
+                  if name.isupper())
+
+    # values marshal can't store, like functions, are simply not cached
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        tmp_path = '{}.{}'.format(snapshot_path, os.getpid())
+        with open(tmp_path, 'wb') as snapshot_file:
+            marshal.dump((key, values), snapshot_file)
+        os.rename(tmp_path, snapshot_path)
+    except (IOError, OSError, ValueError):
+        pass
+
+    return values
+
+
+def _parse_env_value(name, value, default):
+    '''Convert the value of an environment variable to the type of the
+    default value it overrides.
+
+    :raises ValueError: if the value doesn't fit the type
+    '''
+
+    if isinstance(default, bool):
+        if value.lower() in ('1', 'true', 'yes', 'on'):
+            return True
+        if value.lower() in ('0', 'false', 'no', 'off', ''):
+            return False
+        raise ValueError('{}{} must be a boolean, not {}'.format(ENV_PREFIX, name, value))
+
+    if isinstance(default, (int, float)):
+        try:
+            return type(default)(value)
+        except ValueError:
+            raise ValueError('{}{} must be a number, not {}'.format(ENV_PREFIX, name, value))
+
+    if isinstance(default, (list, tuple, dict)):
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            raise ValueError('{}{} must be a python literal, not {}'.format(
+                ENV_PREFIX, name, value))
+
+    if default is None:
+        # unset values may be anything, plain strings need no quotes
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+
+    return value
+
+
 class ConfigData(object):
     '''Holds configuration data for TestCloud. Is initialized with default
     values which can be overridden.
@@ -91,10 +216,20 @@ class ConfigData(object):
 
     DATA_DIR = "/var/lib/testcloud"
     STORE_DIR = "/var/lib/testcloud/backingstores"
+    # tmpfs directory holding the disks of ephemeral instances
+    EPHEMERAL_DIR = "/dev/shm/testcloud"
+    # kernels and initrds extracted from images for direct kernel boot
+    KERNEL_DIR = "/var/lib/testcloud/kernels"
+
+    # UNIX socket of testcloudd, used by the CLI whenever testcloudd runs
+    DAEMON_SOCKET = "/var/lib/testcloud/testcloudd.sock"
 
     # libvirt domain XML Template
     # This lives either in the DEFAULT_CONF_DIR or DATA_DIR
     XML_TEMPLATE = "domain-template.jinja"
+    # Write a copy of the domain XML of new instances to their directory. The
+    # XML is passed to libvirt directly, the copy is only for reference.
+    KEEP_DOMAIN_XML = True
 
     # Data for cloud-init
 
@@ -122,9 +257,63 @@ runcmd:
 
     CMD_LINE_ARGS = []
 
+    # Boot the kernel and initrd of the image directly, skipping firmware and
+    # the bootloader. The root device in the command line must match the image.
+    DIRECT_KERNEL_BOOT = False
+    KERNEL_CMDLINE = ("root=/dev/vda1 ro console=tty1 console=ttyS0,115200n8 "
+                      "no_timer_check net.ifnames=0 quiet")
+
     # timeout, in seconds for instance boot process
     BOOT_TIMEOUT = 30
 
+    # Add a qemu guest agent channel to new instances. The agent is then used
+    # to detect the end of the boot, to find the IP and for 'instance exec'.
+    # The image must run qemu-guest-agent.
+    GUEST_AGENT = False
+
+    # Sharing host directories with 'instance create --share': the driver is
+    # 'virtiofs', '9p' or 'auto' (virtiofs if the hypervisor supports it).
+    # Shares are mounted in the guest under SHARE_MOUNT_DIR/<tag>.
+    SHARE_DRIVER = 'auto'
+    SHARE_MOUNT_DIR = '/mnt'
+
+    # Pool of libvirt connection uris (like 'qemu+ssh://host/system') new
+    # instances are scheduled on when no connection is given, picking the host
+    # running the fewest domains. DATA_DIR must be shared by all hosts, the
+    # instance disks are created in it.
+    HOSTS = []
+
+    # libvirt network instances are attached to. With STATIC_ADDRESSES, every
+    # instance gets an IP from the DHCP range of the network reserved for its
+    # MAC before it is defined, so its IP is known without waiting for boot.
+    # The reservations are added to the network, persistently for persistent
+    # networks, and removed with the instance.
+    NETWORK = 'default'
+    STATIC_ADDRESSES = False
+
+    # Instances created with a group ('instance create --group') get a NAT
+    # network of the group named GROUP_NETWORK_PREFIX<group>, on a /24 subnet
+    # of NETWORK_POOL, instead of NETWORK.
+    DEFAULT_GROUP = None
+    GROUP_NETWORK_PREFIX = 'testcloud-'
+    NETWORK_POOL = '10.123.0.0/16'
+
+    # SSH access to instances for 'instance exec'. Without SSH_KEY, PASSWORD is
+    # used through sshpass. Connections are kept open for SSH_CONTROL_PERSIST
+    # seconds after the last command and shared by all commands.
+    SSH_USER = 'fedora'
+    SSH_KEY = None
+    SSH_CONTROL_PERSIST = 600
+    # maximum number of instances running a command at once
+    SSH_WORKERS = 16
+
+    # Regular expressions matched against the serial console output of a
+    # booting instance, the instance is up as soon as one of them matches.
+    # With no markers, the instance is up once it has a network interface.
+    # Images need to log to the serial console for markers to work, e.g.
+    # [r'Cloud-init v\. \S+ finished at'] for cloud-init.
+    BOOT_READY_MARKERS = []
+
     # ram size, in MiB
     RAM = 512
 
@@ -132,6 +321,128 @@ runcmd:
     # identical to source image
     DISK_SIZE = 0
 
+    # Domain profiles, selectable per instance. Every profile inherits the
+    # values of the 'default' profile and overrides only what it sets.
+    DEFAULT_PROFILE = 'default'
+    PROFILES = {
+        'default': {
+            'vcpus': 1,
+            'cpu_mode': 'custom',  # 'custom' (kvm64) or 'host-passthrough'
+            'net_model': 'rtl8139',
+            'net_queues': 0,  # virtio-net multiqueue, 0 disables it
+            'disk_cache': None,  # e.g. 'none', 'writeback'
+            'disk_io': None,  # e.g. 'native', 'threads', 'io_uring'
+            'disk_discard': None,  # e.g. 'unmap'
+            # qcow2 options of the overlay disk: cluster size (e.g. '128k'),
+            # preallocation (e.g. 'metadata', needs extended L2 entries),
+            # lazy refcounts and extended L2 entries (sub-cluster allocation)
+            'disk_cluster_size': None,
+            'disk_preallocation': None,
+            'disk_lazy_refcounts': False,
+            'disk_extended_l2': False,
+            # maximum size of the qcow2 metadata (L2 and refcount) cache of
+            # qemu for the disk, in bytes, None keeps the qemu default
+            'disk_metadata_cache': None,
+            'iothreads': 0,
+            'rng': False,  # virtio-rng fed from /dev/urandom
+            'hugepages': False,
+            # guest memory may be merged with identical pages by host KSM
+            'ksm': True,
+            # seconds between guest balloon statistics updates, 0 disables them
+            'balloon_stats': 0,
+            # hand memory freed by the guest back to the host
+            'free_page_reporting': False,
+            # QoS limits by libvirt parameter name, like 'total_iops_sec',
+            # 'cpu_shares' or 'inbound.average', see 'instance create --qos'
+            'qos': {},
+        },
+        'performance': {
+            'vcpus': 2,
+            'cpu_mode': 'host-passthrough',
+            'net_model': 'virtio',
+            'net_queues': 2,
+            'disk_cache': 'none',
+            'disk_io': 'io_uring',
+            'disk_discard': 'unmap',
+            'disk_lazy_refcounts': True,
+            'iothreads': 1,
+            'rng': True,
+            'ksm': False,
+        },
+        'hugepages': {
+            'vcpus': 2,
+            'cpu_mode': 'host-passthrough',
+            'net_model': 'virtio',
+            'net_queues': 2,
+            'disk_cache': 'none',
+            'disk_io': 'io_uring',
+            'disk_discard': 'unmap',
+            'disk_lazy_refcounts': True,
+            'iothreads': 1,
+            'rng': True,
+            'hugepages': True,
+            'ksm': False,
+        },
+        # packs many idle guests on a host, see 'testcloud instance density'
+        'density': {
+            'net_model': 'virtio',
+            'rng': True,
+            'ksm': True,
+            'balloon_stats': 5,
+            'free_page_reporting': True,
+        },
+        # keeps busy instances from starving the others on a shared host
+        'shared': {
+            'qos': {'total_iops_sec': 500, 'total_iops_sec_max': 2000,
+                    'total_iops_sec_max_length': 10, 'total_bytes_sec': 50 * 1024 ** 2,
+                    'cpu_shares': 512, 'vcpu_period': 100000, 'vcpu_quota': 50000,
+                    'inbound.average': 10240, 'outbound.average': 10240},
+        },
+    }
+
+    # Pin the vCPUs and bind the memory of new instances to the least loaded
+    # host NUMA node
+    NUMA_PLACEMENT = False
+
+    # Admission control: queue instance boots until the host has the memory
+    # and CPU for them and limit the number of instances booting at once
+    ADMISSION_CONTROL = False
+    MAX_BOOTING = 4
+    # memory, in MiB, always kept free for the host
+    ADMISSION_RESERVED_RAM = 1024
+    # running vCPUs allowed per host CPU
+    ADMISSION_CPU_RATIO = 4
+    # seconds to wait for admission and between resource checks
+    ADMISSION_TIMEOUT = 600
+    ADMISSION_POLL = 2
+
+    # Memory density: 'testcloud instance density' shrinks instances using a
+    # profile with balloon_stats towards their working set plus headroom
+    # (a fraction of it), never below DENSITY_MIN_RAM MiB. Changes smaller
+    # than DENSITY_STEP MiB are not applied.
+    DENSITY_MIN_RAM = 256
+    DENSITY_HEADROOM = 0.25
+    DENSITY_STEP = 32
+    DENSITY_INTERVAL = 10
+
+    # Idle policy: 'testcloud instance idle' suspends (pauses in memory) or
+    # saves (hibernates to disk) instances using at most IDLE_CPU of a host CPU
+    # and IDLE_IO bytes per second of disk and network I/O for IDLE_TIMEOUT
+    # seconds. Starting them, or looking up their address, wakes them up.
+    IDLE_ACTION = 'suspend'
+    IDLE_TIMEOUT = 1800
+    IDLE_CPU = 0.05
+    IDLE_IO = 65536
+    IDLE_INTERVAL = 60
+
+    # Reaper: 'testcloud instance reap' removes instances DEFAULT_TTL seconds
+    # after creation (0 keeps them), instance directories without a domain,
+    # orphaned ephemeral disks and domains using disks of removed instances.
+    # Anything modified within REAPER_GRACE seconds is left alone.
+    DEFAULT_TTL = 0
+    REAPER_GRACE = 600
+    REAPER_INTERVAL = 300
+
     def merge_object(self, obj):
         '''Overwrites default values with values from a python object which have
         names containing all upper case letters.
@@ -143,3 +454,29 @@ runcmd:
         for key in dir(obj):
             if key.isupper():
                 setattr(self, key, getattr(obj, key))
+
+    def merge_values(self, values):
+        '''Overwrites default values with values from a dict.
+
+        :param dict values: configuration values by name
+        '''
+
+        for key, value in values.items():
+            setattr(self, key, value)
+
+    def merge_environ(self, environ):
+        '''Overwrites values with ``TESTCLOUD_<NAME>`` environment variables.
+        They are converted to the type of the value they override, lists and
+        dicts are given as python literals.
+
+        :param dict environ: environment variables, like :data:`os.environ`
+        :raises ValueError: if a variable doesn't fit the type of its value
+        '''
+
+        for key, value in environ.items():
+            if not key.startswith(ENV_PREFIX):
+                continue
+
+            name = key[len(ENV_PREFIX):]
+            if name.isupper() and hasattr(self, name):
+                setattr(self, name, _parse_env_value(name, value, getattr(self, name)))
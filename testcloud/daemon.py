@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+"""
+testcloudd, an optional long running testcloud process. It serves the most
+frequent operations as a small JSON-RPC 2.0 API on a UNIX socket, one request
+and one response per line, while keeping the modules, the config and the
+libvirt connections loaded. The CLI calls it whenever it's running, so listing,
+stopping or looking up instances doesn't pay for connecting every time.
+"""
+
+import os
+import json
+import socket
+import signal
+import logging
+import argparse
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from . import config
+from . import exceptions
+from .exceptions import TestcloudCliError
+
+config_data = config.lazy_config()
+
+log = logging.getLogger('testcloud.daemon')
+
+#: JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+SERVER_ERROR = -32000
+
+#: API methods by name
+METHODS = {}
+
+
+def method(name):
+    """Register a function as API method ``name``. Methods take keyword
+    arguments only and return JSON serializable values."""
+
+    def decorator(func):
+        METHODS[name] = func
+        return func
+    return decorator
+
+
+def _get_instance(name, connection, action):
+    from . import instance
+
+    tc_instance = instance.find_instance(name, connection=connection)
+    if tc_instance is None:
+        raise TestcloudCliError("Cannot {} instance {} because it does "
+                                "not exist".format(action, name))
+    return tc_instance
+
+
+@method('instance.list')
+def _list_instances(connection='qemu:///system'):
+    from . import instance
+
+    return instance.list_instances(connection)
+
+
+@method('instance.start')
+def _start_instance(name, connection='qemu:///system', timeout=None):
+    tc_instance = _get_instance(name, connection, 'start')
+    with tc_instance.admit():
+        tc_instance.start(timeout)
+
+
+@method('instance.stop')
+def _stop_instance(name, connection='qemu:///system'):
+    _get_instance(name, connection, 'stop').stop()
+
+
+@method('instance.remove')
+def _remove_instance(name, connection='qemu:///system', force=False):
+    _get_instance(name, connection, 'remove').remove(autostop=force)
+
+
+@method('instance.tune')
+def _tune_instance(name, qos, connection='qemu:///system'):
+    _get_instance(name, connection, 'tune').tune(qos)
+
+
+@method('instance.ip')
+def _instance_ip(name, connection='qemu:///system'):
+    # the lookup lives in the cli, which imports this module
+    from . import cli
+    return cli.find_vm_ip(name, connection)
+
+
+@method('image.list')
+def _list_images():
+    from . import image
+
+    return image.list_images()
+
+
+def handle(request):
+    """Run a single JSON-RPC request.
+
+    :param dict request: the decoded request
+    :returns: the response, ``None`` for notifications
+    :rtype: dict
+    """
+
+    if not isinstance(request, dict) or not isinstance(request.get('method'), (str, type(u''))):
+        return _error(None, INVALID_REQUEST, "Invalid request")
+
+    request_id = request.get('id')
+    func = METHODS.get(request['method'])
+    if func is None:
+        response = _error(request_id, METHOD_NOT_FOUND,
+                          "Method not found: {}".format(request['method']))
+    else:
+        try:
+            response = {'jsonrpc': '2.0', 'id': request_id,
+                        'result': func(**request.get('params', {}))}
+        except (Exception, exceptions.TestcloudException, exceptions.DomainNotFoundError) as e:
+            log.debug("{} failed: {}".format(request['method'], e))
+            response = _error(request_id, SERVER_ERROR, str(e), type(e).__name__)
+
+    return response if 'id' in request else None
+
+
+def _error(request_id, code, message, error_type=None):
+    error = {'code': code, 'message': message}
+    if error_type is not None:
+        error['data'] = {'type': error_type}
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': error}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in iter(self.rfile.readline, b''):
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError:
+                response = _error(None, PARSE_ERROR, "Parse error")
+            else:
+                response = handle(request)
+
+            if response is not None:
+                self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+                self.wfile.flush()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """The testcloudd socket server, handling every client in a thread."""
+
+    daemon_threads = True
+
+    def __init__(self, path=None):
+        """
+        :param str path: path of the socket, defaults to ``DAEMON_SOCKET``
+        :raises TestcloudCliError: if another testcloudd serves the socket
+        """
+
+        path = config_data.DAEMON_SOCKET if path is None else path
+        client = connect(path)
+        if client is not None:
+            client.close()
+            raise TestcloudCliError("testcloudd is already running on {}".format(path))
+        if os.path.exists(path):
+            # left behind by a testcloudd which didn't exit cleanly
+            os.remove(path)
+
+        socketserver.UnixStreamServer.__init__(self, path, _RequestHandler)
+        # the API can do anything the daemon user can
+        os.chmod(path, 0o600)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+
+class Client(object):
+    """A connection to testcloudd."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self.last_id = 0
+
+    def call(self, method, **params):
+        """Call an API method.
+
+        :param str method: name of the method
+        :returns: the result of the method
+        :raises: the testcloud exception raised by the method, or
+                 :py:class:`TestcloudCliError` for other errors
+        """
+
+        self.last_id += 1
+        request = {'jsonrpc': '2.0', 'id': self.last_id, 'method': method, 'params': params}
+        self.sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+        line = self.rfile.readline()
+        if not line:
+            raise TestcloudCliError("testcloudd closed the connection")
+        response = json.loads(line.decode('utf-8'))
+
+        if 'error' in response:
+            error_type = response['error'].get('data', {}).get('type')
+            error_class = getattr(exceptions, error_type or '', None)
+            if not (isinstance(error_class, type) and
+                    issubclass(error_class, exceptions.TestcloudException)):
+                error_class = TestcloudCliError
+            raise error_class(response['error']['message'])
+        return response['result']
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def connect(path=None):
+    """Connect to testcloudd.
+
+    :param str path: path of the socket, defaults to ``DAEMON_SOCKET``
+    :returns: :py:class:`Client`, or ``None`` if testcloudd isn't running
+    """
+
+    path = config_data.DAEMON_SOCKET if path is None else path
+    if not path or not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    return Client(sock)
+
+
+def _overrides_config(environ=None):
+    """Check whether the environment overrides the config of this process, see
+    :py:meth:`testcloud.config.ConfigData.merge_environ`. testcloudd runs with
+    its own config, only picking the socket doesn't change anything else.
+
+    :param dict environ: environment, defaults to :py:data:`os.environ`
+    :rtype: bool
+    """
+
+    environ = os.environ if environ is None else environ
+    for key in environ:
+        name = key[len(config.ENV_PREFIX):]
+        if not key.startswith(config.ENV_PREFIX) or name == 'DAEMON_SOCKET':
+            continue
+        if name == 'CONFIG' or (name.isupper() and hasattr(config.ConfigData, name)):
+            return True
+    return False
+
+
+def call(method, **params):
+    """Call an API method in testcloudd if it's running, in this process
+    otherwise. Both behave the same, as long as no ``TESTCLOUD_*`` environment
+    variable overrides the config, which always runs the method here.
+
+    :param str method: name of the method
+    :returns: the result of the method
+    """
+
+    client = None if _overrides_config() else connect()
+    if client is None:
+        return METHODS[method](**params)
+
+    try:
+        return client.call(method, **params)
+    finally:
+        client.close()
+
+
+def serve(path=None):
+    """Serve the API until SIGTERM or SIGINT.
+
+    :param str path: path of the socket, defaults to ``DAEMON_SOCKET``
+    """
+
+    from . import util
+
+    util.keep_connections()
+    server = Server(path)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever(), which runs in this thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    log.info("testcloudd listening on {}".format(server.server_address))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the testcloud API on a UNIX socket.")
+    parser.add_argument("--socket",
+                        help="Path of the socket (default: %(default)s)",
+                        default=config_data.DAEMON_SOCKET)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
+    serve(args.socket)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+"""
+Memory density monitor. Reads the balloon statistics of running instances and
+resizes their balloons so idle guests give their unused memory back to the
+host and busy guests get it back under pressure.
+"""
+
+import time
+import logging
+
+import libvirt
+
+from . import config
+from . import instance
+from . import util
+
+config_data = config.lazy_config()
+
+log = logging.getLogger('testcloud.density')
+
+
+def balloon_target(stats, min_ram=None, headroom=None):
+    """Compute the balloon size, in KiB, for a guest from its balloon stats.
+    The target is the guest's working set (memory it can't give up without
+    swapping) plus headroom, kept between ``min_ram`` and the maximum memory
+    of the domain.
+
+    :param dict stats: ``balloon.*`` values from bulk domain stats
+    :param int min_ram: lower bound of the target, in MiB
+    :param float headroom: fraction of the working set to add on top of it
+    :returns: target balloon size in KiB or ``None`` if the guest doesn't
+              report the needed statistics
+    """
+
+    min_ram = config_data.DENSITY_MIN_RAM if min_ram is None else min_ram
+    headroom = config_data.DENSITY_HEADROOM if headroom is None else headroom
+
+    try:
+        available = stats['balloon.available']
+        usable = stats['balloon.usable']
+        maximum = stats['balloon.maximum']
+    except KeyError:
+        return None
+
+    # available is the memory the guest kernel sees, usable what it could
+    # free up without swapping
+    working_set = available - usable
+    target = int(working_set * (1 + headroom))
+
+    return max(min(target, maximum), min(min_ram * 1024, maximum))
+
+
+def _density_domains():
+    """Find the running testcloud instances with balloon statistics enabled.
+
+    :returns: set of domain names
+    """
+
+    names = set()
+    for inst in instance._list_instances():
+        if instance.Instance(inst['name']).metadata.get('density'):
+            names.add(inst['name'])
+    return names
+
+
+def adjust(connection='qemu:///system'):
+    """Resize the balloons of all density instances once.
+
+    :param str connection: libvirt connection uri
+    :returns: dict of domain name -> new memory size in KiB, for all domains
+              which were resized
+    """
+
+    conn = util.open_connection(connection)
+    names = _density_domains()
+    resized = {}
+
+    domain_stats = conn.getAllDomainStats(libvirt.VIR_DOMAIN_STATS_BALLOON,
+                                          libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_RUNNING)
+    for domain, stats in domain_stats:
+        if domain.name() not in names:
+            continue
+
+        target = balloon_target(stats)
+        if target is None:
+            log.debug("No balloon stats for {} yet".format(domain.name()))
+            continue
+
+        if abs(target - stats['balloon.current']) < config_data.DENSITY_STEP * 1024:
+            continue
+
+        log.info("Resizing {} from {} to {} MiB".format(domain.name(),
+                                                        stats['balloon.current'] // 1024,
+                                                        target // 1024))
+        try:
+            domain.setMemoryFlags(target, libvirt.VIR_DOMAIN_AFFECT_LIVE)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                # the domain disappeared in the meantime, just ignore
+                continue
+            raise e
+        resized[domain.name()] = target
+
+    return resized
+
+
+def monitor(connection='qemu:///system', interval=None):
+    """Keep resizing the balloons of density instances every ``interval``
+    seconds, until interrupted.
+
+    :param str connection: libvirt connection uri
+    :param int interval: seconds between adjustments, defaults to the
+                         ``DENSITY_INTERVAL`` config value
+    """
+
+    interval = config_data.DENSITY_INTERVAL if interval is None else interval
+
+    while True:
+        adjust(connection)
+        time.sleep(interval)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+"""
+Idle policy for long-lived instances. Instances using next to no CPU and I/O
+for a while are paused (``suspend``) or hibernated to disk (``save``) to free
+host resources. :py:meth:`testcloud.instance.Instance.start` and
+:py:meth:`testcloud.instance.Instance.wake` bring them back.
+"""
+
+import time
+import logging
+
+import libvirt
+
+from . import config
+from . import instance
+from . import util
+
+config_data = config.lazy_config()
+
+log = logging.getLogger('testcloud.idle')
+
+#: bulk domain stats needed to tell whether an instance is idle
+IDLE_STATS = (libvirt.VIR_DOMAIN_STATS_CPU_TOTAL |
+              libvirt.VIR_DOMAIN_STATS_BLOCK |
+              libvirt.VIR_DOMAIN_STATS_INTERFACE)
+
+
+def activity(stats):
+    """Sum up the activity counters of a domain from its bulk stats.
+
+    :param dict stats: bulk domain stats
+    :returns: tuple of (cpu time in ns, bytes of block and network I/O)
+    """
+
+    io_bytes = 0
+    for key, value in stats.items():
+        if key.startswith('block.') and key.endswith(('.rd.bytes', '.wr.bytes')):
+            io_bytes += value
+        elif key.startswith('net.') and key.endswith(('.rx.bytes', '.tx.bytes')):
+            io_bytes += value
+
+    return stats.get('cpu.time', 0), io_bytes
+
+
+def is_idle(previous, current, elapsed, cpu_threshold=None, io_threshold=None):
+    """Decide whether a domain was idle between two activity samples.
+
+    :param tuple previous: earlier result of :py:func:`activity`
+    :param tuple current: later result of :py:func:`activity`
+    :param float elapsed: seconds between the samples
+    :param float cpu_threshold: highest CPU usage, as a fraction of one host
+                                CPU, of an idle domain
+    :param int io_threshold: highest I/O rate, in bytes per second, of an
+                             idle domain
+    :rtype: bool
+    """
+
+    cpu_threshold = config_data.IDLE_CPU if cpu_threshold is None else cpu_threshold
+    io_threshold = config_data.IDLE_IO if io_threshold is None else io_threshold
+
+    if elapsed <= 0:
+        return False
+
+    cpu_usage = (current[0] - previous[0]) / (elapsed * 1e9)
+    io_rate = (current[1] - previous[1]) / elapsed
+
+    return cpu_usage <= cpu_threshold and io_rate <= io_threshold
+
+
+class IdleMonitor(object):
+    """Tracks the activity of running instances and applies the idle action
+    to instances which stayed idle for ``IDLE_TIMEOUT`` seconds.
+    """
+
+    def __init__(self, connection='qemu:///system', action=None, timeout=None):
+        """
+        :param str connection: libvirt connection uri
+        :param str action: ``suspend`` or ``save``, defaults to ``IDLE_ACTION``
+        :param int timeout: seconds an instance has to be idle for, defaults to
+                            ``IDLE_TIMEOUT``
+        """
+
+        self.connection = connection
+        self.action = config_data.IDLE_ACTION if action is None else action
+        self.timeout = config_data.IDLE_TIMEOUT if timeout is None else timeout
+        # domain name -> (sample time, activity, idle since)
+        self._samples = {}
+
+    def check(self):
+        """Sample all running instances once and put the ones idle for long
+        enough to rest.
+
+        :returns: list of names of the instances put to rest
+        """
+
+        conn = util.open_connection(self.connection)
+        names = set(inst['name'] for inst in instance._list_instances())
+        now = time.time()
+        rested = []
+        samples = {}
+
+        for domain, stats in conn.getAllDomainStats(
+                IDLE_STATS, libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_RUNNING):
+            name = domain.name()
+            if name not in names:
+                continue
+
+            current = activity(stats)
+            idle_since = now
+            if name in self._samples:
+                sampled, previous, since = self._samples[name]
+                if is_idle(previous, current, now - sampled):
+                    idle_since = since
+
+            if now - idle_since >= self.timeout and self.timeout > 0:
+                self._rest(name)
+                rested.append(name)
+                continue
+
+            samples[name] = (now, current, idle_since)
+
+        # instances which stopped or were put to rest start over
+        self._samples = samples
+        return rested
+
+    def _rest(self, name):
+        """Apply the idle action to an instance."""
+
+        tc_instance = instance.Instance(name, connection=self.connection)
+        log.info("Instance {} is idle, {}".format(name, 'hibernating it' if self.action == 'save'
+                                                  else 'suspending it'))
+        try:
+            if self.action == 'save':
+                tc_instance.hibernate()
+            else:
+                tc_instance.suspend()
+        except libvirt.libvirtError as e:
+            log.warning("Could not put idle instance {} to rest: {}".format(name, e))
+
+    def run(self, interval=None):
+        """Keep checking instances every ``interval`` seconds, until interrupted.
+
+        :param int interval: seconds between checks, defaults to ``IDLE_INTERVAL``
+        """
+
+        interval = config_data.IDLE_INTERVAL if interval is None else interval
+
+        while True:
+            self.check()
+            time.sleep(interval)
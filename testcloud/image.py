@@ -10,17 +10,19 @@ Representation of a cloud image which can be used to boot instances
 
 import sys
 import os
+import glob
+import json
+import hashlib
 import subprocess
 import re
 import shutil
 import logging
 
-import requests
-
 from . import config
+from . import trace
 from .exceptions import TestcloudImageError
 
-config_data = config.get_config()
+config_data = config.lazy_config()
 
 log = logging.getLogger('testcloud.image')
 
@@ -109,6 +111,7 @@ class Image(object):
         image_name = name_match[-1]
         return {'type': uri_type, 'name': image_name, 'path': uri_path}
 
+    @trace.traced('image.download')
     def _download_remote_image(self, remote_url, local_path):
         """Download a remote image to the local system, outputting download
         progress as it's downloaded.
@@ -118,6 +121,8 @@ class Image(object):
             will be downloaded to
         """
 
+        import requests
+
         u = requests.get(remote_url, stream=True)
         if u.status_code == 404:
             raise TestcloudImageError('Image not found at the given URL: {}'.format(self.uri))
@@ -171,18 +176,18 @@ class Image(object):
         :param image_path: path to the image to change the context of
         """
 
-        selinux_active = subprocess.call(['selinuxenabled'])
+        selinux_active = trace.call(['selinuxenabled'])
 
         if selinux_active != 0:
             log.debug('SELinux not enabled, not changing context of'
                       'image {}'.format(image_path))
             return
 
-        image_context = subprocess.call(['chcon',
-                                         '-h',
-                                         '-u', 'system_u',
-                                         '-t', 'virt_content_t',
-                                         image_path])
+        image_context = trace.call(['chcon',
+                                    '-h',
+                                    '-u', 'system_u',
+                                    '-t', 'virt_content_t',
+                                    image_path])
         if image_context == 0:
             log.debug('successfully changed SELinux context for '
                       'image {}'.format(image_path))
@@ -190,6 +195,7 @@ class Image(object):
             log.error('Error while changing SELinux context on '
                       'image {}'.format(image_path))
 
+    @trace.traced('image.prepare')
     def prepare(self, copy=True):
         """Prepare the image for local use by either downloading the image from
         a remote location or copying/linking it into the image store from a locally
@@ -212,6 +218,92 @@ class Image(object):
 
         return self.local_path
 
+    def digest(self):
+        """Compute the sha256 digest of the local image. Digests are cached by
+        path, size and modification time of the image so every image is only
+        hashed once.
+
+        :returns: hex digest of the image
+        :rtype: str
+        """
+
+        from . import util
+
+        stat = os.stat(self.local_path)
+        key = '{}:{}:{}'.format(os.path.realpath(self.local_path), stat.st_size,
+                                int(stat.st_mtime))
+        cache_path = '{}/image-digests.json'.format(config_data.DATA_DIR)
+
+        with util.file_lock('{}.lock'.format(cache_path)):
+            try:
+                with open(cache_path, 'r') as cache_file:
+                    digests = json.load(cache_file)
+            except (IOError, ValueError):
+                digests = {}
+
+            if key not in digests:
+                log.debug("computing digest of {}".format(self.local_path))
+                sha = hashlib.sha256()
+                with open(self.local_path, 'rb') as image_file:
+                    for block in iter(lambda: image_file.read(1024 * 1024), b''):
+                        sha.update(block)
+                digests[key] = sha.hexdigest()
+
+                with open(cache_path, 'w') as cache_file:
+                    json.dump(digests, cache_file)
+
+        return digests[key]
+
+    @trace.traced('image.extract_kernel')
+    def extract_kernel(self):
+        """Extract the kernel and initrd of the image for direct kernel boot.
+        They are extracted once per image and kept in ``KERNEL_DIR``, keyed by
+        the image digest, where all instances booting the image share them.
+
+        :returns: tuple of (kernel path, initrd path)
+        :raises TestcloudImageError: if the kernel or initrd can't be extracted
+        """
+
+        from . import util
+
+        kernel_dir = '{}/{}'.format(config_data.KERNEL_DIR, self.digest())
+        kernel = '{}/vmlinuz'.format(kernel_dir)
+        initrd = '{}/initrd.img'.format(kernel_dir)
+
+        if not os.path.isdir(config_data.KERNEL_DIR):
+            os.makedirs(config_data.KERNEL_DIR)
+
+        with util.file_lock('{}.lock'.format(kernel_dir)):
+            if os.path.exists(kernel) and os.path.exists(initrd):
+                return kernel, initrd
+
+            log.info("extracting kernel and initrd from {}".format(self.local_path))
+            tmp_dir = '{}.tmp'.format(kernel_dir)
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir)
+            os.makedirs(tmp_dir)
+
+            extract = trace.call(['virt-builder', '--get-kernel', self.local_path,
+                                  '--output', tmp_dir])
+            kernels = glob.glob('{}/*vmlinuz*'.format(tmp_dir))
+            initrds = glob.glob('{}/*initramfs*'.format(tmp_dir))
+            if extract != 0 or not kernels or not initrds:
+                shutil.rmtree(tmp_dir)
+                raise TestcloudImageError("Unable to extract kernel and initrd from "
+                                          "{}".format(self.local_path))
+
+            os.rename(kernels[0], '{}/vmlinuz'.format(tmp_dir))
+            os.rename(initrds[0], '{}/initrd.img'.format(tmp_dir))
+            if os.path.isdir(kernel_dir):
+                # left incomplete, the rename fails on non-empty directories
+                shutil.rmtree(kernel_dir)
+            os.rename(tmp_dir, kernel_dir)
+
+            self._adjust_image_selinux(kernel)
+            self._adjust_image_selinux(initrd)
+
+        return kernel, initrd
+
     def remove(self):
         """Remove the image from disk. This operation cannot be undone.
         """
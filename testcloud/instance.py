@@ -9,22 +9,30 @@ Representation of a Testcloud spawned (or to-be-spawned) virtual machine
 """
 
 import os
-import sys
 import subprocess
-import glob
+import contextlib
+import json
 import logging
+import re
 import time
 
+import base64
 import libvirt
+import libvirt_qemu
 import shutil
 import uuid
-import jinja2
+import xml.etree.ElementTree as ET
 
+from . import admission
 from . import config
+from . import network
+from . import placement
+from . import scheduler
+from . import trace
 from . import util
 from .exceptions import TestcloudInstanceError
 
-config_data = config.get_config()
+config_data = config.lazy_config()
 
 log = logging.getLogger('testcloud.instance')
 
@@ -39,6 +47,27 @@ DOMAIN_STATUS_ENUM = {libvirt.VIR_DOMAIN_NOSTATE: 'no state',
                       libvirt.VIR_DOMAIN_PMSUSPENDED: 'suspended'
                       }
 
+#: QoS limits of the disk, by the names of their libvirt typed parameters
+IOTUNE_LIMITS = ('total_bytes_sec', 'read_bytes_sec', 'write_bytes_sec',
+                 'total_iops_sec', 'read_iops_sec', 'write_iops_sec',
+                 'total_bytes_sec_max', 'read_bytes_sec_max', 'write_bytes_sec_max',
+                 'total_iops_sec_max', 'read_iops_sec_max', 'write_iops_sec_max',
+                 'total_bytes_sec_max_length', 'read_bytes_sec_max_length',
+                 'write_bytes_sec_max_length', 'total_iops_sec_max_length',
+                 'read_iops_sec_max_length', 'write_iops_sec_max_length',
+                 'size_iops_sec')
+#: QoS limits of the vCPUs, mapped to their ``cputune`` element
+CPUTUNE_LIMITS = {'cpu_shares': 'shares', 'vcpu_period': 'period', 'vcpu_quota': 'quota'}
+#: QoS limits of the network interface, in KiB/s (burst in KiB)
+BANDWIDTH_LIMITS = ('inbound.average', 'inbound.peak', 'inbound.burst',
+                    'outbound.average', 'outbound.peak', 'outbound.burst')
+# values libvirt takes for removing a CPU limit of a running domain, for
+# which 0 means leaving it unchanged
+_CPUTUNE_UNSET = {'cpu_shares': 1024, 'vcpu_quota': -1}
+
+# jinja environments by template search path, shared by all instances
+_jinja_envs = {}
+
 
 def _list_instances():
     """List existing instances currently known to testcloud
@@ -64,6 +93,39 @@ def _list_instances():
     return instance_list
 
 
+def _list_metadata():
+    """Load the metadata of all existing instances
+
+    :returns: list of metadata dicts, one for every instance which has any
+    """
+
+    metadata = []
+    instance_dir = '{}/instances'.format(config_data.DATA_DIR)
+    for name in os.listdir(instance_dir):
+        try:
+            with open('{0}/{1}/{1}-metadata.json'.format(instance_dir, name), 'r') as meta:
+                metadata.append(json.load(meta))
+        except (IOError, ValueError):
+            continue
+
+    return metadata
+
+
+def _domain_state(domain):
+    """Get the state of a domain as a string from ``DOMAIN_STATUS_ENUM``. Shut
+    off domains with a managed save image are reported as ``saved``, starting
+    them restores the saved state.
+
+    :param domain: libvirt domain object
+    :rtype: str
+    """
+
+    state = DOMAIN_STATUS_ENUM[domain.state()[0]]
+    if state == 'shutoff' and domain.hasManagedSaveImage(0):
+        return 'saved'
+    return state
+
+
 def _list_domains(connection):
     """List known domains for a given hypervisor connection.
 
@@ -73,13 +135,13 @@ def _list_domains(connection):
     """
 
     domains = {}
-    conn = libvirt.openReadOnly(connection)
+    conn = util.open_connection(connection, readonly=True)
     for domain in conn.listAllDomains():
         try:
             # the libvirt docs seem to indicate that the second int is for state
             # details, only used when state is ERROR, so only looking at the first
             # int returned for domain.state()
-            domains[domain.name()] = DOMAIN_STATUS_ENUM[domain.state()[0]]
+            domains[domain.name()] = _domain_state(domain)
         except libvirt.libvirtError as e:
             if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
                 # the domain disappeared in the meantime, just ignore
@@ -99,10 +161,10 @@ def _find_domain(name, connection):
     :rtype: str or None
     '''
 
-    conn = libvirt.openReadOnly(connection)
+    conn = util.open_connection(connection, readonly=True)
     try:
         domain = conn.lookupByName(name)
-        return DOMAIN_STATUS_ENUM[domain.state()[0]]
+        return _domain_state(domain)
     except libvirt.libvirtError as e:
         if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
                 # no such domain
@@ -111,12 +173,243 @@ def _find_domain(name, connection):
             raise e
 
 
+def _get_template(name):
+    """Get a domain XML template. Templates are loaded and compiled once per
+    process and only reloaded when their file changes. The compiled code is
+    also kept in ``DATA_DIR/jinja-cache``, so new processes don't compile it
+    again.
+
+    :param str name: file name of the template, looked up in the testcloud
+                     conf directory and ``DATA_DIR``
+    :rtype: jinja2.Template
+    """
+
+    import jinja2
+
+    searchpath = (config.DEFAULT_CONF_DIR, config_data.DATA_DIR)
+    env = _jinja_envs.get(searchpath)
+    if env is None:
+        cache_dir = '{}/jinja-cache'.format(config_data.DATA_DIR)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+        except OSError:
+            pass
+        # without a writable cache directory, templates are compiled once per process
+        bytecode_cache = (jinja2.FileSystemBytecodeCache(cache_dir)
+                          if os.access(cache_dir, os.W_OK) else None)
+        env = jinja2.Environment(loader=jinja2.FileSystemLoader(searchpath=list(searchpath)),
+                                 trim_blocks=True, lstrip_blocks=True,
+                                 bytecode_cache=bytecode_cache)
+        _jinja_envs[searchpath] = env
+
+    return env.get_template(name)
+
+
+def get_profile(name):
+    """Resolve a domain profile by name. Profiles inherit all values from the
+    ``default`` profile and override only the values they set. The profiles
+    shipped with testcloud stay available when ``PROFILES`` is configured,
+    configured profiles of the same name replace them.
+
+    :param str name: name of the profile, as configured in ``PROFILES``
+    :returns: dictionary of profile values
+    :rtype: dict
+    :raises TestcloudInstanceError: if no such profile is configured
+    """
+
+    profiles = dict(config.ConfigData.PROFILES, **config_data.PROFILES)
+    if name not in profiles:
+        raise TestcloudInstanceError("Unknown profile {}, configured profiles are: "
+                                     "{}".format(name, ', '.join(sorted(profiles))))
+
+    profile = dict(config.ConfigData.PROFILES['default'])
+    profile.update(config_data.PROFILES.get('default', {}))
+    profile.update(profiles[name])
+
+    return profile
+
+
+def parse_share(spec):
+    """Parse a share specification of the form ``host_path:tag[:ro]``.
+
+    :param str spec: share specification
+    :returns: dict with ``source`` (absolute host path), ``tag`` and ``readonly``
+    :rtype: dict
+    :raises TestcloudInstanceError: if the specification is invalid
+    """
+
+    parts = spec.split(':')
+    if len(parts) not in (2, 3) or not all(parts[:2]) or parts[2:] not in ([], ['ro'], ['rw']):
+        raise TestcloudInstanceError("Invalid share {}, expected "
+                                     "host_path:tag[:ro]".format(spec))
+
+    source = os.path.abspath(parts[0])
+    if not os.path.isdir(source):
+        raise TestcloudInstanceError("Shared directory {} does not exist".format(source))
+
+    return {'source': source, 'tag': parts[1], 'readonly': parts[2:] == ['ro']}
+
+
+def parse_qos(spec):
+    """Parse a QoS limit of the form ``name=value``. Names are those of the
+    libvirt typed parameters: one of :py:data:`IOTUNE_LIMITS`, the keys of
+    :py:data:`CPUTUNE_LIMITS` or one of :py:data:`BANDWIDTH_LIMITS`. A value of
+    0 removes the limit, and the I/O burst limits depending on it.
+
+    :param str spec: QoS limit specification
+    :returns: tuple of (name, value)
+    :raises TestcloudInstanceError: if the specification is invalid
+    """
+
+    name, _, value = spec.partition('=')
+    if name not in IOTUNE_LIMITS + tuple(CPUTUNE_LIMITS) + BANDWIDTH_LIMITS:
+        raise TestcloudInstanceError("Unknown QoS limit {}, expected one of: {}".format(
+            name, ', '.join(IOTUNE_LIMITS + tuple(sorted(CPUTUNE_LIMITS)) + BANDWIDTH_LIMITS)))
+
+    try:
+        value = int(value)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise TestcloudInstanceError("Invalid QoS limit {}, expected name=<number>".format(spec))
+
+    return name, value
+
+
+def _iotune_base(name):
+    """Get the I/O limit a burst limit depends on: ``<limit>_max`` needs
+    ``<limit>`` and ``<limit>_max_length`` needs ``<limit>_max``.
+
+    :returns: name of the limit, ``None`` for limits depending on none
+    """
+
+    if name.endswith('_max_length'):
+        return name[:-len('_length')]
+    if name.endswith('_max'):
+        return name[:-len('_max')]
+    return None
+
+
+def _iotune_dependents(name):
+    """Get the burst limits which depend on an I/O limit, see
+    :py:func:`_iotune_base`."""
+
+    return [limit for limit in IOTUNE_LIMITS if limit != name and
+            limit.startswith(name + '_max')]
+
+
+def _qos_values(qos):
+    """Split QoS limits into the ``iotune``, ``cputune`` and ``bandwidth``
+    values of the domain template. Unset limits (0) are left out, and so are
+    I/O burst limits whose base limit is unset, which libvirt rejects.
+
+    :param dict qos: QoS limits by name, see :py:func:`parse_qos`
+    :rtype: dict
+    """
+
+    def is_set(name):
+        base = _iotune_base(name)
+        return bool(qos.get(name)) and (base is None or is_set(base))
+
+    values = {'iotune': {}, 'cputune': {}, 'bandwidth': {}}
+    for name, value in qos.items():
+        if not value or (name in IOTUNE_LIMITS and not is_set(name)):
+            continue
+        if name in CPUTUNE_LIMITS:
+            values['cputune'][CPUTUNE_LIMITS[name]] = value
+        elif name in BANDWIDTH_LIMITS:
+            direction, limit = name.split('.')
+            values['bandwidth'].setdefault(direction, {})[limit] = value
+        else:
+            values['iotune'][name] = value
+
+    return values
+
+
+def _overlay_options(profile):
+    """Get the ``qemu-img create -o`` options of the overlay disk of an
+    instance from the values of its profile.
+
+    :param dict profile: profile values, see :py:func:`get_profile`
+    :returns: comma separated qcow2 creation options
+    :rtype: str
+    :raises TestcloudInstanceError: if the options can't be combined
+    """
+
+    options = []
+    if profile.get('disk_cluster_size'):
+        options.append('cluster_size={}'.format(profile['disk_cluster_size']))
+    if profile.get('disk_preallocation'):
+        # qemu refuses preallocating overlays without sub-cluster allocation
+        if not profile.get('disk_extended_l2'):
+            raise TestcloudInstanceError("disk_preallocation of an overlay needs "
+                                         "disk_extended_l2 enabled")
+        options.append('preallocation={}'.format(profile['disk_preallocation']))
+    if profile.get('disk_lazy_refcounts'):
+        options.append('lazy_refcounts=on')
+    if profile.get('disk_extended_l2'):
+        options.append('extended_l2=on')
+
+    return ','.join(options)
+
+
+def _clone_domain_xml(domain_xml, name, disk, seed, console_log):
+    """Turn the XML of a domain into the XML of a clone of it, with its own
+    name, UUID, disks and console log. Devices and their addresses are kept, so
+    the guest of the clone sees the same hardware. Details libvirt fills in for
+    every domain (channel sockets, pty paths, security labels, backing chains)
+    and CPU pinning are dropped.
+
+    :param str domain_xml: XML of the original domain
+    :param str name: name of the clone
+    :param str disk: path of the overlay of the clone
+    :param str seed: path of the seed image of the clone
+    :param str console_log: path of the serial console log of the clone
+    :returns: :py:class:`xml.etree.ElementTree.Element` of the domain XML
+    """
+
+    root = ET.fromstring(domain_xml)
+    root.find('name').text = name
+    root.find('uuid').text = str(uuid.uuid4())
+
+    for element in root.findall('./devices/disk'):
+        dev = element.find('target').get('dev')
+        if dev in ('vda', 'vdb'):
+            element.find('source').set('file', disk if dev == 'vda' else seed)
+        for backing_store in element.findall('backingStore'):
+            element.remove(backing_store)
+
+    for log_file in root.findall('./devices/serial/log'):
+        log_file.set('file', console_log)
+
+    for path, tag in (('./devices/channel', 'source'),
+                      ('./devices/serial', 'source'),
+                      ('./devices/console', 'source'),
+                      ('./devices/interface', 'target'),
+                      ('./seclabel', 'label'),
+                      ('./seclabel', 'imagelabel'),
+                      ('./cputune', 'vcpupin'),
+                      ('./cputune', 'emulatorpin'),
+                      ('.', 'numatune')):
+        for parent in root.findall(path):
+            for element in parent.findall(tag):
+                parent.remove(element)
+
+    # CPU limits are kept, pinning isn't
+    for cputune in root.findall('cputune'):
+        if not len(cputune):
+            root.remove(cputune)
+
+    return root
+
+
 def find_instance(name, image=None, connection='qemu:///system'):
     """Find an instance using a given name and image, if it exists.
 
-    Please note that ``connection`` is not taken into account when searching for the instance, but
-    the instance object returned has the specified connection set. It's your responsibility to
-    make sure the provided connection is valid for this instance.
+    Please note that ``connection`` is not taken into account when searching for the instance.
+    Instances remember the host they were created on and the instance object returned uses
+    that connection, ``connection`` is only used for instances which don't know their host.
 
     :param str name: name of instance to find
     :param image: instance of :py:class:`testcloud.image.Image`
@@ -132,18 +425,38 @@ def find_instance(name, image=None, connection='qemu:///system'):
 
 
 def list_instances(connection='qemu:///system'):
-    """List instances known by testcloud and the state of each instance
+    """List instances known by testcloud and the state of each instance. The
+    domains of all hosts in ``HOSTS`` and of all hosts instances were created
+    on are listed concurrently.
 
     :param connection: libvirt compatible connection to use when listing domains
+                       of instances which don't know their host
     :returns: dictionary of instance_name to domain_state mapping
     """
-    domains = _list_domains(connection)
     all_instances = _list_instances()
+    tc_instances = dict((instance['name'], Instance(instance['name'], connection=connection))
+                        for instance in all_instances)
+
+    hosts = set([connection]) | set(config_data.HOSTS)
+    hosts |= set(tc_instance.connection for tc_instance in tc_instances.values())
+    host_domains = scheduler.map_hosts(_list_domains, hosts)
 
     instances = []
 
     for instance in all_instances:
-        if instance['name'] not in domains.keys():
+        tc_instance = tc_instances[instance['name']]
+        instance['connection'] = tc_instance.connection
+        domains = host_domains[tc_instance.connection]
+
+        if domains is None:
+            # nothing is known about instances of hosts which are down
+            instance['state'] = 'unreachable'
+
+            instances.append(instance)
+
+        elif instance['name'] not in domains.keys():
+            # also ephemeral instances which stopped or are still being
+            # created, removing them is up to the reaper
             log.warn('{} is not registered, might want to delete it.'.format(instance['name']))
             instance['state'] = 'de-sync'
 
@@ -151,8 +464,12 @@ def list_instances(connection='qemu:///system'):
 
         else:
 
-            # Add the state of the instance
+            # Add the state of the instance, instances paused by the idle
+            # policy are reported as suspended
             instance['state'] = domains[instance['name']]
+            if (instance['state'] == 'paused' and
+                    tc_instance.metadata.get('idle') == 'suspended'):
+                instance['state'] = 'suspended'
 
             instances.append(instance)
 
@@ -164,15 +481,31 @@ class Instance(object):
     defined on the local system, using an existing :py:class:`Image`.
     """
 
-    def __init__(self, name, image=None, connection='qemu:///system', hostname=None):
+    def __init__(self, name, image=None, connection='qemu:///system', hostname=None,
+                 ephemeral=False):
         self.name = name
         self.image = image
-        self.connection = connection
         self.path = "{}/instances/{}".format(config_data.DATA_DIR, self.name)
-        self.seed_path = "{}/{}-seed.img".format(self.path, self.name)
         self.meta_path = "{}/meta".format(self.path)
-        self.local_disk = "{}/{}-local.qcow2".format(self.path, self.name)
         self.xml_path = "{}/{}-domain.xml".format(self.path, self.name)
+        self.metadata_path = "{}/{}-metadata.json".format(self.path, self.name)
+        self.console_log = "{}/{}-console.log".format(self.path, self.name)
+
+        #: testcloud specific data about the instance, persisted in its directory
+        self.metadata = self._load_metadata()
+
+        # instances stay on the host they were created on
+        self.connection = self.metadata.get('connection', connection)
+
+        # ephemeral instances keep their disks on tmpfs and use a transient
+        # domain, which is gone once stopped
+        self.ephemeral = ephemeral or self.metadata.get('ephemeral', False)
+        if self.ephemeral:
+            self.disk_path = "{}/{}".format(config_data.EPHEMERAL_DIR, self.name)
+        else:
+            self.disk_path = self.path
+        self.seed_path = "{}/{}-seed.img".format(self.disk_path, self.name)
+        self.local_disk = "{}/{}-local.qcow2".format(self.disk_path, self.name)
 
         self.ram = config_data.RAM
         # desired size of disk, in GiB
@@ -180,6 +513,20 @@ class Instance(object):
         self.vnc = False
         self.graphics = False
         self.atomic = False
+        self.profile = config_data.DEFAULT_PROFILE
+        self.numa = config_data.NUMA_PLACEMENT
+        self.direct_kernel = config_data.DIRECT_KERNEL_BOOT
+        self.ready_markers = config_data.BOOT_READY_MARKERS
+        self.guest_agent = self.metadata.get('guest_agent', config_data.GUEST_AGENT)
+        #: host directories shared with the instance, see :py:func:`parse_share`
+        self.shares = self.metadata.get('shares', [])
+        #: instances of a group share a network of their own, see
+        #: :py:func:`testcloud.network.group_network`
+        self.group = self.metadata.get('group', config_data.DEFAULT_GROUP)
+        #: seconds after creation when the reaper removes the instance, 0 keeps it
+        self.ttl = config_data.DEFAULT_TTL
+        #: QoS limits on top of those of the profile, see :py:func:`parse_qos`
+        self.qos = {}
         self.seed = None
         self.kernel = None
         self.initrd = None
@@ -189,12 +536,20 @@ class Instance(object):
         self.backing_store = image.local_path if image else None
         self.image_path = config_data.STORE_DIR + self.name + ".qcow2"
 
+    @trace.traced('instance.prepare')
     def prepare(self):
         """Create local directories and metadata needed to spawn the instance
         """
         # create the dirs needed for this instance
         self._create_dirs()
 
+        # pick how host directories are shared, the guest needs to know it
+        # for mounting them
+        if self.shares:
+            self.metadata['shares'] = self.shares
+            self.metadata['share_driver'] = self._share_driver()
+            self.save_metadata()
+
         # generate metadata
         self._create_user_data(config_data.PASSWORD)
         self._create_meta_data(self.hostname)
@@ -212,6 +567,17 @@ class Instance(object):
             os.makedirs(self.path)
             os.makedirs(self.meta_path)
 
+        if self.ephemeral:
+            if not os.path.isdir(self.disk_path):
+                os.makedirs(self.disk_path)
+            self.metadata['ephemeral'] = True
+            self.save_metadata()
+
+        if self.ttl:
+            # see testcloud.reaper
+            self.metadata['expires'] = int(time.time()) + self.ttl
+            self.save_metadata()
+
     def _create_user_data(self, password, overwrite=False, atomic=False):
         """Save the right  password to the 'user-data' file needed to
         emulate cloud-init. Default username on cloud images is "fedora"
@@ -225,7 +591,10 @@ class Instance(object):
         else:
             file_data = config_data.USER_DATA % password
 
-        data_path = '{}/meta/user-data'.format(self.path)
+        if self.shares:
+            file_data = file_data.rstrip() + '\n' + self._mounts_user_data()
+
+        data_path = '{}/user-data'.format(self.meta_path)
 
         if (os.path.isfile(data_path) and overwrite) or not os.path.isfile(data_path):
             with open(data_path, 'w') as user_file:
@@ -235,6 +604,46 @@ class Instance(object):
             log.debug("user-data file already exists for instance {}. Not"
                       " regerating.".format(self.name))
 
+    def _share_driver(self):
+        """Pick the driver used for sharing host directories: ``SHARE_DRIVER``
+        or, if that is ``auto``, virtiofs when the hypervisor supports it and
+        9p otherwise.
+
+        :returns: ``virtiofs`` or ``9p``
+        """
+
+        if config_data.SHARE_DRIVER != 'auto':
+            return config_data.SHARE_DRIVER
+
+        conn = util.open_connection(self.connection)
+        try:
+            caps = ET.fromstring(conn.getDomainCapabilities(None, 'x86_64', None, 'kvm'))
+        except libvirt.libvirtError:
+            return '9p'
+
+        drivers = [value.text for value in caps.findall(
+            "./devices/filesystem/enum[@name='driverType']/value")]
+        return 'virtiofs' if 'virtiofs' in drivers else '9p'
+
+    def _mounts_user_data(self):
+        """cloud-config ``mounts`` section mounting all shares of the instance
+        under ``SHARE_MOUNT_DIR``."""
+
+        driver = self.metadata.get('share_driver', '9p')
+        lines = ['mounts:']
+        for share in self.shares:
+            if driver == 'virtiofs':
+                fstype, options = 'virtiofs', ['defaults']
+            else:
+                fstype, options = '9p', ['trans=virtio', 'version=9p2000.L']
+            if share['readonly']:
+                options.append('ro')
+            options.append('nofail')
+            mountpoint = '{}/{}'.format(config_data.SHARE_MOUNT_DIR, share['tag'])
+            lines.append('  - [ {}, {}, {}, "{}" ]'.format(share['tag'], mountpoint, fstype,
+                                                           ','.join(options)))
+        return '\n'.join(lines) + '\n'
+
     def _create_meta_data(self, hostname, overwrite=False):
         """Save the required hostname data to the 'meta-data' file needed to
         emulate cloud-init.
@@ -254,17 +663,18 @@ class Instance(object):
             log.debug("meta-data file already exists for instance {}. Not"
                       " regerating.".format(self.name))
 
+    @trace.traced('instance.seed_image')
     def _generate_seed_image(self):
         """Create a virtual filesystem needed for boot with virt-make-fs on a
         given path (it should probably be somewhere in '/tmp'."""
 
         log.debug("creating seed image {}".format(self.seed_path))
 
-        make_image = subprocess.call(['virt-make-fs',
-                                      '--type=msdos',
-                                      '--label=cidata',
-                                      self.meta_path,
-                                      self.seed_path])
+        make_image = trace.call(['virt-make-fs',
+                                 '--type=msdos',
+                                 '--label=cidata',
+                                 self.meta_path,
+                                 self.seed_path])
 
         # Check the subprocess.call return value for success
         if make_image == 0:
@@ -274,8 +684,8 @@ class Instance(object):
             raise TestcloudInstanceError("Failure during seed image generation")
 
     def _extract_initrd_and_kernel(self):
-        """Download the necessary kernel and initrd for booting a specified
-        cloud image."""
+        """Get the kernel and initrd for direct kernel boot of the instance
+        from the shared cache, see :py:meth:`testcloud.image.Image.extract_kernel`."""
 
         if self.image is None:
             raise TestcloudInstanceError("attempted to access image "
@@ -283,49 +693,195 @@ class Instance(object):
                                          "that information was not supplied "
                                          "at creation time".format(self.name))
 
-        log.info("extracting kernel and initrd from {}".format(self.image.local_path))
-        subprocess.call(['virt-builder', '--get-kernel',
-                         self.image.local_path],
-                        cwd=self.path)
+        self.kernel, self.initrd = self.image.extract_kernel()
 
-        self.kernel = glob.glob("%s/*vmlinuz*" % self.path)[0]
-        self.initrd = glob.glob("%s/*initramfs*" % self.path)[0]
+    @trace.traced('instance.local_disk')
+    def _create_local_disk(self, path=None, backing_store=None, size=None):
+        """Create a instance using the backing store provided by Image. The
+        format of the backing store is passed on explicitly and the overlay is
+        created with the ``disk_*`` options of the profile of the instance
+        (see :py:func:`_overlay_options`).
 
-        if self.kernel is None or self.initrd is None:
-            raise IndexError("Unable to find kernel or initrd, did they " +
-                             "download?")
-            sys.exit(1)
+        :param str path: where to create the overlay, :py:attr:`local_disk` by default
+        :param str backing_store: backing image of the overlay, the image of
+                                  the instance by default
+        :param int size: size of the overlay in bytes, :py:attr:`disk_size` by default
+        :returns: return code of ``qemu-img create``
+        """
 
-    def _create_local_disk(self):
-        """Create a instance using the backing store provided by Image."""
+        if backing_store is None:
+            if self.image is None:
+                raise TestcloudInstanceError("attempted to access image "
+                                             "information for instance {} but "
+                                             "that information was not supplied "
+                                             "at creation time".format(self.name))
+            backing_store = self.image.local_path
 
-        if self.image is None:
-            raise TestcloudInstanceError("attempted to access image "
-                                         "information for instance {} but "
-                                         "that information was not supplied "
-                                         "at creation time".format(self.name))
+        options = _overlay_options(get_profile(self.metadata.get('profile', self.profile)))
 
         imgcreate_command = ['qemu-img',
                              'create',
                              '-f',
                              'qcow2',
                              '-b',
-                             self.image.local_path,
-                             self.local_disk,
+                             backing_store,
+                             '-F',
+                             self._disk_info(backing_store)['format'],
                              ]
+        if options:
+            imgcreate_command.extend(['-o', options])
+        imgcreate_command.append(self.local_disk if path is None else path)
 
         # make sure to expand the resultant disk if the size is set
-        if self.disk_size > 0:
+        if size is not None:
+            imgcreate_command.append(str(size))
+        elif self.disk_size > 0:
             imgcreate_command.append("{}G".format(self.disk_size))
 
-        subprocess.call(imgcreate_command)
+        return trace.call(imgcreate_command)
+
+    def _disk_info(self, path):
+        """Get the details of a disk image from ``qemu-img info``.
+
+        :param str path: path of the disk image
+        :returns: dict of image details, like ``virtual-size`` and ``backing-filename``
+        """
+
+        output = subprocess.check_output(['qemu-img', 'info', '--output=json', path])
+        return json.loads(output.decode('utf-8'))
+
+    def _load_metadata(self):
+        """Load the stored metadata of the instance.
+
+        :returns: metadata dict, empty if none was stored yet
+        """
+
+        try:
+            with open(self.metadata_path, 'r') as metadata_file:
+                return json.load(metadata_file)
+        except IOError:
+            return {}
+
+    def save_metadata(self):
+        """Write :py:attr:`metadata` to the instance directory."""
+
+        with open(self.metadata_path, 'w') as metadata_file:
+            json.dump(self.metadata, metadata_file, indent=2, sort_keys=True)
+
+    def _place_numa(self, vcpus):
+        """Pick a host NUMA node for the instance and record the placement in
+        the instance metadata. Placements are tracked only in the metadata of
+        existing instances, so removing an instance releases its placement.
+
+        :param int vcpus: number of vCPUs of the instance
+        :returns: placement dict (see :py:func:`testcloud.placement.place`) or
+                  ``None`` if the host has a single NUMA node
+        """
+
+        conn = util.open_connection(self.connection)
+        topology = placement.parse_topology(conn.getCapabilities())
+
+        with util.file_lock('{}/placement.lock'.format(config_data.DATA_DIR)):
+            assignments = [meta['numa'] for meta in _list_metadata() if meta.get('numa')]
+            numa = placement.place(topology, vcpus, self.ram, assignments)
+
+            self.metadata['numa'] = numa
+            self.save_metadata()
+
+        return numa
+
+    def admit(self, timeout=None):
+        """Wait for the host to have the resources to boot this instance, see
+        :py:func:`testcloud.admission.admit`. Use as a context manager around
+        the boot of the instance.
+
+        :param int timeout: seconds to wait for admission
+        """
+
+        vcpus = self.metadata.get('vcpus', get_profile(self.profile)['vcpus'])
+        ram = self.metadata.get('ram', self.ram)
+        return admission.admit(util.open_connection(self.connection), ram, vcpus, timeout)
 
     def _get_domain(self):
         """Create the connection to libvirt to control instance lifecycle.
         returns: libvirt domain object"""
-        conn = libvirt.open(self.connection)
+        conn = util.open_connection(self.connection)
         return conn.lookupByName(self.name)
 
+    @trace.traced('instance.tune')
+    def tune(self, qos):
+        """Change QoS limits of the instance. Running instances get them right
+        away, persistent ones also keep them for their next boot.
+
+        :param dict qos: QoS limits by name, see :py:func:`parse_qos`. Limits
+                         set to 0 are removed together with the I/O burst
+                         limits depending on them, others are left as they
+                         are.
+        :raises TestcloudInstanceError: if the instance does not exist, a burst
+                                        limit is set while removing its base
+                                        limit or libvirt rejects the limits
+        """
+
+        qos = dict(qos)
+        for name, value in list(qos.items()):
+            if name not in IOTUNE_LIMITS or value:
+                continue
+            for dependent in _iotune_dependents(name):
+                if qos.get(dependent):
+                    raise TestcloudInstanceError("Can't set {} while removing {}".format(
+                        dependent, name))
+                qos[dependent] = 0
+
+        if _find_domain(self.name, self.connection) is None:
+            raise TestcloudInstanceError("Instance doesn't exist: {}".format(self.name))
+
+        dom = self._get_domain()
+        flags = 0
+        if dom.isActive():
+            flags |= libvirt.VIR_DOMAIN_AFFECT_LIVE
+        if dom.isPersistent():
+            flags |= libvirt.VIR_DOMAIN_AFFECT_CONFIG
+
+        iotune = dict((name, value) for name, value in qos.items() if name in IOTUNE_LIMITS)
+        cputune = dict((name, value or _CPUTUNE_UNSET.get(name, 0))
+                       for name, value in qos.items() if name in CPUTUNE_LIMITS)
+        bandwidth = dict((name, value) for name, value in qos.items()
+                         if name in BANDWIDTH_LIMITS)
+
+        try:
+            if iotune:
+                dom.setBlockIoTune('vda', iotune, flags)
+            if cputune:
+                dom.setSchedulerParametersFlags(cputune, flags)
+            if bandwidth:
+                mac = util.find_mac(dom.XMLDesc())[0].get('address')
+                dom.setInterfaceParameters(mac, bandwidth, flags)
+        except libvirt.libvirtError as e:
+            raise TestcloudInstanceError("Can't tune instance {}: {}".format(self.name, e))
+
+        log.info("Tuned instance {}: {}".format(
+            self.name, ', '.join('{}={}'.format(*item) for item in sorted(qos.items()))))
+
+    def _allocate_address(self, network_name=None):
+        """Get a MAC address for the instance. With ``STATIC_ADDRESSES``, the
+        MAC and IP address are allocated and reserved on the network (see
+        :py:func:`testcloud.network.allocate`), so the IP is known before the
+        instance boots and is written to its ``ip`` file right away.
+
+        :param str network_name: libvirt network of the instance, defaults to
+                                 ``NETWORK``
+        :returns: tuple of (MAC address, network name)
+        """
+
+        network_name = config_data.NETWORK if network_name is None else network_name
+
+        if not config_data.STATIC_ADDRESSES:
+            return util.generate_mac_address(), network_name
+
+        address = network.allocate(self.name, self.connection, network_name)
+        self.create_ip_file(address['ip'])
+        return address['mac'], address['network']
+
     def create_ip_file(self, ip):
         """Write the ip address found after instance creation to a file
            for easier management later. This is likely going to break
@@ -335,19 +891,26 @@ class Instance(object):
                                               self.name), 'w') as ip_file:
             ip_file.write(ip)
 
+    @trace.traced('instance.write_domain_xml')
     def write_domain_xml(self):
         """Load the default xml template, and populate it with the following:
          - name
          - uuid
          - locations of disks
          - network mac address
+         - values of the selected profile (see :py:func:`get_profile`)
+         - QoS limits of the profile and :py:attr:`qos`
+         - NUMA placement, if enabled
+         - kernel, initrd and kernel command line for direct kernel boot
+
+        A copy of the XML is written to :py:attr:`xml_path` unless the
+        ``KEEP_DOMAIN_XML`` config value is disabled.
+
+        :returns: the domain XML
+        :rtype: str
         """
 
-        # Set up the jinja environment
-        jinjaLoader = jinja2.FileSystemLoader(searchpath=[config.DEFAULT_CONF_DIR,
-                                                          config_data.DATA_DIR])
-        jinjaEnv = jinja2.Environment(loader=jinjaLoader)
-        xml_template = jinjaEnv.get_template(config_data.XML_TEMPLATE)
+        xml_template = _get_template(config_data.XML_TEMPLATE)
 
         # Stuff our values in a dict
         instance_values = {'domain_name': self.name,
@@ -355,24 +918,69 @@ class Instance(object):
                            'memory': self.ram * 1024,  # MiB to KiB
                            'disk': self.local_disk,
                            'seed': self.seed_path,
-                           'mac_address': util.generate_mac_address()}
-
-        # Write out the final xml file for the domain
-        with open(self.xml_path, 'w') as dom_template:
-            dom_template.write(xml_template.render(instance_values))
-
-        return
-
+                           'console_log': self.console_log,
+                           'guest_agent': self.guest_agent,
+                           'shares': self.shares,
+                           'share_driver': self.metadata.get('share_driver')}
+        network_name = network.group_network(self.group, self.connection) if self.group else None
+        instance_values['mac_address'], instance_values['network'] = \
+            self._allocate_address(network_name)
+        instance_values.update(get_profile(self.profile))
+
+        # limits of the instance override those of the profile
+        qos = dict(instance_values.get('qos') or {})
+        qos.update(self.qos)
+        instance_values.update(_qos_values(qos))
+
+        self.metadata.update({'connection': self.connection,
+                              'profile': self.profile,
+                              'ram': self.ram,
+                              'vcpus': instance_values['vcpus'],
+                              'density': bool(instance_values['balloon_stats']),
+                              'guest_agent': self.guest_agent,
+                              'group': self.group})
+        self.save_metadata()
+
+        if self.direct_kernel:
+            self._extract_initrd_and_kernel()
+        instance_values['kernel'] = self.kernel if self.direct_kernel else None
+        instance_values['initrd'] = self.initrd if self.direct_kernel else None
+        instance_values['cmdline'] = config_data.KERNEL_CMDLINE
+
+        numa = self._place_numa(instance_values['vcpus']) if self.numa else None
+        instance_values['numa_node'] = numa['node'] if numa else None
+        instance_values['numa_cpuset'] = numa['cpuset'] if numa else None
+
+        domain_xml = xml_template.render(instance_values)
+
+        # Write out a copy of the final xml for the domain, for reference
+        if config_data.KEEP_DOMAIN_XML:
+            with open(self.xml_path, 'w') as dom_template:
+                dom_template.write(domain_xml)
+
+        return domain_xml
+
+    @trace.traced('instance.spawn_vm')
     def spawn_vm(self):
-        """Create and boot the instance, using prepared data."""
+        """Create the instance, using prepared data. Ephemeral instances are
+        created as transient domains, which also boots them. An address
+        allocated for the instance is released again if libvirt rejects it."""
 
-        self.write_domain_xml()
+        had_address = network.lookup(self.name) is not None
+        domain_xml = self.write_domain_xml()
 
-        with open(self.xml_path, 'r') as xml_file:
-            domain_xml = ''.join([x for x in xml_file.readlines()])
-
-        conn = libvirt.open(self.connection)
-        conn.defineXML(domain_xml)
+        conn = util.open_connection(self.connection)
+        try:
+            if self.ephemeral:
+                with trace.span('libvirt.createXML', 'libvirt'):
+                    conn.createXML(domain_xml, 0)
+            else:
+                with trace.span('libvirt.defineXML', 'libvirt'):
+                    conn.defineXML(domain_xml)
+        except libvirt.libvirtError:
+            if not had_address:
+                network.release(self.name, self.connection)
+            raise
 
     def expand_qcow(self, size="+10G"):
         """Expand the storage for a qcow image. Currently only used for Atomic
@@ -391,7 +999,7 @@ class Instance(object):
         """Set the seed image for the instance."""
         self.seed = path
 
-    def boot(self, timeout=config_data.BOOT_TIMEOUT):
+    def boot(self, timeout=None):
         """Deprecated alias for :py:meth:`start`"""
 
         log.warn("instance.boot has been depricated and will be removed in a "
@@ -399,9 +1007,14 @@ class Instance(object):
 
         self.start(timeout)
 
-    def start(self, timeout=config_data.BOOT_TIMEOUT):
+    @trace.traced('instance.start')
+    def start(self, timeout=None):
         """Start an existing instance and wait up to :py:attr:`timeout` seconds
-        for a network interface to appear.
+        for it to boot. The instance is booted once one of its
+        :py:attr:`ready_markers` shows up on its serial console or, without
+        markers, once a network interface appears. Instances with
+        :py:attr:`guest_agent` enabled are booted once the agent is up.
+        Suspended or saved instances are woken up instead, see :py:meth:`wake`.
 
         :param int timeout: number of seconds to wait before timing out.
                             Setting this to 0 will disable timeout, default
@@ -409,44 +1022,524 @@ class Instance(object):
                             value.
         :raises TestcloudInstanceError: if there is an error while creating the
                                         instance or if the timeout is reached
-                                        while looking for a network interface
+                                        while waiting for the boot to finish
         """
 
+        timeout = config_data.BOOT_TIMEOUT if timeout is None else timeout
+
         log.debug("Creating instance {}".format(self.name))
+        if self.ephemeral and _find_domain(self.name, self.connection) is None:
+            raise TestcloudInstanceError("Ephemeral instance {} is gone once stopped and "
+                                         "can't be started again".format(self.name))
+
+        if self.wake():
+            log.info("Resumed instance {}".format(self.name))
+            return
+
         dom = self._get_domain()
-        create_status = dom.create()
-
-        # libvirt doesn't directly raise errors on boot failure, check the
-        # return code to verify that the boot process was successful from
-        # libvirt's POV
-        if create_status != 0:
-            raise TestcloudInstanceError("Instance {} did not start "
-                                         "successfully, see libvirt logs for "
-                                         "details".format(self.name))
+
+        # only console output written after this point belongs to this boot,
+        # transient domains are already running after spawn_vm and have a
+        # fresh console log
+        console_offset = 0
+
+        if not dom.isActive():
+            if self.group:
+                # group networks are gone after a restart of libvirt
+                network.group_network(self.group, self.connection)
+
+            if os.path.exists(self.console_log):
+                console_offset = os.path.getsize(self.console_log)
+
+            with trace.span('libvirt.create', 'libvirt'):
+                create_status = dom.create()
+
+            # libvirt doesn't directly raise errors on boot failure, check the
+            # return code to verify that the boot process was successful from
+            # libvirt's POV
+            if create_status != 0:
+                raise TestcloudInstanceError("Instance {} did not start "
+                                             "successfully, see libvirt logs for "
+                                             "details".format(self.name))
+
+        if timeout == 0:
+            log.info("Started instance {}, not waiting for boot".format(self.name))
+            return
+
+        if self.guest_agent:
+            booted = self._wait_for_agent(dom, timeout)
+        elif self.ready_markers:
+            booted = self._wait_for_console(console_offset, timeout)
+        else:
+            booted = self._wait_for_interface(dom, timeout)
+
+        if booted:
+            log.info("Successfully booted instance {}".format(self.name))
+            return
+
+        # If we get here, the boot process has timed out
+        raise TestcloudInstanceError("Instance {} has failed to boot in {} "
+                                     "seconds".format(self.name, timeout))
+
+    @trace.traced('instance.reset')
+    def reset(self, timeout=None):
+        """Throw away all changes made to the disk of the instance and boot it
+        again. The instance is stopped, its overlay is replaced by a fresh one
+        on the same backing image and it is started again. The seed image,
+        domain definition, MAC and IP address of the instance are kept.
+
+        :param int timeout: number of seconds to wait for the boot, see :py:meth:`start`
+        :raises TestcloudInstanceError: if the instance does not exist, is
+                                        ephemeral or its overlay can't be
+                                        recreated
+        """
+
+        if self.ephemeral:
+            raise TestcloudInstanceError("Ephemeral instance {} is gone once stopped and "
+                                         "can't be reset".format(self.name))
+
+        if _find_domain(self.name, self.connection) is None:
+            raise TestcloudInstanceError("Instance doesn't exist: {}".format(self.name))
+
+        log.debug("Resetting the disk of instance {}".format(self.name))
+        self.stop()
+
+        # checkpoints are stored in the overlay and go away with it
+        for snapshot in self._get_domain().listAllSnapshots(0):
+            snapshot.delete(libvirt.VIR_DOMAIN_SNAPSHOT_DELETE_METADATA_ONLY)
+
+        disk_info = self._disk_info(self.local_disk)
+        backing_store = disk_info.get('full-backing-filename', disk_info.get('backing-filename'))
+        if not backing_store:
+            raise TestcloudInstanceError("Disk {} of instance {} has no backing image to "
+                                         "reset to".format(self.local_disk, self.name))
+
+        # create the overlay next to the old one, so swapping them is atomic
+        new_disk = '{}.new'.format(self.local_disk)
+        if self._create_local_disk(new_disk, backing_store, disk_info['virtual-size']) != 0:
+            if os.path.exists(new_disk):
+                os.remove(new_disk)
+            raise TestcloudInstanceError("Failure creating a fresh disk for instance "
+                                         "{}".format(self.name))
+        os.rename(new_disk, self.local_disk)
+
+        self.start(timeout)
+
+    def checkpoint(self, name):
+        """Save the state of the instance as checkpoint ``name``. Checkpoints
+        of a running instance include its memory, reverting to them resumes the
+        guest where it was instead of booting it. Checkpoints are stored inside
+        the disk of the instance, the seed image is read only and left out.
+
+        :param str name: name of the checkpoint
+        :raises TestcloudInstanceError: if the checkpoint can't be created
+        """
+
+        snapshot = ET.Element('domainsnapshot')
+        ET.SubElement(snapshot, 'name').text = name
+        ET.SubElement(snapshot, 'description').text = 'testcloud checkpoint'
+
+        log.debug("Creating checkpoint {} of instance {}".format(name, self.name))
+        try:
+            with trace.span('libvirt.snapshotCreateXML', 'libvirt'):
+                self._get_domain().snapshotCreateXML(
+                    ET.tostring(snapshot).decode('utf-8'),
+                    libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_ATOMIC)
+        except libvirt.libvirtError as e:
+            raise TestcloudInstanceError("Could not create checkpoint {} of instance {}: "
+                                         "{}".format(name, self.name, e))
+
+    def revert(self, name):
+        """Bring the instance back to the state saved in checkpoint ``name``.
+        The checkpoint is kept and can be reverted to again.
+
+        :param str name: name of the checkpoint
+        :raises TestcloudInstanceError: if there is no such checkpoint or
+                                        reverting to it failed
+        """
+
+        log.debug("Reverting instance {} to checkpoint {}".format(self.name, name))
+        try:
+            dom = self._get_domain()
+            with trace.span('libvirt.revertToSnapshot', 'libvirt'):
+                dom.revertToSnapshot(dom.snapshotLookupByName(name, 0), 0)
+        except libvirt.libvirtError as e:
+            raise TestcloudInstanceError("Could not revert instance {} to checkpoint {}: "
+                                         "{}".format(self.name, name, e))
+
+    def delete_checkpoint(self, name):
+        """Delete checkpoint ``name``.
+
+        :param str name: name of the checkpoint
+        :raises TestcloudInstanceError: if there is no such checkpoint
+        """
+
+        try:
+            self._get_domain().snapshotLookupByName(name, 0).delete(0)
+        except libvirt.libvirtError as e:
+            raise TestcloudInstanceError("Could not delete checkpoint {} of instance {}: "
+                                         "{}".format(name, self.name, e))
+
+    def list_checkpoints(self):
+        """List the checkpoints of the instance, oldest first.
+
+        :returns: list of checkpoint names
+        """
+
+        checkpoints = []
+        for snapshot in self._get_domain().listAllSnapshots(0):
+            created = ET.fromstring(snapshot.getXMLDesc(0)).findtext('creationTime', '0')
+            checkpoints.append((int(created), snapshot.getName()))
+
+        return [name for _, name in sorted(checkpoints)]
+
+    @contextlib.contextmanager
+    def reverting(self, name):
+        """Revert the instance to checkpoint ``name`` when leaving the ``with``
+        block, creating the checkpoint on entry if it doesn't exist yet. Wrap
+        each test case in it to run every test on the same guest state::
+
+            with tc_instance.reverting('clean'):
+                run_test(tc_instance)
+
+        :param str name: name of the checkpoint
+        """
+
+        if name not in self.list_checkpoints():
+            self.checkpoint(name)
+
+        try:
+            yield
+        finally:
+            self.revert(name)
+
+    @trace.traced('instance.clone')
+    def clone(self, names):
+        """Create linked clones of the instance. The current disk of the
+        instance is frozen as a base which the instance and all clones get a
+        thin overlay on. A running instance is saved to disk while its disk is
+        frozen and restored right after. Its clones are booted from the frozen
+        disk with a MAC address of their own, as libvirt doesn't restore the
+        memory of the instance into domains with another name and UUID. Clones
+        of a stopped instance are only defined.
+
+        :param list names: names of the clones
+        :returns: list of :py:class:`Instance` of the clones
+        :raises TestcloudInstanceError: if the instance can't be cloned or a
+                                        clone exists already
+        """
+
+        if self.ephemeral:
+            raise TestcloudInstanceError("Ephemeral instance {} can't be cloned".format(self.name))
+
+        if _find_domain(self.name, self.connection) is None:
+            raise TestcloudInstanceError("Instance doesn't exist: {}".format(self.name))
+
+        for name in names:
+            if (os.path.exists(Instance(name).path) or
+                    _find_domain(name, self.connection) is not None):
+                raise TestcloudInstanceError("An instance named {} already exists".format(name))
+
+        dom = self._get_domain()
+        if dom.snapshotNum(0):
+            # checkpoints live in the disk which is about to be frozen
+            raise TestcloudInstanceError("Instance {} has checkpoints, delete them before "
+                                         "cloning it".format(self.name))
+
+        self.wake()
+        running = bool(dom.isActive())
+
+        base_dir = '{}/clones/{}-{}'.format(config_data.DATA_DIR, self.name,
+                                            uuid.uuid4().hex[:8])
+        os.makedirs(base_dir)
+        base = '{}/disk.qcow2'.format(base_dir)
+        memory = '{}/memory.save'.format(base_dir) if running else None
+        size = self._disk_info(self.local_disk)['virtual-size']
+        conn = util.open_connection(self.connection)
+
+        try:
+            domain_xml = dom.XMLDesc(libvirt.VIR_DOMAIN_XML_SECURE)
+            if running:
+                # nothing writes to the disk while it's frozen
+                log.debug("Saving the memory of instance {}".format(self.name))
+                with trace.span('libvirt.save', 'libvirt'):
+                    dom.save(memory)
+
+            try:
+                # the current disk becomes the frozen base, the instance
+                # carries on in a new overlay with the same path
+                os.rename(self.local_disk, base)
+                if self._create_local_disk(self.local_disk, base, size) != 0:
+                    os.rename(base, self.local_disk)
+                    raise TestcloudInstanceError("Failure creating a new disk for instance "
+                                                 "{}".format(self.name))
+
+                self.metadata['clone_bases'] = self.metadata.get('clone_bases', []) + [base_dir]
+                self.save_metadata()
+            finally:
+                # whatever happened, the instance keeps running
+                if running:
+                    with trace.span('libvirt.restore', 'libvirt'):
+                        conn.restore(memory)
+
+            clones = [self._spawn_clone(conn, name, domain_xml, base, size, running)
+                      for name in names]
+        except libvirt.libvirtError as e:
+            raise TestcloudInstanceError("Cloning instance {} failed: {}".format(self.name, e))
+        finally:
+            if memory is not None and os.path.exists(memory):
+                os.remove(memory)
+            if base_dir not in self.metadata.get('clone_bases', []):
+                # nothing is built on the base
+                shutil.rmtree(base_dir, ignore_errors=True)
+
+        return clones
+
+    def _spawn_clone(self, conn, name, domain_xml, base, size, boot=False):
+        """Create one clone for :py:meth:`clone`.
+
+        :param conn: libvirt connection
+        :param str name: name of the clone
+        :param str domain_xml: domain XML of the instance
+        :param str base: path of the frozen base disk
+        :param int size: size of the overlay of the clone in bytes
+        :param bool boot: whether to boot the clone once it's defined
+        :returns: :py:class:`Instance` of the clone
+        """
+
+        log.debug("Creating clone {} of instance {}".format(name, self.name))
+
+        tc_clone = Instance(name, connection=self.connection)
+        tc_clone.metadata = dict((key, value) for key, value in self.metadata.items()
+                                 if key not in ('numa', 'idle', 'expires'))
+        tc_clone.metadata['clone_of'] = self.name
+        tc_clone._create_dirs()
+        tc_clone.save_metadata()
+
+        for meta_file in os.listdir(self.meta_path):
+            shutil.copy(os.path.join(self.meta_path, meta_file), tc_clone.meta_path)
+        shutil.copy(self.seed_path, tc_clone.seed_path)
+        if tc_clone._create_local_disk(tc_clone.local_disk, base, size) != 0:
+            raise TestcloudInstanceError("Failure creating the disk of clone {}".format(name))
+
+        root = _clone_domain_xml(domain_xml, name, tc_clone.local_disk, tc_clone.seed_path,
+                                 tc_clone.console_log)
+        interface = root.find('./devices/interface')
+        mac, _ = tc_clone._allocate_address(interface.find('source').get('network'))
+        interface.find('mac').set('address', mac)
+        conn.defineXML(ET.tostring(root).decode('utf-8'))
+
+        if boot:
+            # the frozen disk was taken from a running guest, it boots like
+            # after a power failure
+            with tc_clone.admit():
+                tc_clone.start(0)
+
+        return tc_clone
+
+    def suspend(self):
+        """Pause the instance. It keeps its memory on the host but doesn't use
+        any CPU until it is woken up with :py:meth:`wake`."""
+
+        log.debug("Suspending instance {}".format(self.name))
+        self._get_domain().suspend()
+
+        self.metadata['idle'] = 'suspended'
+        self.save_metadata()
+
+    def hibernate(self):
+        """Save the memory of the instance to disk and stop it, which frees all
+        of its memory on the host. :py:meth:`wake` or :py:meth:`start` restore
+        it. Transient domains of ephemeral instances can't be saved and are
+        suspended instead."""
+
+        if self.ephemeral:
+            self.suspend()
+            return
+
+        log.debug("Saving instance {} to disk".format(self.name))
+        with trace.span('libvirt.managedSave', 'libvirt'):
+            self._get_domain().managedSave(0)
+
+        self.metadata['idle'] = 'saved'
+        self.save_metadata()
+
+    def wake(self):
+        """Resume the instance if it is paused or restore it if it was saved
+        by :py:meth:`hibernate`.
+
+        :returns: ``True`` if the instance was woken up, ``False`` if it was
+                  neither paused nor saved
+        """
+
+        domain_state = _find_domain(self.name, self.connection)
+
+        if domain_state == 'paused':
+            log.debug("Resuming instance {}".format(self.name))
+            self._get_domain().resume()
+        elif domain_state == 'saved':
+            log.debug("Restoring instance {} from disk".format(self.name))
+            if self.group:
+                network.group_network(self.group, self.connection)
+            with trace.span('libvirt.restore', 'libvirt'):
+                # creating a domain with a managed save image restores it
+                if self._get_domain().create() != 0:
+                    raise TestcloudInstanceError("Instance {} could not be restored, see "
+                                                 "libvirt logs for details".format(self.name))
+        else:
+            return False
+
+        if self.metadata.pop('idle', None) is not None:
+            self.save_metadata()
+        return True
+
+    @trace.traced('instance.wait_for_interface')
+    def _wait_for_interface(self, dom, timeout):
+        """Poll libvirt for domain interfaces until one is found.
+
+        :param dom: libvirt domain of the instance
+        :param int timeout: number of seconds to wait
+        :returns: ``True`` if an interface was found before the timeout
+        """
+
         log.debug("Polling instance for active network interface")
 
         poll_tick = 0.5
         timeout_ticks = timeout / poll_tick
         count = 0
 
-        # poll libvirt for domain interfaces, returning when an interface is
-        # found, indicating that the boot process is post-cloud-init
         while count <= timeout_ticks:
-            domif = dom.interfaceAddresses(0)
-
-            if len(domif) > 0 or timeout_ticks == 0:
-                log.info("Successfully booted instance {}".format(self.name))
-                return
+            if len(dom.interfaceAddresses(0)) > 0:
+                return True
 
             count += 1
             time.sleep(poll_tick)
 
-        # If we get here, the boot process has timed out
-        raise TestcloudInstanceError("Instance {} has failed to boot in {} "
-                                     "seconds".format(self.name, timeout))
+        return False
+
+    @trace.traced('instance.wait_for_agent')
+    def _wait_for_agent(self, dom, timeout):
+        """Wait for the qemu guest agent of the instance to connect, which
+        libvirt reflects in the state of the agent channel.
+
+        :param dom: libvirt domain of the instance
+        :param int timeout: number of seconds to wait
+        :returns: ``True`` if the agent connected before the timeout
+        """
+
+        log.debug("Waiting for the guest agent to connect")
+
+        deadline = time.time() + timeout
+        while True:
+            channel = util.find_guest_agent(dom.XMLDesc())
+            if channel is not None and channel.get('state') == 'connected':
+                return True
+
+            if time.time() >= deadline:
+                return False
+
+            time.sleep(0.1)
+
+    @trace.traced('instance.wait_for_console')
+    def _wait_for_console(self, offset, timeout):
+        """Follow the serial console log of the instance until a line matches
+        one of :py:attr:`ready_markers`.
+
+        :param int offset: position in the console log to start reading at
+        :param int timeout: number of seconds to wait
+        :returns: ``True`` if a marker was found before the timeout
+        """
+
+        log.debug("Waiting for boot markers on the serial console")
+
+        markers = [re.compile(marker) for marker in self.ready_markers]
+        deadline = time.time() + timeout
+        pending = ''
+
+        while True:
+            try:
+                with open(self.console_log, 'rb') as console:
+                    console.seek(offset)
+                    data = console.read()
+            except IOError:
+                data = b''
+
+            if data:
+                offset += len(data)
+                lines = (pending + data.decode('utf-8', 'replace')).split('\n')
+                # the last line may be incomplete, keep it for the next round
+                pending = lines.pop()
+                for line in lines:
+                    if any(marker.search(line) for marker in markers):
+                        log.debug("Boot marker found: {}".format(line.strip()))
+                        return True
+
+            if time.time() >= deadline:
+                return False
+
+            time.sleep(0.1)
+
+    def agent_command(self, command, timeout=libvirt_qemu.VIR_DOMAIN_QEMU_AGENT_COMMAND_DEFAULT):
+        """Send a command to the qemu guest agent of the instance.
+
+        :param dict command: agent command, like ``{'execute': 'guest-ping'}``
+        :param int timeout: seconds to wait for the agent to reply
+        :returns: the ``return`` value of the reply
+        :raises TestcloudInstanceError: if the agent is not available
+        """
+
+        try:
+            reply = libvirt_qemu.qemuAgentCommand(self._get_domain(), json.dumps(command),
+                                                  timeout, 0)
+        except libvirt.libvirtError as e:
+            raise TestcloudInstanceError("Guest agent command {} failed for instance {}: "
+                                         "{}".format(command['execute'], self.name, e))
+
+        return json.loads(reply).get('return')
+
+    @trace.traced('instance.guest_exec')
+    def guest_exec(self, command, timeout=0):
+        """Run a command in the guest through the qemu guest agent and wait
+        for it to finish. No network or SSH is involved.
+
+        :param list command: command and its arguments, the command is looked
+                             up in the guest's ``PATH``
+        :param int timeout: seconds to wait for the command, 0 waits forever
+        :returns: tuple of (exit code, stdout, stderr)
+        :raises TestcloudInstanceError: if the agent is not available or the
+                                        command does not finish in time
+        """
+
+        pid = self.agent_command({'execute': 'guest-exec',
+                                  'arguments': {'path': command[0],
+                                                'arg': command[1:],
+                                                'capture-output': True}})['pid']
+
+        deadline = time.time() + timeout
+        poll_tick = 0.05
+        while True:
+            status = self.agent_command({'execute': 'guest-exec-status',
+                                         'arguments': {'pid': pid}})
+            if status['exited']:
+                break
+
+            if timeout and time.time() >= deadline:
+                raise TestcloudInstanceError("Command {} did not finish in {} seconds on "
+                                             "instance {}".format(command, timeout, self.name))
+
+            time.sleep(poll_tick)
+            poll_tick = min(poll_tick * 2, 1)
+
+        stdout = base64.b64decode(status.get('out-data', ''))
+        stderr = base64.b64decode(status.get('err-data', ''))
+
+        return status.get('exitcode', -1), stdout, stderr
 
     def stop(self):
-        """Stop the instance
+        """Stop the instance. Ephemeral instances are removed once stopped.
+        Those whose guest shut down by itself are left to
+        :py:func:`testcloud.reaper.reap`, nothing watches for their domain to
+        go away.
 
         :raises TestcloudInstanceError: if the instance does not exist
         """
@@ -455,16 +1548,33 @@ class Instance(object):
 
         domain_state = _find_domain(self.name, self.connection)
 
+        if self.ephemeral:
+            if domain_state is not None:
+                self._get_domain().destroy()
+            self.remove()
+            return
+
         if domain_state is None:
             raise TestcloudInstanceError("Instance doesn't exist: {}".format(self.name))
 
+        if domain_state == 'saved':
+            # a stopped instance boots from scratch the next time
+            log.debug('Discarding saved state of instance {}'.format(self.name))
+            self._get_domain().managedSaveRemove(0)
+            domain_state = 'shutoff'
+
         if domain_state == 'shutoff':
+            if self.metadata.pop('idle', None) is not None:
+                self.save_metadata()
             log.debug('Instance already shut off, not stopping: {}'.format(self.name))
             return
 
         # stop (destroy) the vm
         self._get_domain().destroy()
 
+        if self.metadata.pop('idle', None) is not None:
+            self.save_metadata()
+
     def remove(self, autostop=True):
         """Remove an already stopped instance
 
@@ -479,17 +1589,28 @@ class Instance(object):
         # libvirt connections
         domain_state = _find_domain(self.name, self.connection)
 
-        if domain_state == 'running':
-            if autostop:
-                self.stop()
-            else:
+        if domain_state in ('running', 'paused'):
+            if not autostop:
                 raise TestcloudInstanceError(
                     "Cannot remove running instance {}. Please stop the "
                     "instance before removing.".format(self.name))
 
+            if self.ephemeral:
+                # stopping an ephemeral instance removes it
+                self.stop()
+                return
+            self.stop()
+
+        # transient domains vanish from libvirt once stopped
+        if self.ephemeral:
+            if domain_state is not None:
+                self._get_domain().destroy()
         # remove from libvirt, assuming that it's stopped already
-        if domain_state is not None:
-            self._get_domain().undefine()
+        elif domain_state is not None:
+            # drop the saved state of hibernated instances and checkpoints
+            # along with them
+            self._get_domain().undefineFlags(libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE |
+                                             libvirt.VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA)
             log.debug("Unregistering instance from libvirt.")
         else:
             log.warn('Instance "{}" not found in libvirt "{}". Was it removed already? Should '
@@ -499,6 +1620,19 @@ class Instance(object):
 
         # remove from disk
         shutil.rmtree(self.path)
+        if self.ephemeral and os.path.isdir(self.disk_path):
+            shutil.rmtree(self.disk_path)
+
+        network.release(self.name, self.connection)
+        if self.group:
+            network.prune_group_network(network.group_network_name(self.group), self.connection)
+
+        # drop frozen clone bases no other instance is built on anymore
+        in_use = set(base for meta in _list_metadata() for base in meta.get('clone_bases', []))
+        for base_dir in self.metadata.get('clone_bases', []):
+            if base_dir not in in_use:
+                log.debug("removing clone base {}".format(base_dir))
+                shutil.rmtree(base_dir, ignore_errors=True)
 
     def destroy(self):
         '''A deprecated method. Please call :meth:`remove` instead.'''
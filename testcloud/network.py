@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+"""
+Address allocation for instances. Every instance gets an IP address from the
+DHCP range of its libvirt network and a MAC address derived from it, with a
+static DHCP host reservation tying both together. The addresses are kept in a
+registry under ``DATA_DIR``, so the IP of an instance is known before it boots.
+
+Groups of instances can get a NAT network of their own, on a subnet picked
+from ``NETWORK_POOL``, which is torn down with the last instance of the group.
+"""
+
+import os
+import json
+import socket
+import struct
+import logging
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from . import config
+from . import util
+from .exceptions import TestcloudInstanceError
+
+config_data = config.lazy_config()
+
+log = logging.getLogger('testcloud.network')
+
+
+def _ip_to_int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def _int_to_ip(value):
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+def mac_for_ip(ip):
+    """Derive the MAC address of an instance from its IP address, using the
+    libvirt prefix ``52:54:00`` and the last three octets of the IP.
+
+    :param str ip: IPv4 address
+    :rtype: str
+    """
+
+    octets = [int(octet) for octet in ip.split('.')]
+    return '52:54:00:{:02x}:{:02x}:{:02x}'.format(*octets[1:])
+
+
+def parse_network(network_xml):
+    """Get the addressing details of a libvirt network from its XML.
+
+    :param str network_xml: XML description of the network
+    :returns: dict with the DHCP ``range`` (tuple of first and last address,
+              as ints), the ``gateway`` address and the ``hosts`` reserved
+              (dict of MAC -> IP)
+    :raises TestcloudInstanceError: if the network has no IPv4 DHCP range
+    """
+
+    root = ET.fromstring(network_xml)
+    for ip in root.findall('ip'):
+        if ip.get('family', 'ipv4') != 'ipv4' or ip.find('dhcp/range') is None:
+            continue
+
+        dhcp_range = ip.find('dhcp/range')
+        return {'range': (_ip_to_int(dhcp_range.get('start')),
+                          _ip_to_int(dhcp_range.get('end'))),
+                'gateway': ip.get('address'),
+                'hosts': dict((host.get('mac'), host.get('ip'))
+                              for host in ip.findall('dhcp/host'))}
+
+    raise TestcloudInstanceError("Network {} has no IPv4 DHCP range".format(
+        root.findtext('name')))
+
+
+def pick_address(network_info, used, used_macs=()):
+    """Pick the lowest free IP address in the DHCP range of a network, whose
+    MAC address (see :py:func:`mac_for_ip`) isn't reserved or taken either.
+    The MAC only depends on the last three octets of the IP, so addresses on
+    other networks can share it.
+
+    :param dict network_info: network details from :py:func:`parse_network`
+    :param set used: IP addresses which are taken
+    :param set used_macs: MAC addresses which are taken, on any network
+    :returns: IP address
+    :raises TestcloudInstanceError: if the range is exhausted
+    """
+
+    used = set(used) | set(network_info['hosts'].values()) | set([network_info['gateway']])
+    used_macs = set(used_macs) | set(network_info['hosts'])
+    first, last = network_info['range']
+
+    for value in range(first, last + 1):
+        ip = _int_to_ip(value)
+        if ip not in used and mac_for_ip(ip) not in used_macs:
+            return ip
+
+    raise TestcloudInstanceError("No free addresses left in the DHCP range of the network")
+
+
+def _registry_path():
+    return '{}/addresses.json'.format(config_data.DATA_DIR)
+
+
+def _load_registry():
+    try:
+        with open(_registry_path(), 'r') as registry:
+            return json.load(registry)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_registry(registry):
+    tmp_path = '{}.tmp'.format(_registry_path())
+    with open(tmp_path, 'w') as tmp_file:
+        json.dump(registry, tmp_file, indent=2, sort_keys=True)
+    os.rename(tmp_path, _registry_path())
+
+
+def _host_xml(address):
+    host = ET.Element('host', mac=address['mac'], ip=address['ip'])
+    return ET.tostring(host).decode('utf-8')
+
+
+def _update_hosts(net, command, address):
+    """Add or delete the DHCP host reservation of an address, in the running
+    network and its persistent definition."""
+
+    flags = libvirt.VIR_NETWORK_UPDATE_AFFECT_CONFIG if net.isPersistent() else 0
+    if net.isActive():
+        flags |= libvirt.VIR_NETWORK_UPDATE_AFFECT_LIVE
+
+    net.update(command, libvirt.VIR_NETWORK_SECTION_IP_DHCP_HOST, -1,
+               _host_xml(address), flags)
+
+
+def lookup(name):
+    """Find the address allocated to an instance.
+
+    :param str name: name of the instance
+    :returns: dict with ``mac``, ``ip`` and ``network`` or ``None``
+    """
+
+    return _load_registry().get(name)
+
+
+def allocate(name, connection='qemu:///system', network=None):
+    """Allocate a MAC and IP address for an instance and reserve them in the
+    DHCP server of the network. Instances which have an address already keep
+    it.
+
+    :param str name: name of the instance
+    :param str connection: libvirt connection uri
+    :param str network: name of the libvirt network, defaults to ``NETWORK``
+    :returns: dict with ``mac``, ``ip`` and ``network``
+    :raises TestcloudInstanceError: if no address could be allocated
+    """
+
+    network = config_data.NETWORK if network is None else network
+
+    with util.file_lock('{}/addresses.lock'.format(config_data.DATA_DIR)):
+        registry = _load_registry()
+        if name in registry:
+            return registry[name]
+
+        try:
+            net = util.open_connection(connection).networkLookupByName(network)
+            network_info = parse_network(net.XMLDesc(0))
+
+            # guests testcloud doesn't manage hold leases, not reservations
+            used = set(address['ip'] for address in registry.values())
+            used_macs = set(address['mac'] for address in registry.values())
+            if net.isActive():
+                leases = net.DHCPLeases()
+                used |= set(lease['ipaddr'] for lease in leases)
+                used_macs |= set(lease['mac'] for lease in leases if lease.get('mac'))
+
+            ip = pick_address(network_info, used, used_macs)
+            address = {'mac': mac_for_ip(ip), 'ip': ip, 'network': network,
+                       'connection': connection}
+
+            _update_hosts(net, libvirt.VIR_NETWORK_UPDATE_COMMAND_ADD_LAST, address)
+        except libvirt.libvirtError as e:
+            raise TestcloudInstanceError("Could not allocate an address on network {}: "
+                                         "{}".format(network, e))
+
+        log.debug("Allocated {} ({}) to {}".format(address['ip'], address['mac'], name))
+        registry[name] = address
+        _save_registry(registry)
+
+    return address
+
+
+def release(name, connection='qemu:///system'):
+    """Drop the address of an instance and its DHCP host reservation.
+
+    :param str name: name of the instance
+    :param str connection: libvirt connection uri, used if the address doesn't
+                           record the host of the instance
+    """
+
+    with util.file_lock('{}/addresses.lock'.format(config_data.DATA_DIR)):
+        registry = _load_registry()
+        address = registry.pop(name, None)
+        if address is None:
+            return
+
+        try:
+            net = util.open_connection(address.get('connection', connection)).networkLookupByName(
+                address['network'])
+            _update_hosts(net, libvirt.VIR_NETWORK_UPDATE_COMMAND_DELETE, address)
+        except libvirt.libvirtError as e:
+            # the reservation or the whole network is gone already
+            log.debug("Could not remove the DHCP reservation of {}: {}".format(name, e))
+
+        log.debug("Released {} of {}".format(address['ip'], name))
+        _save_registry(registry)
+
+
+def _parse_cidr(cidr):
+    """Split ``a.b.c.d/prefix`` into the first and last address, as ints."""
+
+    address, prefix = cidr.split('/')
+    mask = (0xffffffff << (32 - int(prefix))) & 0xffffffff
+    first = _ip_to_int(address) & mask
+    return first, first | (~mask & 0xffffffff)
+
+
+def _network_subnets(network_xml):
+    """Get the IPv4 subnets of a libvirt network, as (first, last) int tuples."""
+
+    subnets = []
+    for ip in ET.fromstring(network_xml).findall('ip'):
+        if ip.get('family', 'ipv4') != 'ipv4':
+            continue
+        if ip.get('prefix'):
+            prefix = ip.get('prefix')
+        else:
+            prefix = bin(_ip_to_int(ip.get('netmask', '255.255.255.0'))).count('1')
+        subnets.append(_parse_cidr('{}/{}'.format(ip.get('address'), prefix)))
+    return subnets
+
+
+def pick_subnet(pool, used):
+    """Pick the first /24 subnet of ``pool`` which doesn't overlap any used one.
+
+    :param str pool: address pool in CIDR notation, like ``10.123.0.0/16``
+    :param list used: subnets in use, as (first, last) int tuples
+    :returns: first address of the subnet, as a dotted string
+    :raises TestcloudInstanceError: if the pool is exhausted
+    """
+
+    first, last = _parse_cidr(pool)
+    for start in range(first, last + 1, 256):
+        end = start + 255
+        if end > last:
+            break
+        if not any(start <= used_last and used_first <= end for used_first, used_last in used):
+            return _int_to_ip(start)
+
+    raise TestcloudInstanceError("No free subnets left in NETWORK_POOL {}".format(pool))
+
+
+def group_network_xml(name, subnet):
+    """Build the XML of a NAT network on a /24 subnet.
+
+    :param str name: name of the network
+    :param str subnet: first address of the subnet
+    :rtype: str
+    """
+
+    base = _ip_to_int(subnet)
+    root = ET.Element('network')
+    ET.SubElement(root, 'name').text = name
+    ET.SubElement(root, 'forward', mode='nat')
+    ip = ET.SubElement(root, 'ip', address=_int_to_ip(base + 1), netmask='255.255.255.0')
+    dhcp = ET.SubElement(ip, 'dhcp')
+    ET.SubElement(dhcp, 'range', start=_int_to_ip(base + 2), end=_int_to_ip(base + 254))
+
+    return ET.tostring(root).decode('utf-8')
+
+
+def _networks_path():
+    return '{}/networks.json'.format(config_data.DATA_DIR)
+
+
+def _load_networks():
+    try:
+        with open(_networks_path(), 'r') as networks:
+            return json.load(networks)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_networks(networks):
+    tmp_path = '{}.tmp'.format(_networks_path())
+    with open(tmp_path, 'w') as tmp_file:
+        json.dump(networks, tmp_file, indent=2, sort_keys=True)
+    os.rename(tmp_path, _networks_path())
+
+
+def group_network_name(group):
+    """Get the name of the libvirt network of a group of instances."""
+
+    return '{}{}'.format(config_data.GROUP_NETWORK_PREFIX, group)
+
+
+def group_network(group, connection='qemu:///system'):
+    """Get the network of a group of instances, creating it if it doesn't
+    exist. Group networks are transient NAT networks on a /24 subnet of
+    ``NETWORK_POOL`` of their own. A group keeps its subnet until its network is
+    pruned, networks gone with a restart of libvirt are created again with
+    the DHCP reservations of their instances.
+
+    :param str group: name of the group
+    :param str connection: libvirt connection uri
+    :returns: name of the libvirt network
+    """
+
+    name = group_network_name(group)
+
+    with util.file_lock('{}/networks.lock'.format(config_data.DATA_DIR)):
+        conn = util.open_connection(connection)
+        try:
+            if conn.networkLookupByName(name).isActive():
+                return name
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_NETWORK:
+                raise e
+
+        networks = _load_networks()
+        if name not in networks:
+            used = [_parse_cidr('{}/24'.format(subnet)) for subnet in networks.values()]
+            for net in conn.listAllNetworks():
+                used.extend(_network_subnets(net.XMLDesc(0)))
+            networks[name] = pick_subnet(config_data.NETWORK_POOL, used)
+            _save_networks(networks)
+
+        log.info("Creating network {} on {}/24".format(name, networks[name]))
+        try:
+            net = conn.networkCreateXML(group_network_xml(name, networks[name]))
+
+            # bring back the reservations of existing instances
+            with util.file_lock('{}/addresses.lock'.format(config_data.DATA_DIR)):
+                for address in _load_registry().values():
+                    if address['network'] == name:
+                        _update_hosts(net, libvirt.VIR_NETWORK_UPDATE_COMMAND_ADD_LAST, address)
+        except libvirt.libvirtError as e:
+            raise TestcloudInstanceError("Could not create network {}: {}".format(name, e))
+
+    return name
+
+
+def prune_group_network(name, connection='qemu:///system'):
+    """Tear down a group network once no instance is attached to it or has
+    an address on it.
+
+    :param str name: name of the libvirt network
+    :param str connection: libvirt connection uri
+    :returns: ``True`` if the network was torn down
+    """
+
+    with util.file_lock('{}/networks.lock'.format(config_data.DATA_DIR)):
+        networks = _load_networks()
+        if name not in networks:
+            return False
+
+        if any(address['network'] == name for address in _load_registry().values()):
+            return False
+
+        conn = util.open_connection(connection)
+        for domain in conn.listAllDomains():
+            sources = ET.fromstring(domain.XMLDesc(0)).findall('./devices/interface/source')
+            if any(source.get('network') == name for source in sources):
+                return False
+
+        log.info("Removing network {}".format(name))
+        try:
+            net = conn.networkLookupByName(name)
+            if net.isActive():
+                net.destroy()
+            if net.isPersistent():
+                net.undefine()
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_NETWORK:
+                raise e
+
+        del networks[name]
+        _save_networks(networks)
+
+    return True
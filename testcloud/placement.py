@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+"""
+NUMA aware placement of instances on the host. Each placed instance gets its
+vCPUs pinned to the CPUs of a single host NUMA node and its memory bound to
+that node, keeping guests from floating across nodes on dense hosts.
+"""
+
+import logging
+import xml.etree.ElementTree as ET
+
+log = logging.getLogger('testcloud.placement')
+
+
+def parse_topology(caps_xml):
+    """Parse the host NUMA topology out of libvirt capabilities XML, as
+    returned by ``virConnect.getCapabilities()``.
+
+    :param str caps_xml: libvirt capabilities XML
+    :returns: list of dicts with ``id``, ``cpus`` (list of int) and ``memory``
+              (in KiB) for each NUMA node, sorted by node id
+    :rtype: list
+    """
+
+    caps = ET.fromstring(caps_xml)
+
+    cells = []
+    for cell in caps.findall('./host/topology/cells/cell'):
+        memory = cell.find('memory')
+        cells.append({'id': int(cell.get('id')),
+                      'cpus': sorted(int(cpu.get('id')) for cpu in cell.findall('./cpus/cpu')),
+                      'memory': int(memory.text) if memory is not None else 0})
+
+    return sorted(cells, key=lambda cell: cell['id'])
+
+
+def format_cpuset(cpus):
+    """Format a list of CPU ids as a libvirt cpuset string, collapsing
+    consecutive ids into ranges (``[0, 1, 2, 5]`` -> ``'0-2,5'``).
+
+    :param list cpus: CPU ids
+    :rtype: str
+    """
+
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+
+    return ','.join(str(start) if start == end else '{}-{}'.format(start, end)
+                    for start, end in ranges)
+
+
+def place(topology, vcpus, ram, assignments):
+    """Pick the NUMA node for a new instance. The node with the lowest load,
+    counting both the vCPUs per host CPU and the memory already bound to it,
+    is chosen. Nodes are still used once they are overcommitted, the least
+    loaded one just keeps winning.
+
+    :param list topology: host topology as returned by :py:func:`parse_topology`
+    :param int vcpus: number of vCPUs of the new instance
+    :param int ram: memory of the new instance, in MiB
+    :param list assignments: placements of existing instances, dicts with
+                             ``node``, ``vcpus`` and ``ram`` keys
+    :returns: dict with ``node``, ``cpuset``, ``vcpus`` and ``ram`` keys or
+              ``None`` if the host has no NUMA topology worth placing on
+    :rtype: dict or None
+    """
+
+    cells = [cell for cell in topology if cell['cpus']]
+    if len(cells) < 2:
+        log.debug("Host has {} usable NUMA node(s), not placing".format(len(cells)))
+        return None
+
+    used = dict((cell['id'], {'vcpus': 0, 'ram': 0}) for cell in cells)
+    for assignment in assignments:
+        if assignment.get('node') in used:
+            used[assignment['node']]['vcpus'] += assignment.get('vcpus', 0)
+            used[assignment['node']]['ram'] += assignment.get('ram', 0)
+
+    def load(cell):
+        cpu_load = float(used[cell['id']]['vcpus'] + vcpus) / len(cell['cpus'])
+        mem_load = (float(used[cell['id']]['ram'] + ram) * 1024 / cell['memory']
+                    if cell['memory'] else 0)
+        return (max(cpu_load, mem_load), cell['id'])
+
+    chosen = min(cells, key=load)
+    log.debug("Placing instance on NUMA node {}".format(chosen['id']))
+
+    return {'node': chosen['id'],
+            'cpuset': format_cpuset(chosen['cpus']),
+            'vcpus': vcpus,
+            'ram': ram}
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+"""
+Cleanup of abandoned instances and the resources they leak. The reaper removes
+instances past their time to live, instance directories whose domain is gone,
+ephemeral disks without an instance, clone bases no instance is built on,
+addresses of removed instances, group networks without instances and domains
+using testcloud disks whose instance directory is gone.
+"""
+
+import os
+import time
+import shutil
+import logging
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from . import config
+from . import instance
+from . import network
+from . import scheduler
+from . import util
+from .exceptions import TestcloudException
+
+config_data = config.lazy_config()
+
+log = logging.getLogger('testcloud.reaper')
+
+
+def expired(metadata, now=None):
+    """Check whether an instance is past its time to live.
+
+    :param dict metadata: metadata of the instance
+    :param float now: current unix time, defaults to :py:func:`time.time`
+    :rtype: bool
+    """
+
+    now = time.time() if now is None else now
+    expires = metadata.get('expires')
+    return expires is not None and expires <= now
+
+
+def _old_enough(path, now):
+    """Check that ``path`` was last modified more than ``REAPER_GRACE`` seconds
+    ago. Instances being created have a directory before they have a domain,
+    the grace period keeps the reaper away from them."""
+
+    try:
+        return now - os.path.getmtime(path) > config_data.REAPER_GRACE
+    except OSError:
+        return False
+
+
+def _domain_disks(domain):
+    """Get the paths of the file backed disks of a domain."""
+
+    root = ET.fromstring(domain.XMLDesc())
+    return [source.get('file') for source in root.findall('./devices/disk/source')
+            if source.get('file')]
+
+
+def _testcloud_disk(path):
+    """Find the name of the instance a disk belongs to, if it's one of the disk
+    locations used by testcloud.
+
+    :returns: name of the instance or ``None``
+    """
+
+    for parent in ('{}/instances'.format(config_data.DATA_DIR), config_data.EPHEMERAL_DIR):
+        parent = os.path.normpath(parent) + os.sep
+        if path.startswith(parent):
+            return path[len(parent):].split(os.sep)[0] or None
+    return None
+
+
+def _remove(path, what, dry_run):
+    log.info("{} {} {}".format('Would remove' if dry_run else 'Removing', what, path))
+    if not dry_run:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+def reap(connection='qemu:///system', dry_run=False):
+    """Clean up abandoned instances and leaked resources once.
+
+    :param str connection: libvirt connection uri
+    :param bool dry_run: only log what would be removed
+    :returns: list of paths and domain names which were removed
+    """
+
+    now = time.time()
+    instance_dir = '{}/instances'.format(config_data.DATA_DIR)
+    tc_instances = []
+    for name in sorted(os.listdir(instance_dir)):
+        try:
+            tc_instances.append(instance.Instance(name, connection=connection))
+        except ValueError as e:
+            log.warning("Skipping instance {}, its metadata is unreadable: {}".format(name, e))
+    hosts = set([connection]) | set(config_data.HOSTS)
+    hosts |= set(tc_instance.connection for tc_instance in tc_instances)
+    host_domains = scheduler.map_hosts(instance._list_domains, hosts)
+    reaped = []
+
+    for tc_instance in tc_instances:
+        name = tc_instance.name
+        path = tc_instance.path
+        domains = host_domains[tc_instance.connection]
+
+        if domains is None:
+            # the host is down, its instances may be fine
+            continue
+
+        try:
+            if expired(tc_instance.metadata, now):
+                log.info("{} instance {}, its time to live is "
+                         "over".format('Would remove' if dry_run else 'Removing', name))
+                if not dry_run:
+                    tc_instance.remove(autostop=True)
+                reaped.append(name)
+
+            elif name not in domains and _old_enough(path, now):
+                _remove(path, 'de-synced instance directory', dry_run)
+                if tc_instance.ephemeral and os.path.isdir(tc_instance.disk_path):
+                    _remove(tc_instance.disk_path, 'ephemeral disks', dry_run)
+                reaped.append(path)
+        except (libvirt.libvirtError, TestcloudException, EnvironmentError) as e:
+            log.warning("Could not reap instance {}: {}".format(name, e))
+
+    # disks of ephemeral instances whose directory is gone
+    if os.path.isdir(config_data.EPHEMERAL_DIR):
+        for name in os.listdir(config_data.EPHEMERAL_DIR):
+            path = os.path.join(config_data.EPHEMERAL_DIR, name)
+            if not os.path.isdir(os.path.join(instance_dir, name)) and _old_enough(path, now):
+                _remove(path, 'orphaned ephemeral disks', dry_run)
+                reaped.append(path)
+
+    # addresses of instances whose directory is gone
+    for name in sorted(network._load_registry()):
+        if not os.path.isdir(os.path.join(instance_dir, name)):
+            log.info("{} address of {}".format('Would release' if dry_run else 'Releasing', name))
+            if not dry_run:
+                network.release(name, connection)
+
+    # group networks without instances
+    for name in sorted(network._load_networks()):
+        if not dry_run and network.prune_group_network(name, connection):
+            reaped.append(name)
+
+    # frozen clone bases no instance is built on
+    clone_dir = '{}/clones'.format(config_data.DATA_DIR)
+    if os.path.isdir(clone_dir):
+        in_use = set(base for meta in instance._list_metadata()
+                     for base in meta.get('clone_bases', []))
+        for name in os.listdir(clone_dir):
+            path = os.path.join(clone_dir, name)
+            if path not in in_use and _old_enough(path, now):
+                _remove(path, 'unused clone base', dry_run)
+                reaped.append(path)
+
+    # domains using disks of an instance whose directory is gone
+    for uri in sorted(hosts):
+        if host_domains[uri] is not None:
+            reaped.extend(_reap_domains(uri, instance_dir, dry_run))
+
+    return reaped
+
+
+def _reap_domains(connection, instance_dir, dry_run):
+    """Remove domains of a host using disks of instances whose directory is gone.
+
+    :returns: list of names of the removed domains
+    """
+
+    reaped = []
+    for domain in util.open_connection(connection).listAllDomains():
+        try:
+            owners = set(_testcloud_disk(disk) for disk in _domain_disks(domain))
+            owners.discard(None)
+            # look at the disk again, the instance may have been created
+            # since listing the instance directories
+            if not owners or any(os.path.isdir(os.path.join(instance_dir, owner))
+                                 for owner in owners):
+                continue
+
+            log.info("{} orphaned domain {}".format('Would remove' if dry_run else 'Removing',
+                                                    domain.name()))
+            if not dry_run:
+                if domain.isActive():
+                    domain.destroy()
+                if domain.isPersistent():
+                    domain.undefineFlags(libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE |
+                                         libvirt.VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA)
+            reaped.append(domain.name())
+        except libvirt.libvirtError as e:
+            if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                # the domain disappeared in the meantime, just ignore
+                continue
+            raise e
+
+    return reaped
+
+
+def run(connection='qemu:///system', interval=None):
+    """Keep reaping every ``interval`` seconds, until interrupted. A failing
+    run is logged and the next one happens as usual.
+
+    :param str connection: libvirt connection uri
+    :param int interval: seconds between runs, defaults to the
+                         ``REAPER_INTERVAL`` config value
+    """
+
+    interval = config_data.REAPER_INTERVAL if interval is None else interval
+
+    while True:
+        try:
+            reap(connection)
+        except (libvirt.libvirtError, TestcloudException, EnvironmentError, ValueError) as e:
+            log.warning("Reaping failed: {}".format(e))
+        time.sleep(interval)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+"""
+Placement of instances on a pool of hypervisors. New instances go to the least
+loaded host listed in ``HOSTS`` and remember it in their metadata, so later
+operations on them are routed to that host.
+"""
+
+import logging
+from multiprocessing.pool import ThreadPool
+
+import libvirt
+
+from . import config
+from . import util
+from .exceptions import TestcloudInstanceError
+
+config_data = config.lazy_config()
+
+log = logging.getLogger('testcloud.scheduler')
+
+
+def map_hosts(func, hosts):
+    """Call ``func`` for several hosts at once.
+
+    :param func: callable taking a libvirt connection uri
+    :param hosts: libvirt connection uris
+    :returns: dict of uri -> result of ``func``, ``None`` for hosts which
+              could not be reached
+    """
+
+    hosts = sorted(set(hosts))
+
+    def call_one(uri):
+        try:
+            return uri, func(uri)
+        except libvirt.libvirtError as e:
+            log.warning("Could not reach host {}: {}".format(uri, e))
+            return uri, None
+
+    if len(hosts) < 2:
+        return dict(call_one(uri) for uri in hosts)
+
+    pool = ThreadPool(len(hosts))
+    try:
+        return dict(pool.map(call_one, hosts))
+    finally:
+        pool.close()
+
+
+def host_load(uri):
+    """Get the load of a host.
+
+    :param str uri: libvirt connection uri of the host
+    :returns: dict with ``free_ram`` in MiB and the number of running ``instances``
+    """
+
+    conn = util.open_connection(uri)
+    return {'free_ram': conn.getFreeMemory() // (1024 * 1024),
+            'instances': len(conn.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE))}
+
+
+def pick_host(loads, ram):
+    """Pick the least loaded host with enough free memory for an instance:
+    the one running the fewest domains, the one with the most free memory
+    among equally busy hosts.
+
+    :param dict loads: uri -> result of :py:func:`host_load` or ``None``
+    :param int ram: memory of the instance, in MiB
+    :returns: uri of the host or ``None`` if no host fits the instance
+    """
+
+    candidates = [(load['instances'], -load['free_ram'], uri)
+                  for uri, load in loads.items()
+                  if load is not None and load['free_ram'] >= ram]
+    if not candidates:
+        return None
+    return min(candidates)[2]
+
+
+def schedule(ram, hosts=None):
+    """Pick the host of the pool a new instance should run on.
+
+    :param int ram: memory of the instance, in MiB
+    :param list hosts: libvirt connection uris, defaults to ``HOSTS``
+    :returns: uri of the host
+    :raises TestcloudInstanceError: if no host has enough free memory
+    """
+
+    hosts = config_data.HOSTS if hosts is None else hosts
+    uri = pick_host(map_hosts(host_load, hosts), ram)
+    if uri is None:
+        raise TestcloudInstanceError("None of the hosts {} has {} MiB of memory "
+                                     "free".format(', '.join(hosts), ram))
+
+    log.debug("Scheduled instance on {}".format(uri))
+    return uri
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+"""
+Running commands in instances over SSH. Every instance gets one persistent
+OpenSSH master connection which all commands are multiplexed over, so only the
+first command pays for the SSH handshake and authentication.
+"""
+
+import os
+import sys
+import logging
+import threading
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+from . import config
+from . import trace
+from .exceptions import TestcloudInstanceError
+
+config_data = config.lazy_config()
+
+log = logging.getLogger('testcloud.ssh')
+
+
+class SSHConnection(object):
+    """A multiplexed SSH connection to an instance. The master connection is
+    opened by the first command and kept alive for ``SSH_CONTROL_PERSIST``
+    seconds after the last one, also across testcloud invocations.
+    """
+
+    def __init__(self, name, ip=None):
+        """
+        :param str name: name of the instance
+        :param str ip: address of the instance, read from the ``ip`` file of the
+                       instance (see :py:meth:`testcloud.instance.Instance.create_ip_file`)
+                       if not given
+        :raises TestcloudInstanceError: if the address of the instance is unknown
+        """
+
+        self.name = name
+        self.path = '{}/instances/{}'.format(config_data.DATA_DIR, name)
+        self.control_path = '{}/ssh-control'.format(self.path)
+
+        if ip is None:
+            try:
+                with open('{}/ip'.format(self.path), 'r') as ip_file:
+                    ip = ip_file.read().strip()
+            except IOError:
+                pass
+        if not ip:
+            raise TestcloudInstanceError("IP address of instance {} is not known".format(name))
+        self.ip = ip
+
+    def _ssh_command(self, command):
+        """Build the ssh command line running ``command`` in the instance."""
+
+        ssh = ['ssh',
+               '-o', 'ControlMaster=auto',
+               '-o', 'ControlPath={}'.format(self.control_path),
+               '-o', 'ControlPersist={}'.format(config_data.SSH_CONTROL_PERSIST),
+               '-o', 'StrictHostKeyChecking=no',
+               '-o', 'UserKnownHostsFile=/dev/null',
+               '-o', 'LogLevel=ERROR']
+
+        if config_data.SSH_KEY:
+            ssh = ssh + ['-i', config_data.SSH_KEY, '-o', 'BatchMode=yes']
+        else:
+            # only the master connection authenticates, sshpass reads the
+            # password from the SSHPASS environment variable
+            ssh = ['sshpass', '-e'] + ssh + ['-o', 'PubkeyAuthentication=no']
+
+        return ssh + ['{}@{}'.format(config_data.SSH_USER, self.ip), '--',
+                      ' '.join(quote(arg) for arg in command)]
+
+    def popen(self, command, **kwargs):
+        """Start ``command`` in the instance.
+
+        :param list command: command and its arguments
+        :param kwargs: passed on to :py:class:`subprocess.Popen`
+        :returns: :py:class:`subprocess.Popen` of the ssh process
+        """
+
+        env = dict(os.environ, SSHPASS=config_data.PASSWORD)
+        return subprocess.Popen(self._ssh_command(command), env=env, **kwargs)
+
+    def run(self, command, output=None, prefix=None, lock=None):
+        """Run ``command`` in the instance, streaming its output.
+
+        :param list command: command and its arguments
+        :param output: file to stream stdout and stderr of the command to,
+                       ``sys.stdout`` if not given
+        :param str prefix: prepended to every line of output
+        :param lock: lock held while writing a line to ``output``
+        :returns: exit code of the command
+        """
+
+        output = sys.stdout if output is None else output
+        lock = threading.Lock() if lock is None else lock
+        prefix = prefix or ''
+
+        with trace.span('ssh.run', 'subprocess', instance=self.name):
+            proc = self.popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            for line in iter(proc.stdout.readline, b''):
+                with lock:
+                    output.write(prefix + line.decode('utf-8', 'replace'))
+                    output.flush()
+            proc.stdout.close()
+
+            return proc.wait()
+
+    def close(self):
+        """Close the master connection."""
+
+        if os.path.exists(self.control_path):
+            subprocess.call(['ssh', '-o', 'ControlPath={}'.format(self.control_path),
+                             '-O', 'exit', self.ip],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def run_parallel(names, command, workers=None, output=None):
+    """Run ``command`` in several instances at once, with at most ``workers``
+    commands running concurrently. Output lines are prefixed with the name of
+    the instance they come from.
+
+    :param list names: names of the instances
+    :param list command: command and its arguments
+    :param int workers: maximum number of concurrent commands, defaults to the
+                        ``SSH_WORKERS`` config value
+    :param output: file to stream output to, ``sys.stdout`` if not given
+    :returns: dict of instance name -> exit code, -1 if the command could not
+              be run at all
+    """
+
+    workers = config_data.SSH_WORKERS if workers is None else workers
+    lock = threading.Lock()
+    width = max(len(name) for name in names) if names else 0
+
+    def run_one(name):
+        try:
+            connection = SSHConnection(name)
+        except TestcloudInstanceError as e:
+            log.error(str(e))
+            return name, -1
+        return name, connection.run(command, output, '{} | '.format(name.ljust(width)), lock)
+
+    pool = ThreadPool(min(workers, len(names)) or 1)
+    try:
+        return dict(pool.map(run_one, names))
+    finally:
+        pool.close()
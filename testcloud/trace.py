@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2015, Red Hat, Inc.
+# License: GPL-2.0+ <http://spdx.org/licenses/GPL-2.0+>
+# See the LICENSE file for more details on Licensing
+
+"""
+Timing spans around the phases of image and instance handling. Finished spans
+are handed to registered callbacks and, when recording, kept for export in the
+Chrome trace-event format (viewable in ``chrome://tracing`` or Perfetto).
+"""
+
+import os
+import json
+import time
+import logging
+import functools
+import threading
+import contextlib
+import subprocess
+
+log = logging.getLogger('testcloud.trace')
+
+_callbacks = []
+_events = []
+_recording = False
+_lock = threading.Lock()
+
+
+def add_callback(callback):
+    """Register a function to be called for every finished span, with the
+    arguments ``(name, category, start, duration, args)``. ``start`` is a unix
+    timestamp and ``duration`` in seconds.
+
+    :param callback: callable to register
+    """
+
+    _callbacks.append(callback)
+
+
+def remove_callback(callback):
+    """Unregister a function registered with :py:func:`add_callback`."""
+
+    _callbacks.remove(callback)
+
+
+def start_recording():
+    """Start keeping finished spans for :py:func:`write`."""
+
+    global _recording
+    _recording = True
+
+
+def clear():
+    """Drop all recorded spans."""
+
+    with _lock:
+        del _events[:]
+
+
+def events():
+    """Get the recorded spans as Chrome trace events.
+
+    :returns: list of trace event dicts
+    """
+
+    with _lock:
+        return list(_events)
+
+
+@contextlib.contextmanager
+def span(name, category='testcloud', **args):
+    """Time the ``with`` block as a span named ``name``.
+
+    :param str name: name of the span
+    :param str category: category of the span, like ``subprocess``
+    :param args: extra details attached to the span
+    """
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        duration = time.time() - start
+
+        if _recording:
+            event = {'name': name,
+                     'cat': category,
+                     'ph': 'X',
+                     'ts': int(start * 1000000),
+                     'dur': int(duration * 1000000),
+                     'pid': os.getpid(),
+                     'tid': threading.current_thread().ident,
+                     'args': args}
+            with _lock:
+                _events.append(event)
+
+        for callback in _callbacks:
+            try:
+                callback(name, category, start, duration, args)
+            except Exception:
+                log.exception("trace callback failed for span {}".format(name))
+
+
+def traced(name, category='testcloud'):
+    """Decorator timing every call of the decorated function as a span.
+
+    :param str name: name of the span
+    :param str category: category of the span
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def call(command, **kwargs):
+    """Run ``command`` with :py:func:`subprocess.call`, timing its wall time.
+
+    :param list command: command and its arguments
+    :returns: return code of the command
+    """
+
+    with span(os.path.basename(command[0]), 'subprocess', command=' '.join(command)):
+        return subprocess.call(command, **kwargs)
+
+
+def write(path):
+    """Write the recorded spans to ``path`` in Chrome trace-event format.
+
+    :param str path: path of the file to write
+    """
+
+    with open(path, 'w') as trace_file:
+        json.dump({'traceEvents': events(), 'displayTimeUnit': 'ms'}, trace_file)
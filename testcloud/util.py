@@ -10,21 +10,65 @@ This module contains helper functions for testcloud.
 
 import subprocess
 import logging
+import contextlib
+import fcntl
+import threading
 
 import random
 import libvirt
 import xml.etree.ElementTree as ET
 
 from . import config
+from . import trace
+from .exceptions import TestcloudInstanceError
 
 log = logging.getLogger('testcloud.util')
-config_data = config.get_config()
+config_data = config.lazy_config()
+
+#: name of the virtio-serial channel of the qemu guest agent
+GUEST_AGENT_CHANNEL = 'org.qemu.guest_agent.0'
+
+# open libvirt connections by (uri, readonly), None unless kept
+_connections = None
+_connections_lock = threading.Lock()
+
+
+def keep_connections():
+    """Keep libvirt connections open once made and reuse them, instead of
+    connecting for every operation. For long running processes like testcloudd.
+    """
+
+    global _connections
+    with _connections_lock:
+        if _connections is None:
+            _connections = {}
+
+
+def open_connection(uri, readonly=False):
+    """Open a libvirt connection, or reuse an open one after
+    :py:func:`keep_connections`. Connections which went away (libvirtd
+    restarted) are replaced.
+
+    :param str uri: libvirt connection uri
+    :param bool readonly: whether a read only connection is enough
+    """
+
+    opener = libvirt.openReadOnly if readonly else libvirt.open
+    if _connections is None:
+        return opener(uri)
+
+    with _connections_lock:
+        conn = _connections.get((uri, readonly))
+        if conn is None or not conn.isAlive():
+            conn = opener(uri)
+            _connections[(uri, readonly)] = conn
+        return conn
 
 
 def get_vm_xml(instance_name, connection='qemu:///system'):
     """Query virsh for the xml of an instance by name."""
 
-    con = libvirt.openReadOnly(connection)
+    con = open_connection(connection, readonly=True)
     try:
         domain = con.lookupByName(instance_name)
 
@@ -48,11 +92,53 @@ def find_mac(xml_string):
     return macs
 
 
+def find_guest_agent(xml_string):
+    """Pass in a virsh xmldump and return the guest agent channel target, if
+    the domain has one. Its ``state`` attribute is ``connected`` while the
+    agent in the guest is running.
+    """
+
+    xml_data = ET.fromstring(xml_string)
+
+    for target in xml_data.findall("./devices/channel/target"):
+        if target.get('name') == GUEST_AGENT_CHANNEL:
+            return target
+    return None
+
+
+def find_ip_from_agent(instance_name, connection='qemu:///system'):
+    """Ask the qemu guest agent of an instance for its IPv4 address.
+
+    :param str instance_name: name of the instance (as used by libvirt)
+    :param str connection: name of the libvirt connection uri
+    :returns: IPv4 address of the first non-loopback interface, or ``None`` if
+              the guest has no address yet
+    :raises TestcloudInstanceError: if the guest agent is not available
+    """
+
+    con = open_connection(connection)
+    try:
+        domain = con.lookupByName(instance_name)
+        interfaces = domain.interfaceAddresses(libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_AGENT)
+    except libvirt.libvirtError as e:
+        raise TestcloudInstanceError("Guest agent of {} is not available: "
+                                     "{}".format(instance_name, e))
+
+    for name, interface in sorted(interfaces.items()):
+        if name == 'lo':
+            continue
+        for address in interface.get('addrs') or []:
+            if address['type'] == libvirt.VIR_IP_ADDR_TYPE_IPV4:
+                return address['addr']
+    return None
+
+
 def find_ip_from_mac(mac):
     """Look through ``arp -an`` output for the IP of the provided MAC address.
     """
 
-    arp_list = subprocess.check_output(["arp", "-an"]).split("\n")
+    with trace.span('arp', 'subprocess', command='arp -an'):
+        arp_list = subprocess.check_output(["arp", "-an"]).split("\n")
     for entry in arp_list:
         if mac in entry:
             return entry.split()[1][1:-1]
@@ -63,6 +149,23 @@ def generate_mac_address():
 
     hex_mac = [0x52, 0x54, 0x00]  # These 3 are the prefix libvirt uses
     hex_mac += [random.randint(0x00, 0xff) for x in range(3)]
-    mac = ':'.join(hex(x)[2:] for x in hex_mac)
+    mac = ':'.join('{:02x}'.format(x) for x in hex_mac)
 
     return mac
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on ``path`` for the duration of the ``with``
+    block. The lock is shared by all testcloud processes on the host, the file
+    is created if it doesn't exist yet.
+
+    :param str path: path of the lock file
+    """
+
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)